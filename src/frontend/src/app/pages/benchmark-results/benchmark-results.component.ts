@@ -12,8 +12,23 @@
  * GNU Affero General Public License for more details.
  */
 import { Component, OnDestroy, OnInit } from '@angular/core';
-import { catchError, EMPTY, finalize, Observable, Subscription, take, timer } from 'rxjs';
-import { BenchmarkService, BenchOpResult, BenchResult } from 'src/app/shared/services/api/benchmark.service';
+import { catchError, EMPTY, finalize, Subscription, take, timer } from 'rxjs';
+import {
+  BenchmarkService, BenchOpResult, BenchResult, BenchSeries, BenchSeriesPoint
+} from 'src/app/shared/services/api/benchmark.service';
+
+
+// the fields we show; we don't need the duration in seconds.
+const RESULT_FIELDS = [
+  "version", "date", "threads", "workload", "objsize", "objects",
+  "duration_str", "ops",
+];
+const RESULTS_PAGE_SIZE = 500;
+// series are downsampled by the server to at most this many points, which
+// is all a sparkline this wide can show anyway.
+const SERIES_POINTS = 60;
+const SPARKLINE_WIDTH = 120;
+const SPARKLINE_HEIGHT = 30;
 
 
 type TestResult = {
@@ -22,6 +37,14 @@ type TestResult = {
 };
 
 
+type SeriesLine = {
+  op: string;
+  threads: number;
+  // polyline points, for ops per second over time.
+  points: string;
+};
+
+
 type TestType = {
   workload: string;
   num_objects: number;
@@ -38,16 +61,20 @@ type TestType = {
 })
 export class BenchmarkResultsComponent implements OnInit, OnDestroy {
 
-  private resultsData: Observable<BenchResult[]>;
   private resultsSubscription?: Subscription;
   private resultsTimerSubscription?: Subscription;
+  private seriesSubscription?: Subscription;
+  // id of the last result we have; we only ask for those after it.
+  private cursor?: number;
 
   public results: BenchResult[] = [];
   public per_test_type: {[id: string]: TestType} = {};
+  // by workload and object size.
+  public series: {[id: string]: SeriesLine[]} = {};
+  public readonly sparklineWidth = SPARKLINE_WIDTH;
+  public readonly sparklineHeight = SPARKLINE_HEIGHT;
 
-  public constructor(private benchSvc: BenchmarkService) {
-    this.resultsData = benchSvc.getResults();
-  }
+  public constructor(private benchSvc: BenchmarkService) { }
 
   public ngOnInit(): void {
     this.reloadResults();
@@ -56,11 +83,12 @@ export class BenchmarkResultsComponent implements OnInit, OnDestroy {
   public ngOnDestroy(): void {
     this.resultsTimerSubscription?.unsubscribe();
     this.resultsSubscription?.unsubscribe();
+    this.seriesSubscription?.unsubscribe();
   }
 
   private updateResults(data: BenchResult[]): void {
 
-    const per_test_type: {[id: string]: TestType} = {};
+    const per_test_type: {[id: string]: TestType} = { ...this.per_test_type };
     data.forEach((res: BenchResult) => {
       const typestr = 
         `${res.workload}-${res.objsize}-${res.objects}-${res.duration_str}`;
@@ -87,18 +115,28 @@ export class BenchmarkResultsComponent implements OnInit, OnDestroy {
     });
 
     this.per_test_type = per_test_type;
-    this.results = data;
+    this.results = this.results.concat(data);
+    if (data.length > 0) {
+      this.cursor = data[data.length - 1].id;
+    }
   }
 
   private reloadResults(): void {
-    this.resultsSubscription = this.resultsData
+    // a full page means there may be more already, so don't wait for them.
+    let delay = 30000;
+    this.resultsSubscription = this.benchSvc
+      .getResults({
+        cursor: this.cursor,
+        limit: RESULTS_PAGE_SIZE,
+        fields: RESULT_FIELDS,
+      })
       .pipe(
         catchError((err) => {
           console.error("error loading benchmark results: ", err);
           return EMPTY;
         }),
         finalize(() => {
-          this.resultsTimerSubscription = timer(30000)
+          this.resultsTimerSubscription = timer(delay)
             .pipe(take(1))
             .subscribe(() => {
               this.resultsSubscription!.unsubscribe();
@@ -108,9 +146,61 @@ export class BenchmarkResultsComponent implements OnInit, OnDestroy {
       )
       .subscribe((data: BenchResult[]) => {
         this.updateResults(data);
+        if (data.length === RESULTS_PAGE_SIZE) {
+          delay = 0;
+        } else if (data.length > 0) {
+          this.reloadSeries();
+        }
       });
   }
 
+  private reloadSeries(): void {
+    this.seriesSubscription?.unsubscribe();
+    this.seriesSubscription = this.benchSvc
+      .getSeries({ points: SERIES_POINTS })
+      .pipe(
+        catchError((err) => {
+          console.error("error loading benchmark series: ", err);
+          return EMPTY;
+        })
+      )
+      .subscribe((data: BenchSeries[]) => {
+        const series: {[id: string]: SeriesLine[]} = {};
+        data.forEach((s: BenchSeries) => {
+          const key = `${s.workload}-${s.objsize}`;
+          if (!(key in series)) {
+            series[key] = [];
+          }
+          series[key].push({
+            op: s.op,
+            threads: s.threads,
+            points: this.toPolyline(s.points),
+          });
+        });
+        this.series = series;
+      });
+  }
+
+  private toPolyline(points: BenchSeriesPoint[]): string {
+    const times = points.map((p) => new Date(p.date).getTime());
+    const values = points.map((p) => p.ops_per_sec);
+    const first = Math.min(...times);
+    const timeRange = Math.max(...times) - first || 1;
+    const min = Math.min(...values);
+    const valueRange = Math.max(...values) - min || 1;
+
+    return points.map((_, i: number) => {
+      const x = (times[i] - first) / timeRange * SPARKLINE_WIDTH;
+      const y =
+        SPARKLINE_HEIGHT - (values[i] - min) / valueRange * SPARKLINE_HEIGHT;
+      return `${x.toFixed(1)},${y.toFixed(1)}`;
+    }).join(" ");
+  }
+
+  public seriesFor(type: TestType): SeriesLine[] {
+    return this.series[`${type.workload}-${type.object_size}`] ?? [];
+  }
+
   public toSI(value: number): string {
     const units = ["B", "kB", "MB", "GB", "TB", "PB", "WOOT"];
 
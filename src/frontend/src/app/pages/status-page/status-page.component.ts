@@ -16,17 +16,26 @@ import {
   catchError,
   EMPTY,
   finalize,
-  Observable,
   Subscription,
   take,
   timer
 } from 'rxjs';
+import {
+  EventsService,
+  TstrEvent
+} from 'src/app/shared/services/api/events.service';
 import {
   BranchEntry,
+  BranchRef,
   CommitEntry,
+  HeadsDelta,
   HeadsService
 } from 'src/app/shared/services/api/heads.service';
-import { WorkqueueService, WQItem } from 'src/app/shared/services/api/workqueue.service';
+import {
+  WorkqueueService,
+  WQDelta,
+  WQItem
+} from 'src/app/shared/services/api/workqueue.service';
 import { BenchmarkEnum, CommitStatusEntry, StateEnum, StatusEntry } from './status-page.types';
 
 @Component({
@@ -57,45 +66,81 @@ export class StatusPageComponent implements OnInit, OnDestroy {
     }
   ];
 
-  private headsData: Observable<BranchEntry[]>;
+  // We only ask for what changed since the last revision we got; the
+  // first time around, revision 0 gets us everything.
+  private branches = new Map<string, BranchEntry>();
+  private headsRevision: number = 0;
   private headsSubscription?: Subscription;
   private headsTimerSubscription?: Subscription;
 
-  private wqData: Observable<WQItem[]>;
+  private wqEntries = new Map<number, WQItem>();
+  private wqRevision: number = 0;
   private wqSubscription?: Subscription;
   private wqTimerSubscription?: Subscription;
 
   public wqItems: WQItem[] = [];
 
+  // Changes are pushed to us as they happen, and we fetch them right away;
+  // we still poll every so often, in case we miss something.
+  private eventsSubscription?: Subscription;
+
   constructor(
     private headsSvc: HeadsService,
-    private wqSvc: WorkqueueService
-  ) {
-    this.headsData = headsSvc.getHeads();
-    this.wqData = wqSvc.getItems();
-  }
+    private wqSvc: WorkqueueService,
+    private eventsSvc: EventsService
+  ) { }
 
   ngOnInit(): void {
     this.reloadHeads();
     this.reloadWorkqueue();
+    this.eventsSubscription = this.eventsSvc.getEvents()
+      .subscribe((event: TstrEvent) => {
+        if (event.what === "new_head" || event.what === "closed_branch") {
+          this.refreshHeads();
+        } else if (event.what === "wq_state") {
+          this.refreshWorkqueue();
+        } else if (event.what === "dropped") {
+          this.refreshHeads();
+          this.refreshWorkqueue();
+        }
+      });
   }
 
   ngOnDestroy(): void {
+    this.eventsSubscription?.unsubscribe();
     this.headsTimerSubscription?.unsubscribe();
     this.headsSubscription?.unsubscribe();
     this.wqTimerSubscription?.unsubscribe();
     this.wqSubscription?.unsubscribe();
   }
 
+  private refreshHeads(): void {
+    if (this.headsSubscription !== undefined
+      && !this.headsSubscription.closed) {
+      // already on its way.
+      return;
+    }
+    this.headsTimerSubscription?.unsubscribe();
+    this.reloadHeads();
+  }
+
+  private refreshWorkqueue(): void {
+    if (this.wqSubscription !== undefined && !this.wqSubscription.closed) {
+      return;
+    }
+    this.wqTimerSubscription?.unsubscribe();
+    this.reloadWorkqueue();
+  }
+
   private reloadHeads(): void {
-    this.headsSubscription = this.headsData
+    this.headsSubscription = this.headsSvc.getHeadsSince(this.headsRevision)
       .pipe(
         catchError((err) => {
           console.error("error loading heads data: ", err);
           return EMPTY;
         }),
         finalize(() => {
-          this.headsTimerSubscription = timer(30000)
+          this.headsTimerSubscription = timer(60000)
             .pipe(take(1))
             .subscribe(() => {
               this.headsSubscription!.unsubscribe();
@@ -103,9 +148,20 @@ export class StatusPageComponent implements OnInit, OnDestroy {
             });
         })
       )
-      .subscribe((data: BranchEntry[]) => {
+      .subscribe((delta: HeadsDelta) => {
+        if (delta.full) {
+          this.branches.clear();
+        }
+        delta.branches.forEach((entry: BranchEntry) => {
+          this.branches.set(`${entry.repo}/${entry.name}`, entry);
+        });
+        delta.removed.forEach((ref: BranchRef) => {
+          this.branches.delete(`${ref.repo}/${ref.name}`);
+        });
+        this.headsRevision = delta.revision;
+
         let entries: StatusEntry[] = [];
-        data.forEach((entry => {
+        this.branches.forEach((entry => {
           let entryType: "pr" | "branch" = 
             (entry.is_pull_request ? "pr" : "branch");
           let entryName = entry.name;
@@ -128,14 +184,14 @@ export class StatusPageComponent implements OnInit, OnDestroy {
   }
 
   private reloadWorkqueue(): void {
-    this.wqSubscription = this.wqData
+    this.wqSubscription = this.wqSvc.getItemsSince(this.wqRevision)
       .pipe(
         catchError((err) => {
           console.error("error loading workqueue data: ", err);
           return EMPTY;
         }),
         finalize(() => {
-          this.wqTimerSubscription = timer(10000)
+          this.wqTimerSubscription = timer(60000)
             .pipe(take(1))
             .subscribe(() => {
               this.wqSubscription!.unsubscribe();
@@ -143,8 +199,20 @@ export class StatusPageComponent implements OnInit, OnDestroy {
             });
         })
       )
-      .subscribe((data: WQItem[]) => {
-        this.wqItems = data;
+      .subscribe((delta: WQDelta) => {
+        if (delta.full) {
+          this.wqEntries.clear();
+        }
+        delta.items.forEach((item: WQItem) => {
+          this.wqEntries.set(item.id, item);
+        });
+        delta.removed.forEach((id: number) => {
+          this.wqEntries.delete(id);
+        });
+        this.wqRevision = delta.revision;
+        this.wqItems = Array.from(this.wqEntries.values()).sort(
+          (a: WQItem, b: WQItem) => a.id - b.id
+        );
       });
   }
 
@@ -11,7 +11,7 @@
  * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
  * GNU Affero General Public License for more details.
  */
-import { HttpClient } from '@angular/common/http';
+import { HttpClient, HttpParams } from '@angular/common/http';
 import { Injectable } from '@angular/core';
 import { Observable } from 'rxjs';
 
@@ -38,6 +38,102 @@ export type BenchResult = {
   ops: BenchOpResult[];
 };
 
+export type BenchResultsQuery = {
+  version?: string;
+  workload?: string;
+  objsize?: string;
+  threads?: number;
+  since?: Date;
+  until?: Date;
+  limit?: number;
+  cursor?: number;
+  fields?: string[];
+};
+
+export type BenchTrendStats = {
+  mean: number;
+  min: number;
+  max: number;
+  variance?: number;
+};
+
+export type BenchTrend = {
+  workload: string;
+  objsize: string;
+  threads: number;
+  op: string;
+  bucket: string;
+  count: number;
+  ops_per_sec: BenchTrendStats;
+  objs_per_sec: BenchTrendStats;
+  bytes_per_sec: BenchTrendStats;
+};
+
+export type BenchTrendsQuery = {
+  workload?: string;
+  objsize?: string;
+  threads?: number;
+  op?: string;
+  // days, as 'YYYY-MM-DD'.
+  since?: string;
+  until?: string;
+};
+
+export type BenchSeriesPoint = {
+  result: number;
+  version: string;
+  date: Date;
+  ops_per_sec: number;
+  objs_per_sec: number;
+  bytes_per_sec: number;
+};
+
+export type BenchSeries = {
+  workload: string;
+  objsize: string;
+  threads: number;
+  op: string;
+  points: BenchSeriesPoint[];
+};
+
+export type BenchSeriesQuery = {
+  workload?: string;
+  objsize?: string;
+  threads?: number;
+  op?: string;
+  since?: Date;
+  until?: Date;
+  // downsample each series to this many points, by 'metric'.
+  points?: number;
+  metric?: "ops_per_sec" | "objs_per_sec" | "bytes_per_sec";
+};
+
+export type BenchRegression = {
+  id: number;
+  result: number;
+  version: string;
+  date: Date;
+  workload: string;
+  objsize: string;
+  threads: number;
+  op: string;
+  metric: string;
+  baseline_median: number;
+  recent_median: number;
+  change: number;
+  p_value: number;
+  detected: Date;
+};
+
+export type BenchRegressionsQuery = {
+  workload?: string;
+  objsize?: string;
+  threads?: number;
+  op?: string;
+  since?: Date;
+  limit?: number;
+};
+
 
 @Injectable({
   providedIn: 'root'
@@ -46,7 +142,47 @@ export class BenchmarkService {
 
   constructor(private http: HttpClient) { }
 
-  getResults(): Observable<BenchResult[]> {
-    return this.http.get<BenchResult[]>("/api/bench/results");
+  getResults(query: BenchResultsQuery = {}): Observable<BenchResult[]> {
+    return this.http.get<BenchResult[]>(
+      "/api/bench/results", { params: this.toParams(query) }
+    );
+  }
+
+  getSeries(query: BenchSeriesQuery = {}): Observable<BenchSeries[]> {
+    return this.http.get<BenchSeries[]>(
+      "/api/bench/series", { params: this.toParams(query) }
+    );
+  }
+
+  getTrends(query: BenchTrendsQuery = {}): Observable<BenchTrend[]> {
+    return this.http.get<BenchTrend[]>(
+      "/api/bench/trends", { params: this.toParams(query) }
+    );
+  }
+
+  getRegressions(
+    query: BenchRegressionsQuery = {}
+  ): Observable<BenchRegression[]> {
+    return this.http.get<BenchRegression[]>(
+      "/api/bench/regressions", { params: this.toParams(query) }
+    );
+  }
+
+  private toParams(query: object): HttpParams {
+    let params = new HttpParams();
+    Object.entries(query).forEach(([key, value]) => {
+      if (value === undefined) {
+        return;
+      } else if (value instanceof Date) {
+        params = params.set(key, value.toISOString());
+      } else if (Array.isArray(value)) {
+        value.forEach((v: string) => {
+          params = params.append(key, v);
+        });
+      } else {
+        params = params.set(key, value);
+      }
+    });
+    return params;
   }
 }
@@ -0,0 +1,63 @@
+/* 
+ * tstr - testing stuff
+ * Copyright (C) 2022 SUSE LLC
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ */
+import { Injectable, NgZone } from '@angular/core';
+import { Observable } from 'rxjs';
+
+
+export type TstrEvent = {
+  what: string;
+  when?: Date;
+  data: any;
+};
+
+// Events the server sends; 'dropped' means some were missed, and state
+// should be fetched again.
+const EVENT_TYPES = [
+  "new_head",
+  "closed_branch",
+  "wq_state",
+  "new_results",
+  "new_regression",
+  "dropped",
+];
+
+@Injectable({
+  providedIn: 'root'
+})
+export class EventsService {
+
+  constructor(private zone: NgZone) { }
+
+  // Events as they happen. The browser reconnects on its own should the
+  // stream be interrupted, and we report that as 'dropped'.
+  getEvents(): Observable<TstrEvent> {
+    return new Observable<TstrEvent>((subscriber) => {
+      const source = new EventSource("/api/events/");
+      EVENT_TYPES.forEach((what: string) => {
+        source.addEventListener(what, (msg: MessageEvent) => {
+          const data = JSON.parse(msg.data);
+          this.zone.run(() => {
+            subscriber.next(what === "dropped" ? { what, data } : data);
+          });
+        });
+      });
+      source.onerror = () => {
+        this.zone.run(() => {
+          subscriber.next({ what: "dropped", data: {} });
+        });
+      };
+      return () => source.close();
+    });
+  }
+}
@@ -11,7 +11,7 @@
  * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
  * GNU Affero General Public License for more details.
  */
-import { HttpClient } from '@angular/common/http';
+import { HttpClient, HttpParams } from '@angular/common/http';
 import { Injectable } from '@angular/core';
 import { Observable } from 'rxjs';
 
@@ -22,6 +22,7 @@ export type CommitEntry = {
 };
 
 export type BranchEntry = {
+  repo: string;
   name: string;
   source: string;
   commits: CommitEntry[];
@@ -30,6 +31,19 @@ export type BranchEntry = {
   state: string;
 };
 
+export type BranchRef = {
+  repo: string;
+  name: string;
+};
+
+export type HeadsDelta = {
+  revision: number;
+  // if true, 'branches' are all of them, and replace what we had.
+  full: boolean;
+  branches: BranchEntry[];
+  removed: BranchRef[];
+};
+
 @Injectable({
   providedIn: 'root'
 })
@@ -40,4 +54,9 @@ export class HeadsService {
   getHeads(): Observable<BranchEntry[]> {
     return this.http.get<BranchEntry[]>("/api/heads/");
   }
+
+  getHeadsSince(revision: number): Observable<HeadsDelta> {
+    const params = new HttpParams().set("since", revision);
+    return this.http.get<HeadsDelta>("/api/heads/", { params: params });
+  }
 }
@@ -11,13 +11,14 @@
  * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
  * GNU Affero General Public License for more details.
  */
-import { HttpClient } from '@angular/common/http';
+import { HttpClient, HttpParams } from '@angular/common/http';
 import { Injectable } from '@angular/core';
 import { Observable } from 'rxjs';
 
 
 export type WQJob = {
   id: number;
+  repo: string;
   sha: string;
   branch: string;
   when: Date;
@@ -30,6 +31,16 @@ export type WQItem = {
   job: WQJob;
   when: Date;
   state: string;
+  priority: number;
+  attempts: number;
+};
+
+export type WQDelta = {
+  revision: number;
+  // if true, 'items' are all of them, and replace what we had.
+  full: boolean;
+  items: WQItem[];
+  removed: number[];
 };
 
 @Injectable({
@@ -39,7 +50,27 @@ export class WorkqueueService {
 
   constructor(private http: HttpClient) { }
 
-  getItems(): Observable<WQItem[]> {
-    return this.http.get<WQItem[]>("/api/wq/");
+  getItems(
+    limit?: number, cursor?: number, states?: string[]
+  ): Observable<WQItem[]> {
+    let params = new HttpParams();
+    if (limit !== undefined) {
+      params = params.set("limit", limit);
+    }
+    if (cursor !== undefined) {
+      params = params.set("cursor", cursor);
+    }
+    states?.forEach((state: string) => {
+      params = params.append("state", state);
+    });
+    return this.http.get<WQItem[]>("/api/wq/", { params: params });
+  }
+
+  getItemsSince(revision: number, states?: string[]): Observable<WQDelta> {
+    let params = new HttpParams().set("since", revision);
+    states?.forEach((state: string) => {
+      params = params.append("state", state);
+    });
+    return this.http.get<WQDelta>("/api/wq/", { params: params });
   }
 }
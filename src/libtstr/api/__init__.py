@@ -13,8 +13,12 @@
 
 from fastapi import Request, Depends, Header, HTTPException
 
+from libtstr.cache import ResponseCache
+from libtstr.events import EventBus
 from libtstr.state import TstrState
 from libtstr.gh import GithubMgr
+from libtstr.regressions import RegressionDetector
+from libtstr.results import ResultsMgr
 from libtstr.wq import WorkQueue
 
 
@@ -22,6 +26,16 @@ async def tstr_state(req: Request) -> TstrState:
     return req.app.state.tstr
 
 
+async def response_cache(
+    state: TstrState = Depends(tstr_state),
+) -> ResponseCache:
+    return state.cache
+
+
+async def eventbus(state: TstrState = Depends(tstr_state)) -> EventBus:
+    return state.events
+
+
 async def githubmgr(state: TstrState = Depends(tstr_state)) -> GithubMgr:
     return state.github
 
@@ -30,6 +44,16 @@ async def workqueue(state: TstrState = Depends(tstr_state)) -> WorkQueue:
     return state.workqueue
 
 
+async def regressions(
+    state: TstrState = Depends(tstr_state),
+) -> RegressionDetector:
+    return state.regressions
+
+
+async def resultsmgr(state: TstrState = Depends(tstr_state)) -> ResultsMgr:
+    return state.results
+
+
 async def access_token_required(
     state: TstrState = Depends(tstr_state), x_token: str = Header()
 ) -> None:
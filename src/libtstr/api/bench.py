@@ -11,15 +11,27 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU Affero General Public License for more details.
 
-from typing import List
-from datetime import datetime as dt
-from fastapi import APIRouter, Depends
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime as dt
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from fastapi.logger import logger
 from pydantic import BaseModel
+from databases.interfaces import Record
+import sqlalchemy
 
-from libtstr.api import access_token_required
+from libtstr.api import (
+    access_token_required,
+    regressions,
+    response_cache,
+    resultsmgr,
+)
+from libtstr.cache import ResponseCache
 from libtstr.benchmark import OpResult, Result
+from libtstr.benchstats import RunningStats, lttb
+from libtstr.db import chunked, database, last_id, row_params, writes
 from libtstr.orm import bench as orm
+from libtstr.regressions import RegressionDetector
+from libtstr.results import ResultsMgr
 
 
 router = APIRouter(prefix="/bench", tags=["benchmark"])
@@ -29,88 +41,653 @@ class NewResultReply(BaseModel):
     id: int
 
 
+class NewResultsReply(BaseModel):
+    ids: List[int]
+
+
 @router.put(
     "/new",
     name="Add new benchmark result.",
     response_model=NewResultReply,
     dependencies=[Depends(access_token_required)],
 )
-async def add_new(result: Result) -> NewResultReply:
-
-    new_entry = await orm.Result.objects.create(
-        version=result.version,
-        date=result.date,
-        duration=result.duration,
-        threads=result.threads,
-        workload=result.details.workload,
-        objsize=result.details.objsize,
-        num_objects=result.details.objects,
-        duration_str=result.details.duration,
-    )
+async def add_new(
+    result: Result,
+    results_mgr: ResultsMgr = Depends(resultsmgr),
+    detector: RegressionDetector = Depends(regressions),
+) -> NewResultReply:
+    ids = await writes.submit(lambda: _create_results([result]))
+    results_mgr.added(ids)
+    await _check_regressions(detector, [result])
+    return NewResultReply(id=ids[0])
+
+
+@router.put(
+    "/bulk",
+    name="Add several new benchmark results.",
+    response_model=NewResultsReply,
+    dependencies=[Depends(access_token_required)],
+)
+async def add_bulk(
+    results: List[Result],
+    results_mgr: ResultsMgr = Depends(resultsmgr),
+    detector: RegressionDetector = Depends(regressions),
+) -> NewResultsReply:
+    if len(results) == 0:
+        return NewResultsReply(ids=[])
+    ids = await writes.submit(lambda: _create_results(results))
+    results_mgr.added(ids)
+    logger.info(f"added {len(ids)} benchmark results")
+    await _check_regressions(detector, results)
+    return NewResultsReply(ids=ids)
+
+
+async def _check_regressions(
+    detector: RegressionDetector, results: List[Result]
+) -> None:
+    """
+    Look for regressions in results that have been stored. This is best
+    effort: the results are there regardless, and failing the request would
+    have clients add them again.
+    """
+    try:
+        await detector.check(results)
+    except Exception as e:
+        logger.exception(f"unable to check results for regressions: {e}")
+
+
+async def _create_results(results: List[Result]) -> List[int]:
+    """
+    Insert results, and then their ops, with bulk inserts. Runs through the
+    write queue, and thus in a transaction, and with no other writers; new
+    rows are read back by id. Returns the new results' ids, in order.
+    """
+    last_result = await last_id(orm.Result.Meta.table)
+    for chunk in chunked(results, row_params(orm.Result.Meta.table)):
+        await orm.Result.objects.bulk_create(
+            [
+                orm.Result(
+                    version=r.version,
+                    date=r.date,
+                    duration=r.duration,
+                    threads=r.threads,
+                    workload=r.details.workload,
+                    objsize=r.details.objsize,
+                    num_objects=r.details.objects,
+                    duration_str=r.details.duration,
+                )
+                for r in chunk
+            ]
+        )
+    ids = await _ids_since(orm.Result.Meta.table, last_result)
+    assert len(ids) == len(results)
+
+    ops: List[Tuple[int, OpResult]] = [
+        (result_id, op) for result_id, r in zip(ids, results) for op in r.ops
+    ]
+    for chunk in chunked(ops, row_params(orm.OpResult.Meta.table)):
+        await orm.OpResult.objects.bulk_create(
+            [
+                orm.OpResult(
+                    result=result_id,
+                    name=op.name,
+                    percent=op.percent,
+                    ops_per_sec=op.ops_per_sec,
+                    objs_per_sec=op.objs_per_sec,
+                    bytes_per_sec=op.bytes_per_sec,
+                )
+                for result_id, op in chunk
+            ]
+        )
+
+    await _update_trends(results)
+    return ids
+
+
+# metrics we keep trends for.
+_trend_metrics = ("ops_per_sec", "objs_per_sec", "bytes_per_sec")
+
+# workload, objsize, threads, op, and day.
+TrendKey = Tuple[str, str, int, str, date]
+
+# Looking up existing trends binds an IN list per key column, each with as
+# many params as there are keys being looked up.
+_TREND_KEY_COLUMNS = 5
+
+# the trend columns that merging results into a trend changes.
+_trend_stat_columns = ("count",) + tuple(
+    f"{m}_{f}" for m in _trend_metrics for f in ("mean", "min", "max", "m2")
+)
+
+
+async def _update_trends(results: List[Result]) -> None:
+    """
+    Merge new results into their trends, one per benchmark shape, op and
+    day. Runs as part of the results' write.
+    """
+    new_stats: Dict[TrendKey, Dict[str, RunningStats]] = {}
+    for r in results:
+        for op in r.ops:
+            key = (
+                r.details.workload,
+                r.details.objsize,
+                r.threads,
+                op.name,
+                r.date.date(),
+            )
+            if key not in new_stats:
+                new_stats[key] = {m: RunningStats() for m in _trend_metrics}
+            for m in _trend_metrics:
+                new_stats[key][m].add(float(getattr(op, m)))
+
+    # Narrow down by each key column, and then pick the exact keys.
+    existing: Dict[TrendKey, orm.ResultTrend] = {}
+    keys = list(new_stats.keys())
+    for chunk in chunked(keys, _TREND_KEY_COLUMNS):
+        for trend in await orm.ResultTrend.objects.filter(
+            (orm.ResultTrend.workload << list({k[0] for k in chunk}))
+            & (orm.ResultTrend.objsize << list({k[1] for k in chunk}))
+            & (orm.ResultTrend.threads << list({k[2] for k in chunk}))
+            & (orm.ResultTrend.op << list({k[3] for k in chunk}))
+            & (orm.ResultTrend.bucket << list({k[4] for k in chunk}))
+        ).all():
+            key = (
+                trend.workload,
+                trend.objsize,
+                trend.threads,
+                trend.op,
+                trend.bucket,
+            )
+            if key in new_stats:
+                existing[key] = trend
+
+    created: List[orm.ResultTrend] = []
+    updated: List[orm.ResultTrend] = []
+    for key, stats in new_stats.items():
+        trend = existing.get(key)
+        if trend is None:
+            workload, objsize, threads, op_name, bucket = key
+            trend = orm.ResultTrend(
+                workload=workload,
+                objsize=objsize,
+                threads=threads,
+                op=op_name,
+                bucket=bucket,
+                count=0,
+                **{
+                    f"{m}_{f}": 0.0
+                    for m in _trend_metrics
+                    for f in ("mean", "min", "max", "m2")
+                },
+            )
+            created.append(trend)
+
+        merged = {m: _trend_stats(trend, m) for m in _trend_metrics}
+        for m, st in merged.items():
+            st.merge(stats[m])
+            setattr(trend, f"{m}_mean", st.mean)
+            setattr(trend, f"{m}_min", st.min)
+            setattr(trend, f"{m}_max", st.max)
+            setattr(trend, f"{m}_m2", st.m2)
+        trend.count = merged[_trend_metrics[0]].count
+
+        if key in existing:
+            updated.append(trend)
 
-    for op in result.ops:
-        new_op = await orm.OpResult.objects.create(
-            name=op.name,
-            percent=op.percent,
-            ops_per_sec=op.ops_per_sec,
-            objs_per_sec=op.objs_per_sec,
-            bytes_per_sec=op.bytes_per_sec,
+    for chunk in chunked(created, row_params(orm.ResultTrend.Meta.table)):
+        await orm.ResultTrend.objects.bulk_create(chunk)
+
+    # A single update per chunk of trends, picking each column's value by
+    # id; each trend binds its id once to be matched, and twice per column.
+    table = orm.ResultTrend.Meta.table
+    for chunk in chunked(updated, 1 + 2 * len(_trend_stat_columns)):
+        await database.execute(
+            table.update()
+            .where(table.c.id.in_([t.id for t in chunk]))
+            .values(
+                **{
+                    c: sqlalchemy.case(
+                        {t.id: getattr(t, c) for t in chunk},
+                        value=table.c.id,
+                    )
+                    for c in _trend_stat_columns
+                }
+            )
         )
-        await new_entry.ops.add(new_op)  # type: ignore
 
-    return NewResultReply(id=new_entry.id)
+
+def _trend_stats(trend: orm.ResultTrend, metric: str) -> RunningStats:
+    return RunningStats(
+        count=trend.count,
+        mean=getattr(trend, f"{metric}_mean"),
+        min=getattr(trend, f"{metric}_min"),
+        max=getattr(trend, f"{metric}_max"),
+        m2=getattr(trend, f"{metric}_m2"),
+    )
+
+
+async def _ids_since(table: sqlalchemy.Table, since: int) -> List[int]:
+    query = (
+        sqlalchemy.select(table.c.id)
+        .where(table.c.id > since)
+        .order_by(table.c.id)
+    )
+    return [row["id"] for row in await database.fetch_all(query)]
 
 
 class ResultEntry(BaseModel):
     id: int
-    version: str
-    date: dt
-    duration: float
-    threads: int
-    workload: str
-    objsize: str
-    objects: int
-    duration_str: str
-    ops: List[OpResult]
+    version: Optional[str]
+    date: Optional[dt]
+    duration: Optional[float]
+    threads: Optional[int]
+    workload: Optional[str]
+    objsize: Optional[str]
+    objects: Optional[int]
+    duration_str: Optional[str]
+    ops: Optional[List[OpResult]]
+
+
+# result entry fields, and the columns they come from.
+_result_columns: Dict[str, str] = {
+    "version": "version",
+    "date": "date",
+    "duration": "duration",
+    "threads": "threads",
+    "workload": "workload",
+    "objsize": "objsize",
+    "objects": "num_objects",
+    "duration_str": "duration_str",
+}
 
 
 @router.get(
     "/results",
     name="Obtain existing benchmark results.",
     response_model=List[ResultEntry],
+    response_model_exclude_unset=True,
 )
-async def get_results() -> List[ResultEntry]:
-    # lst: List[ResultReply] = []
+async def get_results(
+    request: Request,
+    version: Optional[str] = Query(default=None),
+    workload: Optional[str] = Query(default=None),
+    objsize: Optional[str] = Query(default=None),
+    threads: Optional[int] = Query(default=None),
+    since: Optional[dt] = Query(default=None),
+    until: Optional[dt] = Query(default=None),
+    limit: Optional[int] = Query(default=None, gt=0),
+    cursor: Optional[int] = Query(default=None),
+    fields: List[str] = Query(default=[]),
+    cache: ResponseCache = Depends(response_cache),
+    results_mgr: ResultsMgr = Depends(resultsmgr),
+) -> Response:
+    """
+    Results are ordered by id. To obtain the next page, pass the id of the
+    last result received as `cursor`. `version` matches versions starting
+    with it; `since` and `until` bound the result's date, inclusively.
+    `fields` may be specified multiple times, to obtain only those fields
+    besides the id; e.g., all but `ops` for a summary.
+    """
+    for f in fields:
+        if f != "ops" and f not in _result_columns:
+            raise HTTPException(status_code=400, detail=f"Invalid field: {f}")
+    if len(fields) == 0:
+        fields = list(_result_columns.keys()) + ["ops"]
+
+    return await cache.respond(
+        request,
+        results_mgr.version,
+        lambda: _get_results(
+            version,
+            workload,
+            objsize,
+            threads,
+            since,
+            until,
+            limit,
+            cursor,
+            fields,
+        ),
+        exclude_unset=True,
+    )
+
+
+async def _get_results(
+    version: Optional[str],
+    workload: Optional[str],
+    objsize: Optional[str],
+    threads: Optional[int],
+    since: Optional[dt],
+    until: Optional[dt],
+    limit: Optional[int],
+    cursor: Optional[int],
+    fields: List[str],
+) -> List[ResultEntry]:
+    table = orm.Result.Meta.table
+    columns = [table.c.id] + [
+        table.c[_result_columns[f]] for f in fields if f in _result_columns
+    ]
+    query = sqlalchemy.select(*columns)
+    if version is not None and len(version) > 0:
+        # a range, rather than LIKE, so the index is used.
+        query = query.where(table.c.version >= version).where(
+            table.c.version < version[:-1] + chr(ord(version[-1]) + 1)
+        )
+    if workload is not None:
+        query = query.where(table.c.workload == workload)
+    if objsize is not None:
+        query = query.where(table.c.objsize == objsize)
+    if threads is not None:
+        query = query.where(table.c.threads == threads)
+    if since is not None:
+        query = query.where(table.c.date >= since)
+    if until is not None:
+        query = query.where(table.c.date <= until)
+    if cursor is not None:
+        query = query.where(table.c.id > cursor)
+    query = query.order_by(table.c.id)
+    if limit is not None:
+        query = query.limit(limit)
+
     results: List[ResultEntry] = []
-    lst = await orm.Result.objects.select_related("ops").all()  # type: ignore
-    for entry in lst:
+    for row in await database.fetch_all(query):
+        entry = ResultEntry(id=row["id"])
+        for f in fields:
+            if f in _result_columns:
+                setattr(entry, f, row[_result_columns[f]])
+        results.append(entry)
 
-        opslst: List[OpResult] = []
-        if entry.ops is not None:
-            for op in entry.ops:
-                opslst.append(
+    if "ops" in fields and len(results) > 0:
+        ops: Dict[int, List[OpResult]] = {r.id: [] for r in results}
+        ops_table = orm.OpResult.Meta.table
+        for chunk in chunked(list(ops.keys())):
+            for row in await database.fetch_all(
+                sqlalchemy.select(ops_table)
+                .where(ops_table.c.result.in_(chunk))
+                .order_by(ops_table.c.id)
+            ):
+                ops[row["result"]].append(
                     OpResult(
-                        name=op.name,
-                        percent=op.percent,
-                        ops_per_sec=op.ops_per_sec,
-                        objs_per_sec=op.objs_per_sec,
-                        bytes_per_sec=op.bytes_per_sec,
+                        name=row["name"],
+                        percent=row["percent"],
+                        ops_per_sec=row["ops_per_sec"],
+                        objs_per_sec=row["objs_per_sec"],
+                        bytes_per_sec=row["bytes_per_sec"],
                     )
                 )
+        for r in results:
+            r.ops = ops[r.id]
+
+    return results
+
+
+class SeriesPoint(BaseModel):
+    result: int
+    version: str
+    date: dt
+    ops_per_sec: float
+    objs_per_sec: float
+    bytes_per_sec: int
+
+
+class SeriesEntry(BaseModel):
+    workload: str
+    objsize: str
+    threads: int
+    op: str
+    points: List[SeriesPoint]
+
+
+# what series may be downsampled by.
+_series_metrics = ("ops_per_sec", "objs_per_sec", "bytes_per_sec")
 
-        results.append(
-            ResultEntry(
-                id=entry.id,
-                version=entry.version,
-                date=entry.date,
-                duration=entry.duration,
-                threads=entry.threads,
-                workload=entry.workload,
-                objsize=entry.objsize,
-                objects=entry.num_objects,
-                duration_str=entry.duration_str,
-                ops=opslst,
+
+@router.get(
+    "/series",
+    name="Obtain benchmark results as per-op series.",
+    response_model=List[SeriesEntry],
+)
+async def get_series(
+    workload: Optional[str] = Query(default=None),
+    objsize: Optional[str] = Query(default=None),
+    threads: Optional[int] = Query(default=None),
+    op: Optional[str] = Query(default=None),
+    since: Optional[dt] = Query(default=None),
+    until: Optional[dt] = Query(default=None),
+    points: Optional[int] = Query(default=None, ge=3),
+    metric: str = Query(default="ops_per_sec"),
+) -> List[SeriesEntry]:
+    """
+    Each op's results over time, per benchmark shape, ordered by date.
+    With `points`, series longer than that are downsampled to that many
+    points, keeping the shape of `metric` over time.
+    """
+    if metric not in _series_metrics:
+        raise HTTPException(status_code=400, detail=f"Invalid metric: {metric}")
+
+    results = orm.Result.Meta.table
+    ops = orm.OpResult.Meta.table
+    query = sqlalchemy.select(
+        results.c.id,
+        results.c.version,
+        results.c.date,
+        results.c.workload,
+        results.c.objsize,
+        results.c.threads,
+        ops.c.name,
+        ops.c.ops_per_sec,
+        ops.c.objs_per_sec,
+        ops.c.bytes_per_sec,
+    ).select_from(ops.join(results, results.c.id == ops.c.result))
+    if workload is not None:
+        query = query.where(results.c.workload == workload)
+    if objsize is not None:
+        query = query.where(results.c.objsize == objsize)
+    if threads is not None:
+        query = query.where(results.c.threads == threads)
+    if op is not None:
+        query = query.where(ops.c.name == op)
+    if since is not None:
+        query = query.where(results.c.date >= since)
+    if until is not None:
+        query = query.where(results.c.date <= until)
+    query = query.order_by(
+        results.c.workload,
+        results.c.objsize,
+        results.c.threads,
+        ops.c.name,
+        results.c.date,
+        results.c.id,
+    )
+
+    # rows come grouped by series; downsample them before building points.
+    groups: List[List[Record]] = []
+    for row in await database.fetch_all(query):
+        if len(groups) == 0 or any(
+            row[c] != groups[-1][0][c]
+            for c in ("workload", "objsize", "threads", "name")
+        ):
+            groups.append([])
+        groups[-1].append(row)
+
+    series: List[SeriesEntry] = []
+    for rows in groups:
+        if points is not None:
+            picked = lttb(
+                [row["date"].timestamp() for row in rows],
+                [float(row[metric]) for row in rows],
+                points,
+            )
+            rows = [rows[i] for i in picked]
+        series.append(
+            SeriesEntry(
+                workload=rows[0]["workload"],
+                objsize=rows[0]["objsize"],
+                threads=rows[0]["threads"],
+                op=rows[0]["name"],
+                points=[
+                    SeriesPoint(
+                        result=row["id"],
+                        version=row["version"],
+                        date=row["date"],
+                        ops_per_sec=row["ops_per_sec"],
+                        objs_per_sec=row["objs_per_sec"],
+                        bytes_per_sec=row["bytes_per_sec"],
+                    )
+                    for row in rows
+                ],
             )
         )
 
-    return results
+    return series
+
+
+class TrendStats(BaseModel):
+    mean: float
+    min: float
+    max: float
+    variance: Optional[float]
+
+
+class TrendEntry(BaseModel):
+    workload: str
+    objsize: str
+    threads: int
+    op: str
+    bucket: date
+    count: int
+    ops_per_sec: TrendStats
+    objs_per_sec: TrendStats
+    bytes_per_sec: TrendStats
+
+
+@router.get(
+    "/trends",
+    name="Obtain daily benchmark result trends.",
+    response_model=List[TrendEntry],
+)
+async def get_trends(
+    workload: Optional[str] = Query(default=None),
+    objsize: Optional[str] = Query(default=None),
+    threads: Optional[int] = Query(default=None),
+    op: Optional[str] = Query(default=None),
+    since: Optional[date] = Query(default=None),
+    until: Optional[date] = Query(default=None),
+) -> List[TrendEntry]:
+    """
+    Statistics of each op's results, per benchmark shape and day, ordered
+    by shape, op and day. `since` and `until` bound the day, inclusively.
+    """
+    query = orm.ResultTrend.objects
+    if workload is not None:
+        query = query.filter(orm.ResultTrend.workload == workload)
+    if objsize is not None:
+        query = query.filter(orm.ResultTrend.objsize == objsize)
+    if threads is not None:
+        query = query.filter(orm.ResultTrend.threads == threads)
+    if op is not None:
+        query = query.filter(orm.ResultTrend.op == op)
+    if since is not None:
+        query = query.filter(orm.ResultTrend.bucket >= since)
+    if until is not None:
+        query = query.filter(orm.ResultTrend.bucket <= until)
+    query = query.order_by(
+        [
+            orm.ResultTrend.workload.asc(),
+            orm.ResultTrend.objsize.asc(),
+            orm.ResultTrend.threads.asc(),
+            orm.ResultTrend.op.asc(),
+            orm.ResultTrend.bucket.asc(),
+        ]
+    )
+
+    entries: List[TrendEntry] = []
+    for trend in await query.all():
+        stats: Dict[str, TrendStats] = {}
+        for m in _trend_metrics:
+            st = _trend_stats(trend, m)
+            stats[m] = TrendStats(
+                mean=st.mean, min=st.min, max=st.max, variance=st.variance
+            )
+        entries.append(
+            TrendEntry(
+                workload=trend.workload,
+                objsize=trend.objsize,
+                threads=trend.threads,
+                op=trend.op,
+                bucket=trend.bucket,
+                count=trend.count,
+                **stats,
+            )
+        )
+    return entries
+
+
+class RegressionEntry(BaseModel):
+    id: int
+    result: int
+    version: str
+    date: dt
+    workload: str
+    objsize: str
+    threads: int
+    op: str
+    metric: str
+    baseline_median: float
+    recent_median: float
+    change: float
+    p_value: float
+    detected: dt
+
+
+@router.get(
+    "/regressions",
+    name="Obtain detected benchmark regressions.",
+    response_model=List[RegressionEntry],
+)
+async def get_regressions(
+    workload: Optional[str] = Query(default=None),
+    objsize: Optional[str] = Query(default=None),
+    threads: Optional[int] = Query(default=None),
+    op: Optional[str] = Query(default=None),
+    since: Optional[dt] = Query(default=None),
+    limit: int = Query(default=100, gt=0),
+) -> List[RegressionEntry]:
+    """
+    Regressions found as results were added, most recently detected first.
+    `since` bounds when they were detected.
+    """
+    query = orm.Regression.objects.select_related(orm.Regression.result)
+    if workload is not None:
+        query = query.filter(orm.Regression.workload == workload)
+    if objsize is not None:
+        query = query.filter(orm.Regression.objsize == objsize)
+    if threads is not None:
+        query = query.filter(orm.Regression.threads == threads)
+    if op is not None:
+        query = query.filter(orm.Regression.op == op)
+    if since is not None:
+        query = query.filter(orm.Regression.detected >= since)
+    query = query.order_by(
+        [orm.Regression.detected.desc(), orm.Regression.id.desc()]
+    ).limit(limit)
+
+    return [
+        RegressionEntry(
+            id=r.id,
+            result=r.result.id,
+            version=r.result.version,
+            date=r.result.date,
+            workload=r.workload,
+            objsize=r.objsize,
+            threads=r.threads,
+            op=r.op,
+            metric=r.metric,
+            baseline_median=r.baseline_median,
+            recent_median=r.recent_median,
+            change=r.change,
+            p_value=r.p_value,
+            detected=r.detected,
+        )
+        for r in await query.all()
+    ]
@@ -0,0 +1,69 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+import json
+from typing import Any, AsyncIterator, Dict
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+
+from libtstr.api import eventbus
+from libtstr.events import EventBus, EventSubscriber
+
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+# Events queued for each client. Should a client not keep up, the oldest
+# are dropped, and it is told how many it missed.
+QUEUE_SIZE: int = 100
+# Comments are sent when idle, so proxies and clients keep the stream open.
+KEEPALIVE_INTERVAL: float = 15.0
+
+
+@router.get("/", name="Stream events as they happen.")
+async def stream_events(
+    bus: EventBus = Depends(eventbus),
+) -> StreamingResponse:
+    """
+    Server-sent events: new heads and closed branches, workqueue state
+    changes, new benchmark results and regressions. A `dropped` event means
+    events were missed, and the state should be fetched again.
+    """
+    return StreamingResponse(
+        _stream(bus.subscribe(maxsize=QUEUE_SIZE)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _stream(sub: EventSubscriber) -> AsyncIterator[str]:
+    # We're paused while the client's connection is busy; meanwhile events
+    # pile up in the subscriber's bounded queue, rather than in ours.
+    dropped = 0
+    try:
+        while True:
+            event = await sub.get(timeout=KEEPALIVE_INTERVAL)
+            if sub.is_closed:
+                break
+            if sub.dropped > dropped:
+                yield _format("dropped", {"count": sub.dropped - dropped})
+                dropped = sub.dropped
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event.what.value}\ndata: {event.json()}\n\n"
+    finally:
+        sub.close()
+
+
+def _format(what: str, data: Dict[str, Any]) -> str:
+    return f"event: {what}\ndata: {json.dumps(data)}\n\n"
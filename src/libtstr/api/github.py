@@ -0,0 +1,61 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+import hashlib
+import hmac
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.logger import logger
+
+from libtstr.api import githubmgr
+from libtstr.gh import GithubMgr
+
+
+router = APIRouter(prefix="/github", tags=["github"])
+
+
+def _verify_signature(
+    secret: str, body: bytes, signature: Optional[str]
+) -> bool:
+    if signature is None or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256)
+    return hmac.compare_digest(f"sha256={expected.hexdigest()}", signature)
+
+
+@router.post("/webhook", name="Receive GitHub webhook events.")
+async def webhook(
+    request: Request,
+    x_github_event: str = Header(),
+    x_hub_signature_256: Optional[str] = Header(default=None),
+    gh: GithubMgr = Depends(githubmgr),
+) -> None:
+    secret = gh.config.webhook_secret
+    if secret is None:
+        raise HTTPException(status_code=404, detail="Webhooks not enabled")
+
+    body = await request.body()
+    if not _verify_signature(secret, body, x_hub_signature_256):
+        logger.error(f"invalid signature for '{x_github_event}' event")
+        raise HTTPException(status_code=403, detail="Invalid signature")
+
+    if x_github_event == "ping":
+        return
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid payload")
+
+    await gh.handle_event(x_github_event, payload)
@@ -11,20 +11,38 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU Affero General Public License for more details.
 
-from typing import List
-from fastapi import APIRouter, Depends
+from typing import List, Optional, Union
+from fastapi import APIRouter, Depends, Query, Request, Response
 
 # from fastapi.logger import logger
 
-from libtstr.api import githubmgr
-from libtstr.gh import GithubMgr, GithubBranch
+from libtstr.api import githubmgr, response_cache
+from libtstr.cache import ResponseCache
+from libtstr.gh import GithubMgr, GithubBranch, GithubHeadsDelta
 
 
 router = APIRouter(prefix="/heads", tags=["heads"])
 
 
 @router.get(
-    "/", name="Obtain currently open heads.", response_model=List[GithubBranch]
+    "/",
+    name="Obtain currently open heads.",
+    response_model=Union[List[GithubBranch], GithubHeadsDelta],
 )
-async def get_heads(gh: GithubMgr = Depends(githubmgr)) -> List[GithubBranch]:
-    return await gh.get_heads()
+async def get_heads(
+    request: Request,
+    since: Optional[int] = Query(default=None),
+    gh: GithubMgr = Depends(githubmgr),
+    cache: ResponseCache = Depends(response_cache),
+) -> Response:
+    """
+    With `since`, only branches that changed after that revision are
+    returned, along with those that are gone, and the current revision to
+    pass next time. Pass 0 to start with all branches.
+    """
+    if since is not None:
+        revision = since
+        return await cache.respond(
+            request, gh.version, lambda: gh.get_heads_since(revision)
+        )
+    return await cache.respond(request, gh.version, gh.get_heads)
@@ -11,20 +11,153 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU Affero General Public License for more details.
 
-from typing import List
-from fastapi import APIRouter, Depends
+from typing import List, Optional, Union
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import BaseModel
 
 # from fastapi.logger import logger
 
-from libtstr.api import workqueue
-from libtstr.wq import WQItem, WorkQueue
+from libtstr.api import access_token_required, response_cache, workqueue
+from libtstr.cache import ResponseCache
+from libtstr.orm.workqueue import WQStateEnum
+from libtstr.wq import (
+    WQDelta,
+    WQItem,
+    WQLease,
+    WorkQueue,
+    entry_state_from_str,
+)
 
 
 router = APIRouter(prefix="/wq", tags=["workqueue"])
 
 
 @router.get(
-    "/", name="Obtain current workqueue items", response_model=List[WQItem]
+    "/",
+    name="Obtain current workqueue items",
+    response_model=Union[List[WQItem], WQDelta],
+)
+async def get_heads(
+    request: Request,
+    limit: Optional[int] = Query(default=None, gt=0),
+    cursor: Optional[int] = Query(default=None),
+    state: List[str] = Query(default=[]),
+    since: Optional[int] = Query(default=None),
+    wq: WorkQueue = Depends(workqueue),
+    cache: ResponseCache = Depends(response_cache),
+) -> Response:
+    """
+    Entries are ordered by id. To obtain the next page, pass the id of the
+    last entry received as `cursor`. `state` may be specified multiple times.
+
+    With `since`, only entries that changed after that revision are
+    returned, along with the ids of those that no longer match `state`, and
+    the current revision to pass next time. Pass 0 to start with all
+    entries. Changes are not paged; `since` can't be used with `limit` or
+    `cursor`.
+    """
+    states: List[WQStateEnum] = []
+    for s in state:
+        st = entry_state_from_str(s)
+        if st is None:
+            raise HTTPException(status_code=400, detail=f"Invalid state: {s}")
+        states.append(st)
+
+    if since is not None:
+        if limit is not None or cursor is not None:
+            raise HTTPException(
+                status_code=400,
+                detail="since can't be used with limit or cursor",
+            )
+        revision = since
+        return await cache.respond(
+            request,
+            wq.version,
+            lambda: wq.get_entries_since(revision, states=states),
+        )
+
+    return await cache.respond(
+        request,
+        wq.version,
+        lambda: wq.get_entries(limit=limit, cursor=cursor, states=states),
+    )
+
+
+class ClaimRequest(BaseModel):
+    worker: str
+    # only claim items for heads of these repositories.
+    repos: Optional[List[str]] = None
+
+
+class LeaseRequest(BaseModel):
+    lease: str
+
+
+class FailRequest(BaseModel):
+    lease: str
+    reason: str = ""
+
+
+@router.post(
+    "/claim",
+    name="Claim the next available workqueue item.",
+    response_model=Optional[WQLease],
+    dependencies=[Depends(access_token_required)],
+)
+async def claim(
+    req: ClaimRequest, wq: WorkQueue = Depends(workqueue)
+) -> Optional[WQLease]:
+    """
+    Returns a lease on the claimed item, or null if there's nothing to do.
+    The lease must be kept alive with heartbeats until the item is completed,
+    or reported as failed. Workers should only claim items for `repos` they
+    can work on.
+    """
+    return await wq.claim(req.worker, req.repos)
+
+
+@router.post(
+    "/heartbeat",
+    name="Extend the lease on a claimed workqueue item.",
+    response_model=WQLease,
+    dependencies=[Depends(access_token_required)],
+)
+async def heartbeat(
+    req: LeaseRequest, wq: WorkQueue = Depends(workqueue)
+) -> WQLease:
+    lease = await wq.heartbeat(req.lease)
+    if lease is None:
+        raise HTTPException(status_code=404, detail="Lease not found")
+    return lease
+
+
+@router.post(
+    "/complete",
+    name="Mark a claimed workqueue item as done.",
+    response_model=WQItem,
+    dependencies=[Depends(access_token_required)],
+)
+async def complete(
+    req: LeaseRequest, wq: WorkQueue = Depends(workqueue)
+) -> WQItem:
+    item = await wq.complete(req.lease)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Lease not found")
+    return item
+
+
+@router.post(
+    "/fail",
+    name="Report a claimed workqueue item as failed.",
+    response_model=WQItem,
+    dependencies=[Depends(access_token_required)],
 )
-async def get_heads(wq: WorkQueue = Depends(workqueue)) -> List[WQItem]:
-    return await wq.get_entries()
+async def fail(req: FailRequest, wq: WorkQueue = Depends(workqueue)) -> WQItem:
+    """
+    The item goes back in the queue, to be tried again, unless it is out of
+    attempts, in which case it fails for good.
+    """
+    item = await wq.fail(req.lease, req.reason)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Lease not found")
+    return item
@@ -13,7 +13,7 @@
 
 from typing import List
 from datetime import datetime as dt
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
 
 class Op(BaseModel):
@@ -46,3 +46,10 @@ class Result(BaseModel):
     duration: float
     details: WarpCmd
     ops: List[OpResult]
+
+    @validator("ops")
+    def _unique_ops(cls, ops: List[OpResult]) -> List[OpResult]:
+        names = [op.name for op in ops]
+        if len(names) != len(set(names)):
+            raise ValueError("duplicate op names")
+        return ops
@@ -0,0 +1,158 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+import math
+from typing import Dict, List, Optional, Sequence
+
+
+class RunningStats:
+    """
+    Count, mean, min, max and variance of a series of values, updated one
+    value at a time or by merging in another series' statistics, without
+    keeping the values around (Welford's and Chan et al.'s algorithms).
+    """
+
+    __slots__ = ("count", "mean", "min", "max", "m2")
+
+    count: int
+    mean: float
+    min: float
+    max: float
+    # sum of squared differences from the mean.
+    m2: float
+
+    def __init__(
+        self,
+        count: int = 0,
+        mean: float = 0.0,
+        min: float = 0.0,
+        max: float = 0.0,
+        m2: float = 0.0,
+    ) -> None:
+        self.count = count
+        self.mean = mean
+        self.min = min
+        self.max = max
+        self.m2 = m2
+
+    def add(self, value: float) -> None:
+        self.merge(RunningStats(1, value, value, value, 0.0))
+
+    def merge(self, other: "RunningStats") -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean
+            self.min = other.min
+            self.max = other.max
+            self.m2 = other.m2
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count = count
+
+    @property
+    def variance(self) -> Optional[float]:
+        """Sample variance, if we have at least two values."""
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+
+def ranks(values: Sequence[float]) -> List[float]:
+    """Rank of each value, starting at 1, with ties getting their mean rank."""
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    result = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            result[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+    return result
+
+
+def mann_whitney_less(
+    baseline: Sequence[float], sample: Sequence[float]
+) -> float:
+    """
+    One-sided Mann-Whitney U test of whether `sample` tends to be smaller
+    than `baseline`. Returns the p-value, from the normal approximation with
+    tie and continuity corrections.
+    """
+    n1, n2 = len(baseline), len(sample)
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    n = n1 + n2
+    r = ranks(list(baseline) + list(sample))
+    u = sum(r[n1:]) - n2 * (n2 + 1) / 2
+
+    ties: Dict[float, int] = {}
+    for rank in r:
+        ties[rank] = ties.get(rank, 0) + 1
+    tie_term = sum(t**3 - t for t in ties.values()) / (n * (n - 1))
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term)
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 + 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(-z / math.sqrt(2))
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], points: int) -> List[int]:
+    """
+    Pick `points` of a series' points that keep its shape, using the
+    Largest-Triangle-Three-Buckets algorithm. `xs` must be sorted. Returns
+    the indexes of the points picked, in order; the first and last points
+    are always kept.
+    """
+    n = len(xs)
+    if points >= n or points < 3:
+        return list(range(n))
+
+    picked = [0]
+    # the points in between are split in `points - 2` buckets, and from
+    # each we pick the one making the largest triangle with the previously
+    # picked point and the average of the next bucket.
+    size = (n - 2) / (points - 2)
+    prev = 0
+    for b in range(points - 2):
+        start = int(b * size) + 1
+        end = int((b + 1) * size) + 1
+        next_end = min(int((b + 2) * size) + 1, n)
+        if b == points - 3:
+            next_start, next_end = n - 1, n
+        else:
+            next_start = end
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        best, best_area = start, -1.0
+        for i in range(start, end):
+            area = abs(
+                (xs[prev] - avg_x) * (ys[i] - ys[prev])
+                - (xs[prev] - xs[i]) * (avg_y - ys[prev])
+            )
+            if area > best_area:
+                best, best_area = i, area
+        picked.append(best)
+        prev = best
+
+    picked.append(n - 1)
+    return picked
@@ -0,0 +1,104 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+from collections import OrderedDict
+import hashlib
+from typing import Any, Awaitable, Callable, NamedTuple
+from uuid import uuid4
+from fastapi import Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+class _CachedResponse(NamedTuple):
+    etag: str
+    body: bytes
+
+
+class ResponseCache:
+    """
+    Caches rendered responses of read-only endpoints, tagged with the
+    generation of the data they were computed from; a generation is bumped
+    whenever the underlying data is written. Responses carry an ETag made of
+    the generation and the request, so a client asking again for something
+    that didn't change gets a 304 without us looking at either the cache or
+    the database.
+    """
+
+    MAX_ENTRIES: int = 256
+
+    # ETags from a previous run mean nothing, as generations start over.
+    _epoch: str
+    _entries: "OrderedDict[str, _CachedResponse]"
+
+    def __init__(self) -> None:
+        self._epoch = uuid4().hex[:8]
+        self._entries = OrderedDict()
+
+    async def respond(
+        self,
+        request: Request,
+        generation: int,
+        compute: Callable[[], Awaitable[Any]],
+        exclude_unset: bool = False,
+    ) -> Response:
+        key = _request_key(request)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        etag = f'"{self._epoch}-{generation}-{digest}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+            )
+
+        cached = self._entries.get(key)
+        if cached is not None and cached.etag == etag:
+            self._entries.move_to_end(key)
+            return Response(
+                content=cached.body,
+                media_type="application/json",
+                headers=headers,
+            )
+
+        value = await compute()
+        body = JSONResponse(
+            content=jsonable_encoder(value, exclude_unset=exclude_unset)
+        ).body
+        self._entries[key] = _CachedResponse(etag, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.popitem(last=False)
+        return Response(
+            content=body, media_type="application/json", headers=headers
+        )
+
+
+def _request_key(request: Request) -> str:
+    query = "&".join(
+        f"{k}={v}" for k, v in sorted(request.query_params.multi_items())
+    )
+    return f"{request.url.path}?{query}"
+
+
+def _etag_matches(header: Any, etag: str) -> bool:
+    if header is None:
+        return False
+    for tag in str(header).split(","):
+        tag = tag.strip()
+        # weak comparison, as it should be for If-None-Match.
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag:
+            return True
+    return False
@@ -0,0 +1,78 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+from collections import OrderedDict
+import time
+from typing import Generic, Hashable, Iterable, List, Optional, TypeVar
+
+
+K = TypeVar("K", bound=Hashable)
+
+
+class ChangeLog(Generic[K]):
+    """
+    Tracks which keys changed at which revision, so that clients can ask for
+    what changed since the last revision they saw. Only the latest revision
+    of each key is kept, and the oldest keys are forgotten past MAX_KEYS;
+    revisions before what we still know about can't be answered, and need a
+    full resync.
+
+    Revisions follow the clock, in milliseconds, so that they keep growing
+    across restarts, and a revision handed out by a previous run is always
+    older than anything we know about.
+    """
+
+    MAX_KEYS: int = 100000
+
+    _revision: int
+    # we know about every change after this revision.
+    _floor: int
+    _changes: "OrderedDict[K, int]"
+
+    def __init__(self) -> None:
+        self._revision = _now()
+        self._floor = self._revision
+        self._changes = OrderedDict()
+
+    @property
+    def revision(self) -> int:
+        return self._revision
+
+    def record(self, keys: Iterable[K]) -> None:
+        """Mark `keys` as changed, at a new revision."""
+        self._revision = max(self._revision + 1, _now())
+        for key in keys:
+            self._changes[key] = self._revision
+            self._changes.move_to_end(key)
+        while len(self._changes) > self.MAX_KEYS:
+            _, revision = self._changes.popitem(last=False)
+            self._floor = revision
+
+    def changed_since(self, revision: int) -> Optional[List[K]]:
+        """
+        Keys changed after `revision`, most recent last; or None if we can't
+        tell, in which case everything must be considered changed.
+        """
+        if revision < self._floor or revision > self._revision:
+            return None
+        changed: List[K] = []
+        for key in reversed(self._changes):
+            if self._changes[key] <= revision:
+                break
+            changed.append(key)
+        changed.reverse()
+        return changed
+
+
+def _now() -> int:
+    return int(time.time() * 1000)
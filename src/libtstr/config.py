@@ -13,10 +13,16 @@
 
 from pydantic import BaseModel, Field
 
+from libtstr.db import DatabaseConfig
 from libtstr.gh import GithubConfig
+from libtstr.regressions import RegressionConfig
+from libtstr.wq import WorkQueueConfig
 
 
 class TstrConfig(BaseModel):
     gh: GithubConfig
+    wq: WorkQueueConfig = Field(default_factory=WorkQueueConfig)
+    db: DatabaseConfig = Field(default_factory=DatabaseConfig)
+    regressions: RegressionConfig = Field(default_factory=RegressionConfig)
     log_level: str = Field(default="INFO")
     access_token: str
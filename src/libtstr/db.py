@@ -13,17 +13,246 @@
 
 # pyright: reportUnknownMemberType=false
 
+import asyncio
+import sqlite3
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 import databases
+from fastapi.logger import logger
+from pydantic import BaseModel, Field
 import sqlalchemy
 from ormar import ModelMeta
 
-_dburl = "sqlite:///tstr.db"
+# SQLite before 3.32 allows at most 999 bound parameters per statement;
+# multi-row statements stay below that, with room for other parameters.
+MAX_BULK_PARAMS = 900
+
+T = TypeVar("T")
+
+
+class DatabaseConfig(BaseModel):
+    url: str = Field(default="sqlite:///tstr.db")
+    # Connection pool bounds, for backends with a connection pool. SQLite
+    # opens a connection per query, and ignores these.
+    min_size: int = Field(default=1)
+    max_size: int = Field(default=10)
+    # SQLite only. With WAL, readers don't block on writers, and vice versa;
+    # and with synchronous=NORMAL, commits in WAL mode don't fsync.
+    sqlite_journal_mode: str = Field(default="wal")
+    sqlite_synchronous: str = Field(default="normal")
+    sqlite_mmap_size: int = Field(default=256 * 1024 * 1024)
+    # How long to wait for another connection's write lock, in seconds.
+    sqlite_busy_timeout: float = Field(default=5.0)
+    # Writes are committed in groups: a group waits this long, in seconds,
+    # for more writes to join it, up to a maximum number of writes.
+    group_commit_delay: float = Field(default=0.005)
+    group_commit_size: int = Field(default=100)
+
+
+class TstrDatabase(databases.Database):
+    """
+    A database that can be pointed at its configured backend after being
+    created. Our models are bound to the one database object at import
+    time, before we have read our configuration.
+    """
+
+    def configure(self, url: str, **options: Any) -> None:
+        assert not self.is_connected
+        self.__init__(url, **options)
+
+
+Write = Callable[[], Awaitable[Any]]
+
+
+class WriteQueue:
+    """
+    Serializes writes to the database, committing them in groups. Each write
+    runs in its own savepoint within the group's transaction, so a failing
+    write doesn't affect the others in its group; its caller gets the
+    exception, and everyone else their results, once the group commits.
+
+    Writes run in the queue's task, and must not submit writes themselves.
+    Until the queue is started, writes run right away, each in its own
+    transaction.
+    """
+
+    _database: databases.Database
+    _queue: "asyncio.Queue[Optional[Tuple[Write, asyncio.Future[Any]]]]"
+    _delay: float
+    _size: int
+    _task: Optional[asyncio.Task]  # type: ignore
+
+    def __init__(self, database: databases.Database) -> None:
+        self._database = database
+        self._delay = 0.0
+        self._size = 1
+        self._task = None
+
+    def start(self, delay: float, size: int) -> None:
+        self._delay = delay
+        self._size = max(size, 1)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._main_task())
+
+    async def stop(self) -> None:
+        """Stop, once the writes already submitted have been committed."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, write: Callable[[], Awaitable[T]]) -> T:
+        """Run `write`, returning its result once it has been committed."""
+        if self._task is None:
+            async with self._database.transaction():
+                return await write()
+
+        future: "asyncio.Future[T]" = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((write, future))
+        return await future
+
+    async def _main_task(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            group = [item]
+            if self._delay > 0:
+                await asyncio.sleep(self._delay)
+            while len(group) < self._size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+            await self._commit(group)
+
+    async def _commit(self, group: List[Tuple[Write, "asyncio.Future[Any]"]]):
+        results: List[Tuple[bool, Any]] = []
+        try:
+            async with self._database.transaction():
+                for write, future in group:
+                    if future.cancelled():
+                        results.append((True, None))
+                        continue
+                    try:
+                        async with self._database.transaction():
+                            results.append((True, await write()))
+                    except Exception as e:
+                        results.append((False, e))
+        except Exception as e:
+            logger.error(f"unable to commit {len(group)} writes: {e}")
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), (ok, value) in zip(group, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+_default_url = DatabaseConfig().url
 
 metadata = sqlalchemy.MetaData()
-database = databases.Database(_dburl)
-engine = sqlalchemy.create_engine(_dburl)
+database = TstrDatabase(_default_url)
+engine = sqlalchemy.create_engine(_default_url)
+writes = WriteQueue(database)
 
 
 class BaseMeta(ModelMeta):
     database: databases.Database = database
     metadata: sqlalchemy.MetaData = metadata
+
+
+def chunked(lst: List[T], params: int = 1) -> Iterator[List[T]]:
+    """
+    Split a list into chunks suitable for a single bulk statement, binding
+    `params` parameters for each item; e.g., one for IN lists, or as many as
+    the table has columns for multi-row inserts.
+    """
+    size = max(1, MAX_BULK_PARAMS // params)
+    for i in range(0, len(lst), size):
+        yield lst[i : i + size]
+
+
+def row_params(table: sqlalchemy.Table) -> int:
+    """Parameters bound for each row of a multi-row insert into `table`."""
+    return len(table.columns)
+
+
+async def last_id(table: sqlalchemy.Table) -> int:
+    """
+    Highest id in `table`, or 0 if empty. Bulk inserts don't give us the
+    ids of new rows, which can be read back as those past the previous
+    highest id, provided nobody else inserts in the meantime.
+    """
+    return await database.fetch_val(
+        sqlalchemy.select(
+            sqlalchemy.func.coalesce(sqlalchemy.func.max(table.c.id), 0)
+        )
+    )
+
+
+def configure_database(config: DatabaseConfig) -> None:
+    """
+    Set up the database, and its engine, from our configuration. Must be
+    called before connecting to the database.
+    """
+    global engine
+
+    options: Dict[str, Any] = {}
+    if _is_sqlite(config.url):
+        options["factory"] = _sqlite_factory(config)
+        options["timeout"] = config.sqlite_busy_timeout
+    else:
+        options["min_size"] = config.min_size
+        options["max_size"] = config.max_size
+
+    database.configure(config.url, **options)
+    engine = sqlalchemy.create_engine(config.url)
+
+    if _is_sqlite(config.url):
+        # the journal mode is kept in the database file, so it only needs
+        # to be set once.
+        with engine.connect() as conn:
+            conn.exec_driver_sql(
+                f"PRAGMA journal_mode={config.sqlite_journal_mode}"
+            )
+
+
+def _is_sqlite(url: str) -> bool:
+    return databases.DatabaseURL(url).dialect == "sqlite"
+
+
+def _sqlite_factory(config: DatabaseConfig) -> type:
+    pragmas: List[str] = [
+        # ormar relies on foreign keys being enforced.
+        "foreign_keys=1",
+        f"synchronous={config.sqlite_synchronous}",
+        f"mmap_size={config.sqlite_mmap_size}",
+        f"busy_timeout={int(config.sqlite_busy_timeout * 1000)}",
+    ]
+
+    class Connection(sqlite3.Connection):
+        def __init__(self, *args: Any, **kwargs: Any) -> None:
+            super().__init__(*args, **kwargs)
+            for pragma in pragmas:
+                self.execute(f"PRAGMA {pragma};")
+
+    return Connection
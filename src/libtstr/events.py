@@ -0,0 +1,158 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+import asyncio
+from enum import Enum
+from datetime import datetime as dt
+import signal
+import threading
+from types import FrameType
+from typing import Any, Dict, List, Optional, Sequence
+from pydantic import BaseModel, Field
+
+
+class EventTypeEnum(Enum):
+    NEW_HEAD = "new_head"
+    CLOSED_BRANCH = "closed_branch"
+    NEW_REGRESSION = "new_regression"
+    WQ_STATE = "wq_state"
+    NEW_RESULTS = "new_results"
+
+
+class Event(BaseModel):
+    what: EventTypeEnum
+    when: dt = Field(default_factory=dt.utcnow)
+    data: Dict[str, Any] = Field(default={})
+
+
+class EventSubscriber:
+    """
+    Receives events published on an EventBus. Events are kept in a bounded
+    queue; should a subscriber fall behind, the oldest events are dropped so
+    that publishers never block.
+    """
+
+    _bus: "EventBus"
+    _queue: "asyncio.Queue[Optional[Event]]"
+    _is_closed: bool
+    dropped: int
+
+    def __init__(self, bus: "EventBus", maxsize: int) -> None:
+        self._bus = bus
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._is_closed = False
+        self.dropped = 0
+
+    def _put(self, event: Optional[Event]) -> None:
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """
+        Wait for the next event. Returns None on timeout, or if the
+        subscriber has been closed.
+        """
+        if self._is_closed:
+            return None
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def get_nowait(self) -> Optional[Event]:
+        """Obtain an already queued event, if any."""
+        if self._is_closed or self._queue.empty():
+            return None
+        return self._queue.get_nowait()
+
+    @property
+    def is_closed(self) -> bool:
+        return self._is_closed
+
+    def close(self) -> None:
+        """Stop receiving events, waking up anyone waiting on us."""
+        if self._is_closed:
+            return
+        self._bus.unsubscribe(self)
+        self._is_closed = True
+        self._put(None)
+
+
+class EventBus:
+    """
+    In-process publish/subscribe channel between tstr's subsystems.
+    """
+
+    _subscribers: List[EventSubscriber]
+    _is_closed: bool
+
+    def __init__(self) -> None:
+        self._subscribers = []
+        self._is_closed = False
+
+    def subscribe(self, maxsize: int = 1000) -> EventSubscriber:
+        """Subscribe to events; once closed, subscribers start out closed."""
+        sub = EventSubscriber(self, maxsize)
+        self._subscribers.append(sub)
+        if self._is_closed:
+            sub.close()
+        return sub
+
+    def unsubscribe(self, sub: EventSubscriber) -> None:
+        if sub in self._subscribers:
+            self._subscribers.remove(sub)
+
+    def close(self) -> None:
+        """Close all subscribers, e.g. when shutting down."""
+        self._is_closed = True
+        for sub in list(self._subscribers):
+            sub.close()
+
+    def publish(self, event: Event) -> None:
+        for sub in self._subscribers:
+            sub._put(event)
+
+
+def close_on_exit(
+    bus: EventBus,
+    signals: Sequence[signal.Signals] = (signal.SIGINT, signal.SIGTERM),
+) -> None:
+    """
+    Close `bus` as soon as we're told to exit, rather than on shutdown. The
+    server waits for open connections to end before shutting the application
+    down, and connections streaming events would otherwise never end. Whoever
+    handled the signals before still does, e.g. the server itself. Must be
+    called from the event loop.
+    """
+    # Signals are only handled by the main thread.
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+
+    for sig in signals:
+        previous = signal.getsignal(sig)
+
+        def handler(
+            signum: int, frame: Optional[FrameType], previous: Any = previous
+        ) -> None:
+            # We may be interrupting the loop itself; close from within it.
+            loop.call_soon_threadsafe(bus.close)
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                signal.signal(signum, signal.SIG_DFL)
+                signal.raise_signal(signum)
+
+        signal.signal(sig, handler)
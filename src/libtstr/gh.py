@@ -14,27 +14,74 @@
 # pyright: reportUnknownMemberType=false
 
 import asyncio
-from typing import Dict, List, Optional
-from datetime import datetime as dt
-import github
-from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+from datetime import datetime as dt, timedelta
+from pydantic import BaseModel, Field, root_validator
 from fastapi.logger import logger
+import sqlalchemy
 
-from libtstr.orm.heads import Branch, Head
+from libtstr.changelog import ChangeLog
+from libtstr.db import chunked, database, last_id, row_params, writes
+from libtstr.events import Event, EventBus, EventTypeEnum
+from libtstr.ghclient import GithubClient, GithubError, GithubReply
+from libtstr.orm.heads import Branch, GithubSync, Head
+
+
+T = TypeVar("T")
 
 
 class GithubConfig(BaseModel):
     token: str
-    repo: str
+    repos: List[str]
+    api_url: str = Field(default="https://api.github.com")
+    # Maximum number of concurrent requests to GitHub, across all repos.
+    max_requests: int = Field(default=4)
+    per_page: int = Field(default=100)
+    # Polling backs off while nothing changes, and speeds up when something
+    # does, within these bounds. It also slows down as needed to stay within
+    # the API rate limit.
+    poll_interval: float = Field(default=30.0)
+    min_poll_interval: float = Field(default=10.0)
+    max_poll_interval: float = Field(default=300.0)
+    # Secret shared with GitHub to sign webhook deliveries. When set, we
+    # rely on webhooks and only poll every so often, to reconcile anything
+    # we may have missed.
+    webhook_secret: Optional[str] = Field(default=None)
+    webhook_poll_interval: float = Field(default=900.0)
+    # Between full syncs, we only ask for pull requests updated since the
+    # last sync.
+    full_sync_interval: float = Field(default=86400.0)
+    # Closed branches are forgotten about, in memory, this long after being
+    # closed.
+    evict_closed_after: float = Field(default=30 * 86400.0)
+
+    @root_validator(pre=True)
+    def _single_repo(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        # older configs specify a single 'repo'.
+        if "repo" in values and "repos" not in values:
+            values["repos"] = [values.pop("repo")]
+        return values
 
 
 class GithubHead(BaseModel):
+    repo: str
     head: str
     source: str
     sha: str
     is_pull_request: bool
     id: Optional[int]
     state: Optional[str]
+    updated: Optional[dt] = None
 
 
 class GithubCommit(BaseModel):
@@ -43,6 +90,7 @@ class GithubCommit(BaseModel):
 
 
 class GithubBranch(BaseModel):
+    repo: str
     name: str
     source: str
     commits: List[GithubCommit]
@@ -51,125 +99,630 @@ class GithubBranch(BaseModel):
     state: str
 
 
+class GithubBranchRef(BaseModel):
+    repo: str
+    name: str
+
+
+class GithubHeadsDelta(BaseModel):
+    revision: int
+    # if true, `branches` are all of them, and replace what we had.
+    full: bool
+    branches: List[GithubBranch]
+    removed: List[GithubBranchRef]
+
+
+class _HeadRecord:
+    """A head, as kept in memory."""
+
+    __slots__ = ("sha", "when")
+
+    sha: bytes
+    when: dt
+
+    def __init__(self, sha: bytes, when: dt) -> None:
+        self.sha = sha
+        self.when = when
+
+
+class _BranchRecord:
+    """A branch and its heads, oldest first, as kept in memory."""
+
+    __slots__ = (
+        "id",
+        "repo",
+        "name",
+        "source",
+        "is_pull_request",
+        "pr_id",
+        "is_closed",
+        "last_update",
+        "tip",
+        "heads",
+    )
+
+    id: Optional[int]
+    repo: str
+    name: str
+    source: str
+    is_pull_request: bool
+    pr_id: int
+    is_closed: bool
+    last_update: Optional[dt]
+    # sha of the current head.
+    tip: Optional[bytes]
+    heads: List[_HeadRecord]
+
+    def __init__(
+        self,
+        id: Optional[int],
+        repo: str,
+        name: str,
+        source: str,
+        is_pull_request: bool,
+        pr_id: int,
+        is_closed: bool,
+        last_update: Optional[dt],
+        tip: Optional[bytes],
+    ) -> None:
+        self.id = id
+        self.repo = repo
+        self.name = name
+        self.source = source
+        self.is_pull_request = is_pull_request
+        self.pr_id = pr_id
+        self.is_closed = is_closed
+        self.last_update = last_update
+        self.tip = tip
+        self.heads = []
+
+
+class RepoSync:
+    """
+    Keeps a repository's heads in sync with GitHub. Each repository is
+    synced by its own task, with its own watermark and polling interval.
+    """
+
+    mgr: "GithubMgr"
+    repo: str
+    last_cost: int
+    _sync: GithubSync
+    _poll_interval: float
+    _cost: int
+    _task: Optional[asyncio.Task]  # type: ignore
+
+    def __init__(self, mgr: "GithubMgr", sync: GithubSync) -> None:
+        self.mgr = mgr
+        self.repo = sync.repo
+        self.last_cost = 0
+        self._sync = sync
+        self._poll_interval = mgr.config.poll_interval
+        self._cost = 0
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._main_task())
+
+    async def wait(self) -> None:
+        if self._task is None:
+            return
+        try:
+            await self._task
+        except Exception as e:
+            logger.error(f"github sync for {self.repo} failed: {e}")
+        self._task = None
+
+    async def _main_task(self) -> None:
+        while self.mgr.is_running:
+            logger.debug(f"updating github heads for {self.repo}")
+            self._cost = 0
+            try:
+                changed = await self._update_heads()
+            except GithubError as e:
+                logger.error(f"unable to update heads for {self.repo}: {e}")
+                changed = False
+            except Exception as e:
+                logger.exception(
+                    f"unexpected error updating heads for {self.repo}: {e}"
+                )
+                # What we got from GitHub may not have been applied, so
+                # don't rely on it being unchanged next time.
+                self.mgr.client.forget(f"/repos/{self.repo}")
+                changed = False
+            self.last_cost = self._cost
+
+            interval = self._next_poll_interval(changed)
+            logger.debug(
+                f"next github update for {self.repo} "
+                f"in {interval:.1f} seconds"
+            )
+            await self.mgr.sleep(interval)
+
+    def _next_poll_interval(self, changed: bool) -> float:
+        """
+        Poll more often while things are changing, and less often while
+        they're not. Regardless, don't poll so often that we'd run out of
+        rate limit before it resets, given what the last update of every
+        repo cost.
+        """
+        config = self.mgr.config
+        if changed:
+            self._poll_interval /= 2
+        else:
+            self._poll_interval *= 1.5
+        self._poll_interval = min(
+            max(self._poll_interval, config.min_poll_interval),
+            config.max_poll_interval,
+        )
+
+        interval = self._poll_interval
+        if config.webhook_secret is not None:
+            interval = max(interval, config.webhook_poll_interval)
+        client = self.mgr.client
+        remaining = client.rate_limit_remaining
+        until_reset = client.seconds_until_reset()
+        if remaining is not None and until_reset is not None:
+            cost = max(self.mgr.last_cost(), 1)
+            updates_left = max(remaining // cost, 1)
+            interval = max(interval, until_reset / updates_left)
+        return interval
+
+    async def _get(
+        self, path: str, params: Optional[Dict[str, Any]] = None
+    ) -> GithubReply:
+        reply = await self.mgr.run(self.mgr.client.get, path, params)
+        if reply.changed:
+            self._cost += 1
+        return reply
+
+    async def _update_heads(self) -> bool:
+        """Update heads from GitHub. Returns whether anything changed."""
+
+        logger.debug(f"update heads from github for {self.repo}")
+
+        now = dt.utcnow()
+        watermark = self._sync.pulls_watermark
+        last_full_sync = self._sync.last_full_sync
+        full = (
+            watermark is None
+            or last_full_sync is None
+            or now - last_full_sync
+            > timedelta(seconds=self.mgr.config.full_sync_interval)
+        )
+
+        if full:
+            # a full sync really fetches everything again, rather than
+            # finding it unchanged since we last fetched it.
+            self.mgr.client.forget(f"/repos/{self.repo}")
+        gh_heads = await self._get_heads(None if full else watermark)
+
+        # the sync only counts, and moves the watermark, once its heads have
+        # been applied.
+        if gh_heads is not None:
+            await self.mgr.apply_heads(gh_heads)
+            for ghead in gh_heads:
+                if ghead.updated is not None and (
+                    watermark is None or ghead.updated > watermark
+                ):
+                    watermark = ghead.updated
+            self._sync.pulls_watermark = watermark
+            if full:
+                self._sync.last_full_sync = now
+            await writes.submit(self._sync.update)
+
+        if gh_heads is None:
+            logger.debug(f"no changes on github for {self.repo}")
+            return False
+        return True
+
+    async def _get_heads(
+        self, since: Optional[dt]
+    ) -> Optional[List[GithubHead]]:
+        """
+        Obtain the default branch's and pull requests' heads. If `since` is
+        specified, only pull requests updated since then, closed or not, are
+        obtained; otherwise all open pull requests. Returns None if nothing
+        changed since we last asked.
+        """
+        repo_path = f"/repos/{self.repo}"
+
+        repo = await self._get(repo_path)
+        default_branch = await self._get(
+            f"{repo_path}/branches/{repo.data['default_branch']}"
+        )
+
+        if since is None:
+            pages = await self._get_open_pulls()
+        else:
+            pages = await self._get_updated_pulls(since)
+
+        if not any(r.changed for r in [repo, default_branch, *pages]):
+            return None
+
+        heads: List[GithubHead] = [
+            GithubHead(
+                repo=self.repo,
+                head=default_branch.data["name"],
+                source=default_branch.data["name"],
+                sha=default_branch.data["commit"]["sha"],
+                is_pull_request=False,
+                id=None,
+                state=None,
+            )
+        ]
+        for page in pages:
+            for pr in page.data:
+                updated = _parse_time(pr["updated_at"])
+                if since is not None and updated < since:
+                    break
+                heads.append(
+                    GithubHead(
+                        repo=self.repo,
+                        head=f"pull/{pr['number']}/head",
+                        source=pr["head"]["label"],
+                        sha=pr["head"]["sha"],
+                        is_pull_request=True,
+                        id=pr["number"],
+                        state=pr["state"],
+                        updated=updated,
+                    )
+                )
+
+        return heads
+
+    async def _get_open_pulls(self) -> List[GithubReply]:
+        """
+        Obtain all pages of open pull requests. We find out how many pages
+        there are, and fetch the remaining ones concurrently.
+        """
+        path = f"/repos/{self.repo}/pulls"
+        first = await self._get(path, self._page(1))
+        pages: List[GithubReply] = [first]
+        pages.extend(
+            await asyncio.gather(
+                *[
+                    self._get(path, self._page(n))
+                    for n in range(2, first.last_page + 1)
+                ]
+            )
+        )
+        return pages
+
+    async def _get_updated_pulls(self, since: dt) -> List[GithubReply]:
+        """
+        Obtain pages of pull requests, most recently updated first, until we
+        reach those not updated since `since`.
+        """
+        path = f"/repos/{self.repo}/pulls"
+        pages: List[GithubReply] = []
+        n = 1
+        while True:
+            params = self._page(n)
+            params.update(
+                {"state": "all", "sort": "updated", "direction": "desc"}
+            )
+            page = await self._get(path, params)
+            pages.append(page)
+            if not page.changed or n >= page.last_page:
+                break
+            if any(_parse_time(pr["updated_at"]) < since for pr in page.data):
+                break
+            n += 1
+        return pages
+
+    def _page(self, page: int) -> Dict[str, Any]:
+        return {"per_page": self.mgr.config.per_page, "page": page}
+
+
 class GithubMgr:
 
     config: GithubConfig
-    gh: github.Github
-    repo: str
-    _heads: List[Head]
-    _branches: List[Branch]
-    _branches_by_name: Dict[str, Branch]
-    _heads_by_sha: Dict[str, List[Head]]
-    _is_running: bool
+    repos: List[str]
+    events: EventBus
+    client: GithubClient
+    is_running: bool
+    # branches we track, keyed by id and by (repo, name), and the heads we
+    # know of for each of them, keyed by (branch id, sha).
+    _branches: Dict[int, _BranchRecord]
+    _branches_by_name: Dict[Tuple[str, str], _BranchRecord]
+    _head_keys: Set[Tuple[int, bytes]]
+    # branches that changed, by (repo, name); its revision is bumped
+    # whenever branches or heads change, and the heads snapshot is rebuilt
+    # only when it is behind.
+    _changes: ChangeLog[Tuple[str, str]]
+    _snapshot: List[GithubBranch]
+    _snapshot_version: int
+    _syncs: List[RepoSync]
+    _executor: ThreadPoolExecutor
+    _apply_lock: asyncio.Lock
+    _stopping: asyncio.Event
     _task: Optional[asyncio.Task]  # type: ignore
 
-    def __init__(self, config: GithubConfig) -> None:
+    EVICT_INTERVAL: float = 3600.0
+
+    def __init__(self, config: GithubConfig, events: EventBus) -> None:
         self.config = config
-        self.gh = github.Github(config.token)
-        self.repo = config.repo
-        self._heads = []
-        self._branches = []
+        self.repos = config.repos
+        self.events = events
+        # One client, and thus one connection pool, for all repos.
+        self.client = GithubClient(
+            config.token, config.api_url, config.max_requests
+        )
+        # Requests to GitHub are blocking, so they are performed in our own
+        # thread pool, keeping the event loop free.
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.max_requests, thread_name_prefix="github"
+        )
+        self._apply_lock = asyncio.Lock()
+        self._branches = {}
         self._branches_by_name = {}
-        self._heads_by_sha = {}
-        self._is_running = False
+        self._head_keys = set()
+        self._changes = ChangeLog()
+        self._snapshot = []
+        self._snapshot_version = 0
+        self._syncs = []
+        self.is_running = False
+        self._stopping = asyncio.Event()
         self._task = None
 
     async def start(self):
-        self._is_running = True
+        self.is_running = True
         self._task = asyncio.create_task(self._main_task())
 
     async def stop(self):
-        self._is_running = False
+        self.is_running = False
+        self._stopping.set()
         if self._task is not None:
-            await self._task
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"github task failed: {e}")
             self._task = None
+        self._executor.shutdown(wait=False)
+        self.client.close()
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run a blocking call to GitHub in our thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def sleep(self, seconds: float) -> None:
+        """Sleep for a while, unless we're being stopped."""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def last_cost(self) -> int:
+        """Requests counting against the rate limit in the last updates."""
+        return sum(s.last_cost for s in self._syncs)
 
     async def _main_task(self) -> None:
 
         await self._load()
 
-        while self._is_running:
-            logger.debug("updating github heads")
-            # self._heads = await self._get_heads()
-            await self._update_heads()
+        for sync in self._syncs:
+            sync.start()
 
-            await asyncio.sleep(30.0)
+        while self.is_running:
+            await self.sleep(self.EVICT_INTERVAL)
+            async with self._apply_lock:
+                self._evict_closed()
 
-    async def _load(self) -> None:
-        self._heads = await Head.objects.all()
-        self._branches = await Branch.objects.all()
+        for sync in self._syncs:
+            await sync.wait()
 
-        for b in self._branches:
-            assert b.name not in self._branches_by_name
-            self._branches_by_name[b.name] = b
+    async def _load(self) -> None:
+        self._syncs = []
+        for repo in self.repos:
+            sync, _ = await GithubSync.objects.get_or_create(repo=repo)
+            self._syncs.append(RepoSync(self, sync))
+
+        # branches closed long enough ago are left out, as they would be
+        # evicted anyway.
+        branches = Branch.Meta.table
+        await self._load_branches(
+            sqlalchemy.or_(
+                branches.c.is_closed.is_(False),
+                branches.c.last_update >= self._evict_cutoff(),
+            )
+        )
 
-        for h in self._heads:
-            if h.sha not in self._heads_by_sha:
-                self._heads_by_sha[h.sha] = []
-            self._heads_by_sha[h.sha].append(h)
+    async def _load_branches(self, where: Any) -> List[_BranchRecord]:
+        """
+        Load branches matching `where`, and their heads, into our index.
+        Rows are read without building ORM objects, which we don't keep.
+        """
+        branches = Branch.Meta.table
+        heads = Head.Meta.table
+
+        loaded: List[_BranchRecord] = []
+        for row in await database.fetch_all(
+            sqlalchemy.select(branches).where(where).order_by(branches.c.id)
+        ):
+            branch = _BranchRecord(
+                id=row["id"],
+                repo=row["repo"],
+                name=row["name"],
+                source=row["source"],
+                is_pull_request=row["is_pull_request"],
+                pr_id=row["pr_id"],
+                is_closed=row["is_closed"],
+                last_update=row["last_update"],
+                tip=(None if row["tip"] is None else _pack_sha(row["tip"])),
+            )
+            loaded.append(branch)
+            self._add_branch(branch)
+
+        for row in await database.fetch_all(
+            sqlalchemy.select(heads.c.branch, heads.c.sha, heads.c.when)
+            .select_from(heads.join(branches, heads.c.branch == branches.c.id))
+            .where(where)
+            .order_by(heads.c.id)
+        ):
+            self._add_head(
+                self._branches[row["branch"]],
+                _HeadRecord(_pack_sha(row["sha"]), row["when"]),
+            )
 
-    async def _update_heads(self) -> None:
+        if len(loaded) > 0:
+            self._changes.record((b.repo, b.name) for b in loaded)
+        return loaded
+
+    def _add_branch(self, branch: _BranchRecord) -> None:
+        self._branches[branch.id] = branch
+        self._branches_by_name[(branch.repo, branch.name)] = branch
+
+    def _add_head(self, branch: _BranchRecord, head: _HeadRecord) -> None:
+        branch.heads.append(head)
+        self._head_keys.add((branch.id, head.sha))
+
+    def _evict_cutoff(self) -> dt:
+        return dt.utcnow() - timedelta(seconds=self.config.evict_closed_after)
+
+    def _evict_closed(self) -> None:
+        """
+        Forget about branches closed long enough ago. They remain in the
+        database, and are loaded back should they be reopened.
+        """
+        cutoff = self._evict_cutoff()
+        evicted = [
+            b
+            for b in self._branches.values()
+            if b.is_closed
+            and b.last_update is not None
+            and b.last_update < cutoff
+        ]
+        for branch in evicted:
+            del self._branches[branch.id]
+            del self._branches_by_name[(branch.repo, branch.name)]
+            for head in branch.heads:
+                self._head_keys.discard((branch.id, head.sha))
+
+        if len(evicted) > 0:
+            self._changes.record((b.repo, b.name) for b in evicted)
+            logger.info(f"evicted {len(evicted)} closed branches")
+
+    async def _restore_branches(self, gh_heads: List[GithubHead]) -> None:
+        """
+        Load back branches we have evicted, for heads of branches we don't
+        know about that are not closed.
+        """
+        wanted: Dict[str, Set[str]] = {}
+        for ghead in gh_heads:
+            if ghead.state == "closed":
+                continue
+            if (ghead.repo, ghead.head) in self._branches_by_name:
+                continue
+            wanted.setdefault(ghead.repo, set()).add(ghead.head)
+
+        branches = Branch.Meta.table
+        for repo, names in wanted.items():
+            for chunk in chunked(list(names)):
+                restored = await self._load_branches(
+                    sqlalchemy.and_(
+                        branches.c.repo == repo, branches.c.name.in_(chunk)
+                    )
+                )
+                for branch in restored:
+                    logger.debug(f"restored branch {repo} {branch.name}")
+
+    async def apply_heads(self, gh_heads: List[GithubHead]) -> None:
+        # Polling, for every repo, and webhooks apply heads, one batch at a
+        # time.
+        async with self._apply_lock:
+            await self._restore_branches(gh_heads)
+            await self._do_apply_heads(gh_heads)
+
+    async def _do_apply_heads(self, gh_heads: List[GithubHead]) -> None:
+        """
+        Work out which branches and heads are new, and which branches are
+        being closed or reopened, then write all of it in a single
+        transaction. Our in-memory state only changes once it has been
+        committed.
+        """
 
         skipped = 0
-        new_heads = 0
-        new_branches = 0
-        closed_branches = 0
-        reopened_branches = 0
+        new_heads: List[Tuple[_BranchRecord, bytes]] = []
+        new_branches: Dict[Tuple[str, str], _BranchRecord] = {}
+        # heads being added in this batch, as ((repo, branch), sha).
+        pending_heads: Set[Tuple[Tuple[str, str], bytes]] = set()
+        # open/closed state for existing branches, keyed by branch id.
+        pending_closed: Dict[int, bool] = {}
+        # current heads for existing branches, keyed by branch id.
+        pending_tips: Dict[int, bytes] = {}
+        # branches going back to a head we already know of.
+        returned: List[Tuple[_BranchRecord, bytes]] = []
+        closed_branches: List[_BranchRecord] = []
+        reopened = 0
+
+        def is_closed(branch: _BranchRecord) -> bool:
+            if branch.id is not None and branch.id in pending_closed:
+                return pending_closed[branch.id]
+            return branch.is_closed
+
+        def set_closed(branch: _BranchRecord, closed: bool) -> None:
+            if branch.id is None:
+                branch.is_closed = closed
+            else:
+                pending_closed[branch.id] = closed
 
-        logger.debug("update heads from github")
+        def tip(branch: _BranchRecord) -> Optional[bytes]:
+            if branch.id is not None and branch.id in pending_tips:
+                return pending_tips[branch.id]
+            return branch.tip
+
+        def set_tip(branch: _BranchRecord, sha: bytes) -> None:
+            if branch.id is None:
+                branch.tip = sha
+            else:
+                pending_tips[branch.id] = sha
+
+        def is_tracked(branch: _BranchRecord, sha: bytes) -> bool:
+            if ((branch.repo, branch.name), sha) in pending_heads:
+                return True
+            return (branch.id, sha) in self._head_keys
+
+        def add_head(branch: _BranchRecord, sha: bytes) -> None:
+            new_heads.append((branch, sha))
+            pending_heads.add(((branch.repo, branch.name), sha))
+            set_tip(branch, sha)
 
-        gh_heads = await self._get_heads()
         for ghead in gh_heads:
-            if ghead.head in self._branches_by_name:
+            branch_key = (ghead.repo, ghead.head)
+            sha = _pack_sha(ghead.sha)
+            existing = self._branches_by_name.get(
+                branch_key, new_branches.get(branch_key)
+            )
+            if existing is not None:
                 logger.debug(f"head {ghead.head} found")
 
-                existing: Branch = self._branches_by_name[ghead.head]
-                if existing.is_closed:
+                if is_closed(existing):
                     # what we have is closed, check if we need to open it.
                     if ghead.state != "closed":
-                        existing.is_closed = False
-                        await existing.update()
-                        reopened_branches += 1
+                        set_closed(existing, False)
+                        reopened += 1
                     else:
                         # skip ahead
                         skipped += 1
                         continue
 
-                if ghead.sha in self._heads_by_sha:
-                    found = False
-                    for h in self._heads_by_sha[ghead.sha]:
-                        if h.branch.name == ghead.head:
-                            found = True
-                            break
-                    if found:
-                        # head/sha already tracked
-                        skipped += 1
-                        continue
-                    else:
-                        # new sha for branch/PR
-                        new_head = Head(
-                            sha=ghead.sha,
-                            branch=existing,
-                        )
-                        self._heads_by_sha[ghead.sha].append(new_head)
-                        self._heads.append(new_head)
-                        await new_head.save()
-                        new_heads += 1
-                else:
-                    # new head for branch/PR
-                    new_head = Head(
-                        sha=ghead.sha,
-                        branch=existing,
-                    )
-                    self._heads.append(new_head)
-                    self._heads_by_sha[ghead.sha] = [new_head]
-                    await new_head.save()
-                    new_heads += 1
+                if not is_tracked(existing, sha):
+                    # new sha for branch/PR
+                    add_head(existing, sha)
+                elif tip(existing) != sha:
+                    # back to a sha we already track, e.g. after a
+                    # force-push.
+                    set_tip(existing, sha)
+                    returned.append((existing, sha))
+                elif ghead.state != "closed":
+                    # head/sha already tracked
+                    skipped += 1
+                    continue
 
                 if ghead.state == "closed":
-                    existing.is_closed = True
-                    await existing.update()
-                    closed_branches += 1
+                    set_closed(existing, True)
+                    closed_branches.append(existing)
             else:
                 logger.debug(f"new branch/PR: {ghead.head}")
                 # new branch/PR
@@ -179,84 +732,280 @@ class GithubMgr:
                     skipped += 1
                     continue
 
-                new_branch = Branch(
+                new_branch = _BranchRecord(
+                    id=None,
+                    repo=ghead.repo,
                     name=ghead.head,
                     source=ghead.source,
                     is_pull_request=ghead.is_pull_request,
                     pr_id=(-1 if not ghead.is_pull_request else ghead.id),
                     is_closed=False,
+                    last_update=None,
+                    tip=None,
                 )
-                new_head = Head(
-                    sha=ghead.sha,
-                    branch=new_branch,
-                )
-                self._branches.append(new_branch)
-                self._branches_by_name[new_branch.name] = new_branch
-                self._heads.append(new_head)
-                if new_head.sha not in self._heads_by_sha:
-                    self._heads_by_sha[new_head.sha] = []
-                self._heads_by_sha[new_head.sha].append(new_head)
-                await new_branch.save()
-                await new_head.save()
-                new_branches += 1
-                new_heads += 1
+                new_branches[branch_key] = new_branch
+                add_head(new_branch, sha)
+
+        if (
+            len(new_heads) > 0
+            or len(pending_closed) > 0
+            or len(pending_tips) > 0
+        ):
+            now = dt.utcnow()
+            branches, heads = await self._write_heads(
+                list(new_branches.values()),
+                new_heads,
+                pending_closed,
+                pending_tips,
+                now,
+            )
 
-            pass
+            # committed; now we can update our state.
+            changed: Set[Tuple[str, str]] = set()
+            for branch_id, closed in pending_closed.items():
+                branch = self._branches[branch_id]
+                branch.is_closed = closed
+                branch.last_update = now
+                changed.add((branch.repo, branch.name))
+            for branch_id, sha in pending_tips.items():
+                branch = self._branches[branch_id]
+                branch.tip = sha
+                changed.add((branch.repo, branch.name))
+            for row in branches:
+                branch = new_branches[(row.repo, row.name)]
+                branch.id = row.id
+                branch.last_update = row.last_update
+                self._add_branch(branch)
+            for row in heads:
+                branch = self._branches[row.branch.id]
+                self._add_head(
+                    branch, _HeadRecord(_pack_sha(row.sha), row.when)
+                )
+                changed.add((branch.repo, branch.name))
+            self._changes.record(changed)
+
+            for row in heads:
+                branch = self._branches[row.branch.id]
+                self._publish_new_head(branch, row.sha)
+            for branch, sha in returned:
+                self._publish_new_head(branch, sha.hex())
+            for branch in closed_branches:
+                self.events.publish(
+                    Event(
+                        what=EventTypeEnum.CLOSED_BRANCH,
+                        data={"repo": branch.repo, "branch": branch.name},
+                    )
+                )
 
         logger.info(
-            f"new(branches: {new_branches}, heads: {new_heads}), "
-            f"skipped: {skipped}, closed: {closed_branches}, "
-            f"reopened: {reopened_branches}"
+            f"new(branches: {len(new_branches)}, heads: {len(new_heads)}), "
+            f"returned: {len(returned)}, skipped: {skipped}, "
+            f"closed: {len(closed_branches)}, reopened: {reopened}"
         )
 
-    async def _get_heads(self) -> List[GithubHead]:
-        heads: List[GithubHead] = []
+    async def _write_heads(
+        self,
+        new_branches: List[_BranchRecord],
+        new_heads: List[Tuple[_BranchRecord, bytes]],
+        closed: Dict[int, bool],
+        tips: Dict[int, bytes],
+        now: dt,
+    ) -> Tuple[List[Branch], List[Head]]:
+        """
+        Write new branches and heads, and open/closed state and tip changes,
+        in a single transaction, through the write queue. Returns the new
+        branches and heads as stored.
+        """
+        table = Branch.Meta.table
+
+        async def write() -> Tuple[List[Branch], List[Head]]:
+            for value in (True, False):
+                ids = [i for i, c in closed.items() if c == value]
+                for chunk in chunked(ids):
+                    await Branch.objects.filter(Branch.id << chunk).update(
+                        is_closed=value, last_update=now
+                    )
 
-        repo = self.gh.get_repo(self.repo)
-        default_branch = repo.get_branch(repo.default_branch)
-        sha: str = default_branch.commit.sha
+            # each branch binds its id twice, and its tip.
+            for chunk in chunked(list(tips.items()), 3):
+                await database.execute(
+                    table.update()
+                    .where(table.c.id.in_([i for i, _ in chunk]))
+                    .values(
+                        tip=sqlalchemy.case(
+                            {i: sha.hex() for i, sha in chunk},
+                            value=table.c.id,
+                        )
+                    )
+                )
 
-        heads.append(
-            GithubHead(
-                head=default_branch.name,
-                source=default_branch.name,
-                sha=sha,
+            last_branch = await last_id(Branch.Meta.table)
+            for chunk in chunked(new_branches, row_params(Branch.Meta.table)):
+                await Branch.objects.bulk_create(
+                    [
+                        Branch(
+                            repo=b.repo,
+                            name=b.name,
+                            source=b.source,
+                            is_pull_request=b.is_pull_request,
+                            pr_id=b.pr_id,
+                            is_closed=b.is_closed,
+                            tip=(None if b.tip is None else b.tip.hex()),
+                        )
+                        for b in chunk
+                    ]
+                )
+            branches = await Branch.objects.filter(
+                Branch.id > last_branch
+            ).all()
+            branch_ids: Dict[Tuple[str, str], int] = {
+                (b.repo, b.name): b.id for b in branches
+            }
+
+            last_head = await last_id(Head.Meta.table)
+            for chunk in chunked(new_heads, row_params(Head.Meta.table)):
+                await Head.objects.bulk_create(
+                    [
+                        Head(
+                            repo=branch.repo,
+                            sha=sha.hex(),
+                            branch=(
+                                branch.id
+                                if branch.id is not None
+                                else branch_ids[(branch.repo, branch.name)]
+                            ),
+                        )
+                        for branch, sha in chunk
+                    ]
+                )
+            heads = await Head.objects.filter(Head.id > last_head).all()
+            return branches, heads
+
+        return await writes.submit(write)
+
+    async def handle_event(self, event: str, payload: Dict[str, Any]) -> None:
+        """
+        Apply a GitHub webhook event. Only pushes to the default branch and
+        pull request events matter to us; everything else is ignored.
+        """
+        repo = payload.get("repository", {}).get("full_name")
+        if repo not in self.repos:
+            logger.debug(f"ignoring '{event}' event for repo '{repo}'")
+            return
+
+        ghead: Optional[GithubHead] = None
+        if event == "push":
+            default_branch: str = payload["repository"]["default_branch"]
+            if payload["ref"] != f"refs/heads/{default_branch}":
+                return
+            if payload.get("deleted", False):
+                return
+            ghead = GithubHead(
+                repo=repo,
+                head=default_branch,
+                source=default_branch,
+                sha=payload["after"],
                 is_pull_request=False,
                 id=None,
                 state=None,
             )
+        elif event == "pull_request":
+            pr = payload["pull_request"]
+            ghead = GithubHead(
+                repo=repo,
+                head=f"pull/{pr['number']}/head",
+                source=pr["head"]["label"],
+                sha=pr["head"]["sha"],
+                is_pull_request=True,
+                id=pr["number"],
+                state=pr["state"],
+            )
+
+        if ghead is None:
+            logger.debug(f"ignoring '{event}' event")
+            return
+
+        logger.debug(
+            f"'{event}' event for {repo} {ghead.head} (sha: {ghead.sha})"
         )
+        await self.apply_heads([ghead])
 
-        pulls = repo.get_pulls()
-        for pr in pulls:
-            heads.append(
-                GithubHead(
-                    head=f"pull/{pr.number}/head",
-                    source=pr.head.label,
-                    sha=pr.head.sha,
-                    is_pull_request=True,
-                    id=pr.number,
-                    state=pr.state,
-                )
+    def _publish_new_head(self, branch: _BranchRecord, sha: str) -> None:
+        self.events.publish(
+            Event(
+                what=EventTypeEnum.NEW_HEAD,
+                data={"repo": branch.repo, "branch": branch.name, "sha": sha},
             )
+        )
 
-        return heads
+    @property
+    def version(self) -> int:
+        """Changes whenever the branches or heads we track change."""
+        return self._changes.revision
 
     async def get_heads(self) -> List[GithubBranch]:
-        heads: List[GithubBranch] = []
-
-        for b in await Branch.objects.all():
-            commits: List[GithubCommit] = []
-            for h in await Head.objects.all(Head.branch.name == b.name):
-                commits.append(GithubCommit(sha=h.sha, when=h.when))
-            heads.append(
-                GithubBranch(
-                    name=b.name,
-                    source=b.source,
-                    commits=commits,
-                    is_pull_request=b.is_pull_request,
-                    id=(None if not b.is_pull_request else b.pr_id),
-                    state=("closed" if b.is_closed else "open"),
-                )
+        """
+        Obtain all branches and their heads, from memory. The result is
+        shared between callers until something changes, and must not be
+        modified.
+        """
+        if self._snapshot_version != self.version:
+            self._snapshot = self._build_snapshot()
+            self._snapshot_version = self.version
+        return self._snapshot
+
+    async def get_heads_since(self, revision: int) -> GithubHeadsDelta:
+        """
+        Obtain the branches that changed after `revision`, along with the
+        ones we no longer track. Should we not know what changed since then,
+        all branches are returned instead, as a full resync.
+        """
+        changed = self._changes.changed_since(revision)
+        if changed is None:
+            return GithubHeadsDelta(
+                revision=self.version,
+                full=True,
+                branches=await self.get_heads(),
+                removed=[],
             )
-        return heads
+
+        branches: List[GithubBranch] = []
+        removed: List[GithubBranchRef] = []
+        for repo, name in changed:
+            branch = self._branches_by_name.get((repo, name))
+            if branch is None:
+                removed.append(GithubBranchRef(repo=repo, name=name))
+            else:
+                branches.append(_branch_to_api(branch))
+        return GithubHeadsDelta(
+            revision=self.version,
+            full=False,
+            branches=branches,
+            removed=removed,
+        )
+
+    def _build_snapshot(self) -> List[GithubBranch]:
+        return [_branch_to_api(b) for _, b in sorted(self._branches.items())]
+
+
+def _branch_to_api(b: _BranchRecord) -> GithubBranch:
+    commits: List[GithubCommit] = [
+        GithubCommit(sha=h.sha.hex(), when=h.when) for h in b.heads
+    ]
+    return GithubBranch(
+        repo=b.repo,
+        name=b.name,
+        source=b.source,
+        commits=commits,
+        is_pull_request=b.is_pull_request,
+        id=(None if not b.is_pull_request else b.pr_id),
+        state=("closed" if b.is_closed else "open"),
+    )
+
+
+def _pack_sha(sha: str) -> bytes:
+    return bytes.fromhex(sha)
+
+
+def _parse_time(value: str) -> dt:
+    return dt.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,174 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+import requests
+import requests.adapters
+
+
+class GithubError(Exception):
+    """An error talking to GitHub. There's no status if we got no reply."""
+
+    status: Optional[int]
+    msg: str
+
+    def __init__(self, status: Optional[int], msg: str) -> None:
+        self.status = status
+        self.msg = msg
+
+    def __str__(self) -> str:
+        if self.status is None:
+            return f"github error: {self.msg}"
+        return f"github error ({self.status}): {self.msg}"
+
+
+class GithubReply:
+    """A reply from GitHub, possibly obtained from our cache."""
+
+    data: Any
+    links: Dict[str, str]
+    changed: bool
+
+    def __init__(self, data: Any, links: Dict[str, str], changed: bool) -> None:
+        self.data = data
+        self.links = links
+        self.changed = changed
+
+    @property
+    def last_page(self) -> int:
+        """Number of pages for a paginated reply, as told by its links."""
+        if "last" not in self.links:
+            return 1
+        query = parse_qs(urlparse(self.links["last"]).query)
+        return int(query["page"][0])
+
+
+class GithubClient:
+    """
+    Minimal, thread-safe, GitHub REST API client. Replies are cached along
+    with their ETags, so repeated requests are conditional: when nothing
+    changed, GitHub replies with 304 Not Modified, which does not count
+    against our rate limit, and we serve the cached reply instead.
+    """
+
+    url: str
+    rate_limit_remaining: Optional[int]
+    rate_limit_reset: Optional[float]
+    num_requests: int
+    num_not_modified: int
+    _session: requests.Session
+    _cache: Dict[str, Tuple[str, GithubReply]]
+    _lock: threading.Lock
+
+    def __init__(self, token: str, url: str, pool_size: int) -> None:
+        self.url = url.rstrip("/")
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
+        self.num_requests = 0
+        self.num_not_modified = 0
+        self._session = requests.Session()
+        self._session.headers.update(
+            {
+                "Accept": "application/vnd.github+json",
+                "Authorization": f"token {token}",
+                "User-Agent": "tstr",
+            }
+        )
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, path: str, params: Optional[Dict[str, Any]] = None
+    ) -> GithubReply:
+        key = path
+        if params is not None and len(params) > 0:
+            key = f"{path}?{urlencode(sorted(params.items()))}"
+
+        headers: Dict[str, str] = {}
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            headers["If-None-Match"] = cached[0]
+
+        try:
+            res = self._session.get(
+                f"{self.url}{path}", params=params, headers=headers, timeout=30
+            )
+        except requests.RequestException as e:
+            raise GithubError(None, str(e))
+        self._update_rate_limit(res)
+
+        with self._lock:
+            self.num_requests += 1
+            if res.status_code == 304 and cached is not None:
+                self.num_not_modified += 1
+                reply = cached[1]
+                return GithubReply(reply.data, reply.links, changed=False)
+
+        if res.status_code != 200:
+            raise GithubError(res.status_code, res.text)
+
+        links: Dict[str, str] = {
+            rel: link["url"] for rel, link in res.links.items()
+        }
+        try:
+            data = res.json()
+        except ValueError as e:
+            raise GithubError(res.status_code, f"invalid reply: {e}")
+        reply = GithubReply(data, links, changed=True)
+        etag = res.headers.get("ETag")
+        if etag is not None:
+            with self._lock:
+                self._cache[key] = (etag, reply)
+        return reply
+
+    def forget(self, path: str) -> None:
+        """
+        Forget cached replies for `path`, and for paths below it, so they are
+        fetched, and reported as changed, again.
+        """
+        with self._lock:
+            for key in [
+                k
+                for k in self._cache
+                if k == path or k.startswith((f"{path}/", f"{path}?"))
+            ]:
+                del self._cache[key]
+
+    def _update_rate_limit(self, res: requests.Response) -> None:
+        remaining = res.headers.get("X-RateLimit-Remaining")
+        reset = res.headers.get("X-RateLimit-Reset")
+        try:
+            with self._lock:
+                if remaining is not None:
+                    self.rate_limit_remaining = int(remaining)
+                if reset is not None:
+                    self.rate_limit_reset = float(reset)
+        except ValueError:
+            pass
+
+    def seconds_until_reset(self) -> Optional[float]:
+        if self.rate_limit_reset is None:
+            return None
+        return max(self.rate_limit_reset - time.time(), 0.0)
+
+    def close(self) -> None:
+        self._session.close()
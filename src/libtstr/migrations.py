@@ -0,0 +1,444 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+# pyright: reportUnknownMemberType=false
+
+from typing import Callable, List, NamedTuple, Optional
+from fastapi.logger import logger
+import sqlalchemy
+from sqlalchemy.engine import Connection
+
+from libtstr import db
+from libtstr.config import TstrConfig
+
+# make sure all our tables are known to the metadata.
+import libtstr.orm.bench  # noqa: F401
+import libtstr.orm.heads  # noqa: F401
+import libtstr.orm.workqueue  # noqa: F401
+
+
+MigrationFn = Callable[[Connection, TstrConfig], None]
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    fn: MigrationFn
+
+
+class MigrationError(Exception):
+    pass
+
+
+_migrations: List[Migration] = []
+
+# the schema version lives outside our models' metadata, so it's never
+# created along with them.
+_version_metadata = sqlalchemy.MetaData()
+_version_table = sqlalchemy.Table(
+    "schema_version",
+    _version_metadata,
+    sqlalchemy.Column("version", sqlalchemy.Integer, nullable=False),
+)
+
+
+def migration(description: str) -> Callable[[MigrationFn], MigrationFn]:
+    """
+    Register a migration. Migrations are applied in the order they are
+    registered, and must never be reordered or removed once released; each
+    one gets the next schema version.
+    """
+
+    def decorator(fn: MigrationFn) -> MigrationFn:
+        _migrations.append(Migration(len(_migrations) + 1, description, fn))
+        return fn
+
+    return decorator
+
+
+def latest_version() -> int:
+    return len(_migrations)
+
+
+def migrate(config: TstrConfig) -> None:
+    """
+    Bring the database schema up to date. A new database is created at the
+    latest version; an existing one gets any migrations it's missing, each
+    in its own transaction. Databases from before we tracked the schema
+    version are at version 0.
+    """
+    engine = db.engine
+    with engine.begin() as conn:
+        _version_table.create(conn, checkfirst=True)
+        version = _get_version(conn)
+        if version is None:
+            tables = sqlalchemy.inspect(conn).get_table_names()
+            if "branches" not in tables:
+                logger.info(f"creating database at version {latest_version()}")
+                db.metadata.create_all(conn, checkfirst=True)
+                _set_version(conn, latest_version())
+                return
+            version = 0
+
+    if version > latest_version():
+        raise MigrationError(
+            f"database schema version {version} is newer than "
+            f"supported version {latest_version()}"
+        )
+
+    for m in _migrations[version:]:
+        logger.info(
+            f"migrating database to version {m.version}: {m.description}"
+        )
+        with engine.begin() as conn:
+            m.fn(conn, config)
+            _set_version(conn, m.version)
+
+
+def _get_version(conn: Connection) -> Optional[int]:
+    return conn.execute(
+        sqlalchemy.select(_version_table.c.version)
+    ).scalar_one_or_none()
+
+
+def _set_version(conn: Connection, version: int) -> None:
+    conn.execute(_version_table.delete())
+    conn.execute(_version_table.insert().values(version=version))
+
+
+def _add_column(
+    conn: Connection, table: str, column: sqlalchemy.Column
+) -> None:
+    columns = [c["name"] for c in sqlalchemy.inspect(conn).get_columns(table)]
+    if column.name in columns:
+        return
+    spec = column.type.compile(dialect=conn.dialect)
+    if column.server_default is not None:
+        default = column.server_default.arg  # type: ignore
+        spec += f" DEFAULT {default}"
+    conn.exec_driver_sql(
+        f'ALTER TABLE {table} ADD COLUMN "{column.name}" {spec}'
+    )
+
+
+def _create_index(conn: Connection, table: str, *columns: str) -> None:
+    name = f"ix_{table}_{'_'.join(columns)}"
+    indexes = [i["name"] for i in sqlalchemy.inspect(conn).get_indexes(table)]
+    if name in indexes:
+        return
+    cols = ", ".join(f'"{c}"' for c in columns)
+    conn.exec_driver_sql(f"CREATE INDEX {name} ON {table} ({cols})")
+
+
+#
+# Migrations. Table definitions here are frozen as of their migration, and
+# must not follow later changes to the models.
+#
+
+
+@migration("workqueue leases and priorities")
+def _wq_leases(conn: Connection, config: TstrConfig) -> None:
+    _add_column(
+        conn,
+        "workqueue",
+        sqlalchemy.Column("priority", sqlalchemy.Integer, server_default="0"),
+    )
+    _add_column(
+        conn, "workqueue", sqlalchemy.Column("worker", sqlalchemy.String(1024))
+    )
+    _add_column(
+        conn, "workqueue", sqlalchemy.Column("lease", sqlalchemy.String(64))
+    )
+    _add_column(
+        conn,
+        "workqueue",
+        sqlalchemy.Column("lease_expires", sqlalchemy.DateTime),
+    )
+
+
+@migration("github sync state")
+def _github_sync(conn: Connection, config: TstrConfig) -> None:
+    meta = sqlalchemy.MetaData()
+    sqlalchemy.Table(
+        "github_sync",
+        meta,
+        sqlalchemy.Column("repo", sqlalchemy.String(1024), primary_key=True),
+        sqlalchemy.Column("pulls_watermark", sqlalchemy.DateTime),
+        sqlalchemy.Column("last_full_sync", sqlalchemy.DateTime),
+    )
+    meta.create_all(conn, checkfirst=True)
+
+
+@migration("branches and heads per repository")
+def _multi_repo(conn: Connection, config: TstrConfig) -> None:
+    # Branches were keyed by name, and heads referred to them by name. The
+    # new tables are built alongside, and renamed into place; existing
+    # branches and heads belong to the first repository we track.
+    repo = config.gh.repos[0]
+    meta = sqlalchemy.MetaData()
+    branches = sqlalchemy.Table(
+        "branches_new",
+        meta,
+        sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column("repo", sqlalchemy.String(1024), nullable=False),
+        sqlalchemy.Column("name", sqlalchemy.String(1024), nullable=False),
+        sqlalchemy.Column("source", sqlalchemy.String(1024), nullable=False),
+        sqlalchemy.Column("is_pull_request", sqlalchemy.Boolean),
+        sqlalchemy.Column("pr_id", sqlalchemy.Integer),
+        sqlalchemy.Column("is_closed", sqlalchemy.Boolean),
+        sqlalchemy.Column(
+            "last_update",
+            sqlalchemy.DateTime,
+            server_default=sqlalchemy.func.now(),
+        ),
+        sqlalchemy.UniqueConstraint(
+            "repo", "name", name="uc_branches_repo_name"
+        ),
+    )
+    heads = sqlalchemy.Table(
+        "branch_heads_new",
+        meta,
+        sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column("repo", sqlalchemy.String(1024), nullable=False),
+        sqlalchemy.Column("sha", sqlalchemy.String(1024), nullable=False),
+        sqlalchemy.Column(
+            "branch",
+            sqlalchemy.Integer,
+            sqlalchemy.ForeignKey(
+                "branches_new.id", name="fk_branch_heads_branches_id_branch"
+            ),
+        ),
+        sqlalchemy.Column(
+            "when", sqlalchemy.DateTime, server_default=sqlalchemy.func.now()
+        ),
+    )
+    meta.create_all(conn)
+
+    conn.execute(
+        sqlalchemy.text(
+            "INSERT INTO branches_new "
+            "(repo, name, source, is_pull_request, pr_id, is_closed, "
+            "last_update) "
+            "SELECT :repo, name, source, is_pull_request, pr_id, is_closed, "
+            "last_update FROM branches ORDER BY rowid"
+        ),
+        {"repo": repo},
+    )
+    conn.execute(
+        sqlalchemy.text(
+            'INSERT INTO branch_heads_new (id, repo, sha, branch, "when") '
+            'SELECT h.id, :repo, h.sha, b.id, h."when" '
+            "FROM branch_heads h JOIN branches_new b ON b.name = h.branch"
+        ),
+        {"repo": repo},
+    )
+
+    conn.exec_driver_sql("DROP TABLE branch_heads")
+    conn.exec_driver_sql("DROP TABLE branches")
+    # renaming updates references to the renamed table, including the
+    # new heads' foreign key.
+    conn.exec_driver_sql(f"ALTER TABLE {branches.name} RENAME TO branches")
+    conn.exec_driver_sql(f"ALTER TABLE {heads.name} RENAME TO branch_heads")
+
+
+@migration("indexes on frequently looked up columns")
+def _lookup_indexes(conn: Connection, config: TstrConfig) -> None:
+    _create_index(conn, "branch_heads", "sha")
+    _create_index(conn, "jobs", "head")
+    _create_index(conn, "workqueue", "state")
+    _create_index(conn, "benchmark_results", "version")
+    _create_index(conn, "benchmark_results", "date")
+
+
+@migration("benchmark op results keyed on their result")
+def _bench_ops_fk(conn: Connection, config: TstrConfig) -> None:
+    # Op results were linked to their result through a join table, even
+    # though each belongs to exactly one. Should a result have several ops
+    # by the same name, we keep the first.
+    meta = sqlalchemy.MetaData()
+    sqlalchemy.Table(
+        "benchmark_results",
+        meta,
+        sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    )
+    ops = sqlalchemy.Table(
+        "benchmark_results_ops_new",
+        meta,
+        sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column(
+            "result",
+            sqlalchemy.Integer,
+            sqlalchemy.ForeignKey(
+                "benchmark_results.id",
+                name="fk_benchmark_results_ops_benchmark_results_id_result",
+            ),
+        ),
+        sqlalchemy.Column("name", sqlalchemy.String(100), nullable=False),
+        sqlalchemy.Column("percent", sqlalchemy.Integer, nullable=False),
+        sqlalchemy.Column("ops_per_sec", sqlalchemy.Float, nullable=False),
+        sqlalchemy.Column("objs_per_sec", sqlalchemy.Float, nullable=False),
+        sqlalchemy.Column("bytes_per_sec", sqlalchemy.Integer, nullable=False),
+        sqlalchemy.UniqueConstraint(
+            "result", "name", name="uc_benchmark_results_ops_result_name"
+        ),
+    )
+    ops.create(conn)
+
+    conn.exec_driver_sql(
+        f"INSERT INTO {ops.name} "
+        "(id, result, name, percent, ops_per_sec, objs_per_sec, "
+        "bytes_per_sec) "
+        "SELECT o.id, x.result, o.name, o.percent, o.ops_per_sec, "
+        "o.objs_per_sec, o.bytes_per_sec "
+        "FROM benchmark_result_x_ops x "
+        "JOIN benchmark_results_ops o ON o.id = x.opresult "
+        "WHERE x.id IN ("
+        "SELECT MIN(x2.id) FROM benchmark_result_x_ops x2 "
+        "JOIN benchmark_results_ops o2 ON o2.id = x2.opresult "
+        "GROUP BY x2.result, o2.name)"
+    )
+
+    conn.exec_driver_sql("DROP TABLE benchmark_result_x_ops")
+    conn.exec_driver_sql("DROP TABLE benchmark_results_ops")
+    conn.exec_driver_sql(
+        f"ALTER TABLE {ops.name} RENAME TO benchmark_results_ops"
+    )
+
+
+@migration("index on benchmark result parameters")
+def _bench_params_index(conn: Connection, config: TstrConfig) -> None:
+    _create_index(conn, "benchmark_results", "workload", "objsize", "threads")
+
+
+@migration("benchmark trends")
+def _bench_trends(conn: Connection, config: TstrConfig) -> None:
+    # Trends are built from the results we already have, per day. Their
+    # variances are computed from sums of squares here, which is less
+    # precise than merging as we go, but good enough to start from.
+    meta = sqlalchemy.MetaData()
+    metrics = ("ops_per_sec", "objs_per_sec", "bytes_per_sec")
+    stats = ("mean", "min", "max", "m2")
+    trends = sqlalchemy.Table(
+        "benchmark_trends",
+        meta,
+        sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column("workload", sqlalchemy.String(100), nullable=False),
+        sqlalchemy.Column("objsize", sqlalchemy.String(100), nullable=False),
+        sqlalchemy.Column("threads", sqlalchemy.Integer, nullable=False),
+        sqlalchemy.Column("op", sqlalchemy.String(100), nullable=False),
+        sqlalchemy.Column("bucket", sqlalchemy.Date, nullable=False),
+        sqlalchemy.Column("count", sqlalchemy.Integer, nullable=False),
+        *[
+            sqlalchemy.Column(f"{m}_{s}", sqlalchemy.Float, nullable=False)
+            for m in metrics
+            for s in stats
+        ],
+        sqlalchemy.UniqueConstraint(
+            "workload",
+            "objsize",
+            "threads",
+            "op",
+            "bucket",
+            name="uc_benchmark_trends_workload_objsize_threads_op_bucket",
+        ),
+    )
+    trends.create(conn)
+
+    columns = ", ".join(f"{m}_{s}" for m in metrics for s in stats)
+    aggregates = ", ".join(
+        f"AVG(CAST(o.{m} AS REAL)), MIN(o.{m}), MAX(o.{m}), "
+        f"MAX(0.0, SUM(CAST(o.{m} AS REAL) * o.{m}) "
+        f"- SUM(CAST(o.{m} AS REAL)) * SUM(o.{m}) / COUNT(*))"
+        for m in metrics
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO benchmark_trends "
+        f"(workload, objsize, threads, op, bucket, count, {columns}) "
+        "SELECT r.workload, r.objsize, r.threads, o.name, DATE(r.date), "
+        f"COUNT(*), {aggregates} "
+        "FROM benchmark_results_ops o "
+        "JOIN benchmark_results r ON r.id = o.result "
+        "GROUP BY r.workload, r.objsize, r.threads, o.name, DATE(r.date)"
+    )
+
+
+@migration("benchmark regressions")
+def _bench_regressions(conn: Connection, config: TstrConfig) -> None:
+    # Regressions are only looked for as results come in; past results are
+    # not checked.
+    meta = sqlalchemy.MetaData()
+    sqlalchemy.Table(
+        "benchmark_results",
+        meta,
+        sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    )
+    regressions = sqlalchemy.Table(
+        "benchmark_regressions",
+        meta,
+        sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column(
+            "result",
+            sqlalchemy.Integer,
+            sqlalchemy.ForeignKey(
+                "benchmark_results.id",
+                name="fk_benchmark_regressions_benchmark_results_id_result",
+            ),
+        ),
+        sqlalchemy.Column("workload", sqlalchemy.String(100), nullable=False),
+        sqlalchemy.Column("objsize", sqlalchemy.String(100), nullable=False),
+        sqlalchemy.Column("threads", sqlalchemy.Integer, nullable=False),
+        sqlalchemy.Column("op", sqlalchemy.String(100), nullable=False),
+        sqlalchemy.Column("metric", sqlalchemy.String(100), nullable=False),
+        sqlalchemy.Column("baseline_median", sqlalchemy.Float, nullable=False),
+        sqlalchemy.Column("recent_median", sqlalchemy.Float, nullable=False),
+        sqlalchemy.Column("change", sqlalchemy.Float, nullable=False),
+        sqlalchemy.Column("p_value", sqlalchemy.Float, nullable=False),
+        sqlalchemy.Column(
+            "detected",
+            sqlalchemy.DateTime,
+            server_default=sqlalchemy.func.now(),
+        ),
+    )
+    regressions.create(conn)
+    _create_index(
+        conn, "benchmark_regressions", "workload", "objsize", "threads", "op"
+    )
+    _create_index(conn, "benchmark_regressions", "detected")
+
+
+@migration("workqueue attempts")
+def _wq_attempts(conn: Connection, config: TstrConfig) -> None:
+    _add_column(
+        conn,
+        "workqueue",
+        sqlalchemy.Column("attempts", sqlalchemy.Integer, server_default="0"),
+    )
+
+
+@migration("workqueue lease index")
+def _wq_lease_index(conn: Connection, config: TstrConfig) -> None:
+    # heartbeats and completions look entries up by lease.
+    _create_index(conn, "workqueue", "lease")
+
+
+@migration("branch tips")
+def _branch_tips(conn: Connection, config: TstrConfig) -> None:
+    # a branch's tip was its newest head.
+    _add_column(
+        conn, "branches", sqlalchemy.Column("tip", sqlalchemy.String(1024))
+    )
+    conn.exec_driver_sql(
+        "UPDATE branches SET tip = ("
+        "SELECT h.sha FROM branch_heads h WHERE h.branch = branches.id "
+        "ORDER BY h.id DESC LIMIT 1)"
+    )
+    _create_index(conn, "branches", "tip")
@@ -15,16 +15,11 @@
 # pyright: reportIncompatibleVariableOverride=false
 # pyright: reportUnknownMemberType=false
 
-from datetime import datetime as dt
-from typing import List, Optional
+from datetime import date, datetime as dt
 import ormar
 from sqlalchemy import func
-from pydantic.typing import ForwardRef
 
-from libtstr.db import BaseMeta, engine
-
-
-ThroughRef = ForwardRef("ResultToOpResult")
+from libtstr.db import BaseMeta
 
 
 class User(ormar.Model):
@@ -55,50 +50,115 @@ class Token(ormar.Model):
     host: Host = ormar.ForeignKey(Host)
 
 
+class Result(ormar.Model):
+    class Meta(BaseMeta):
+        tablename = "benchmark_results"
+        constraints = [
+            ormar.IndexColumns("version", name="ix_benchmark_results_version"),
+            ormar.IndexColumns("date", name="ix_benchmark_results_date"),
+            ormar.IndexColumns(
+                "workload",
+                "objsize",
+                "threads",
+                name="ix_benchmark_results_workload_objsize_threads",
+            ),
+        ]
+
+    id: int = ormar.Integer(primary_key=True)
+    # submitter: Token = ormar.ForeignKey(Token)
+    version: str = ormar.String(max_length=1024)
+    date: dt = ormar.DateTime(server_default=func.now())
+    duration: float = ormar.Float()
+    threads: int = ormar.Integer()
+    workload: str = ormar.String(max_length=100)
+    objsize: str = ormar.String(max_length=100)
+    num_objects: int = ormar.Integer()
+    duration_str: str = ormar.String(max_length=100)
+
+
 class OpResult(ormar.Model):
     class Meta(BaseMeta):
         tablename = "benchmark_results_ops"
+        # an op result belongs to one result, which has one of each op.
+        constraints = [ormar.UniqueColumns("result", "name")]
 
     id: int = ormar.Integer(primary_key=True)
+    result: Result = ormar.ForeignKey(Result, related_name="ops")
     name: str = ormar.String(max_length=100)
-    # result: Result = ormar.ForeignKey(Result, related_name="ops")
     percent: int = ormar.Integer()
     ops_per_sec: float = ormar.Float()
     objs_per_sec: float = ormar.Float()
     bytes_per_sec: int = ormar.Integer()
 
 
-class ResultToOpResult(ormar.Model):
+class ResultTrend(ormar.Model):
+    """
+    Running statistics of an op's results, for one benchmark shape, over
+    one day. Variances are kept as the sum of squared differences from the
+    mean, so that new results can be merged in.
+    """
+
     class Meta(BaseMeta):
-        tablename = "benchmark_result_x_ops"
+        tablename = "benchmark_trends"
+        constraints = [
+            ormar.UniqueColumns(
+                "workload", "objsize", "threads", "op", "bucket"
+            )
+        ]
 
     id: int = ormar.Integer(primary_key=True)
+    workload: str = ormar.String(max_length=100)
+    objsize: str = ormar.String(max_length=100)
+    threads: int = ormar.Integer()
+    op: str = ormar.String(max_length=100)
+    bucket: date = ormar.Date()
+    count: int = ormar.Integer()
+    ops_per_sec_mean: float = ormar.Float()
+    ops_per_sec_min: float = ormar.Float()
+    ops_per_sec_max: float = ormar.Float()
+    ops_per_sec_m2: float = ormar.Float()
+    objs_per_sec_mean: float = ormar.Float()
+    objs_per_sec_min: float = ormar.Float()
+    objs_per_sec_max: float = ormar.Float()
+    objs_per_sec_m2: float = ormar.Float()
+    bytes_per_sec_mean: float = ormar.Float()
+    bytes_per_sec_min: float = ormar.Float()
+    bytes_per_sec_max: float = ormar.Float()
+    bytes_per_sec_m2: float = ormar.Float()
+
+
+class Regression(ormar.Model):
+    """
+    A drop in an op's performance, flagged when `result` was ingested, by
+    comparing the most recent results for its benchmark shape with those
+    before them.
+    """
 
-
-class Result(ormar.Model):
     class Meta(BaseMeta):
-        tablename = "benchmark_results"
+        tablename = "benchmark_regressions"
+        constraints = [
+            ormar.IndexColumns(
+                "workload",
+                "objsize",
+                "threads",
+                "op",
+                name="ix_benchmark_regressions_workload_objsize_threads_op",
+            ),
+            ormar.IndexColumns(
+                "detected", name="ix_benchmark_regressions_detected"
+            ),
+        ]
 
     id: int = ormar.Integer(primary_key=True)
-    # submitter: Token = ormar.ForeignKey(Token)
-    version: str = ormar.String(max_length=1024)
-    date: dt = ormar.DateTime(server_default=func.now())
-    duration: float = ormar.Float()
-    threads: int = ormar.Integer()
+    result: Result = ormar.ForeignKey(Result, related_name="regressions")
     workload: str = ormar.String(max_length=100)
     objsize: str = ormar.String(max_length=100)
-    num_objects: int = ormar.Integer()
-    duration_str: str = ormar.String(max_length=100)
-    ops: Optional[List[OpResult]] = ormar.ManyToMany(
-        OpResult, through=ResultToOpResult
-    )
-
-
-Result.update_forward_refs()
-
-User.Meta.table.create(engine, checkfirst=True)
-Host.Meta.table.create(engine, checkfirst=True)
-Token.Meta.table.create(engine, checkfirst=True)
-OpResult.Meta.table.create(engine, checkfirst=True)
-Result.Meta.table.create(engine, checkfirst=True)
-ResultToOpResult.Meta.table.create(engine, checkfirst=True)
+    threads: int = ormar.Integer()
+    op: str = ormar.String(max_length=100)
+    metric: str = ormar.String(max_length=100)
+    baseline_median: float = ormar.Float()
+    recent_median: float = ormar.Float()
+    # relative change of the median, negative for drops.
+    change: float = ormar.Float()
+    p_value: float = ormar.Float()
+    detected: dt = ormar.DateTime(server_default=func.now())
@@ -17,9 +17,10 @@
 
 import ormar
 from datetime import datetime as dt
+from typing import Optional
 from sqlalchemy import func
 
-from libtstr.db import BaseMeta, engine
+from libtstr.db import BaseMeta
 
 
 # class HeadStateEnum(Enum):
@@ -47,24 +48,41 @@ from libtstr.db import BaseMeta, engine
 class Branch(ormar.Model):
     class Meta(BaseMeta):
         tablename = "branches"
+        constraints = [
+            ormar.UniqueColumns("repo", "name"),
+            ormar.IndexColumns("tip", name="ix_branches_tip"),
+        ]
 
-    name: str = ormar.String(max_length=1024, primary_key=True)
+    id: int = ormar.Integer(primary_key=True)
+    repo: str = ormar.String(max_length=1024)
+    name: str = ormar.String(max_length=1024)
     source: str = ormar.String(max_length=1024)
     is_pull_request: bool = ormar.Boolean(default=False)
     pr_id: int = ormar.Integer(default=-1)
     is_closed: bool = ormar.Boolean(default=False)
     last_update: dt = ormar.DateTime(server_default=func.now())
+    # sha of the branch's current head; not necessarily its newest head, as
+    # a branch can go back to an earlier one.
+    tip: Optional[str] = ormar.String(max_length=1024, nullable=True)
 
 
 class Head(ormar.Model):
     class Meta(BaseMeta):
         tablename = "branch_heads"
+        constraints = [ormar.IndexColumns("sha", name="ix_branch_heads_sha")]
 
     id: int = ormar.Integer(primary_key=True)
+    repo: str = ormar.String(max_length=1024)
     sha: str = ormar.String(max_length=1024)
     branch: Branch = ormar.ForeignKey(Branch)
     when: dt = ormar.DateTime(server_default=func.now())
 
 
-Branch.Meta.table.create(engine, checkfirst=True)
-Head.Meta.table.create(engine, checkfirst=True)
+class GithubSync(ormar.Model):
+    class Meta(BaseMeta):
+        tablename = "github_sync"
+
+    repo: str = ormar.String(max_length=1024, primary_key=True)
+    # most recent pull request update we have seen.
+    pulls_watermark: Optional[dt] = ormar.DateTime(nullable=True)
+    last_full_sync: Optional[dt] = ormar.DateTime(nullable=True)
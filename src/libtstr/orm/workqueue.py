@@ -17,10 +17,11 @@
 
 from enum import Enum
 from datetime import datetime as dt
+from typing import Optional
 import ormar
 from sqlalchemy import func
 
-from libtstr.db import BaseMeta, engine
+from libtstr.db import BaseMeta
 from libtstr.orm.heads import Head
 
 
@@ -34,6 +35,8 @@ class JobStateEnum(Enum):
     WAITING = 0
     RUNNING = 1
     FINISHED = 2
+    CANCELLED = 3
+    FAILED = 4
 
 
 class WQStateEnum(Enum):
@@ -41,11 +44,14 @@ class WQStateEnum(Enum):
     ASSIGNED = 1
     RUNNING = 2
     DONE = 3
+    CANCELLED = 4
+    FAILED = 5
 
 
 class Job(ormar.Model):
     class Meta(BaseMeta):
         tablename = "jobs"
+        constraints = [ormar.IndexColumns("head", name="ix_jobs_head")]
 
     id: int = ormar.Integer(primary_key=True)
     head: Head = ormar.ForeignKey(Head)
@@ -57,12 +63,18 @@ class Job(ormar.Model):
 class WQEntry(ormar.Model):
     class Meta(BaseMeta):
         tablename = "workqueue"
+        constraints = [
+            ormar.IndexColumns("state", name="ix_workqueue_state"),
+            ormar.IndexColumns("lease", name="ix_workqueue_lease"),
+        ]
 
     id: int = ormar.Integer(primary_key=True)
     job: Job = ormar.ForeignKey(Job)  # type: ignore
     when: dt = ormar.DateTime(server_default=func.now())
     state: WQStateEnum = ormar.Enum(enum_class=WQStateEnum)
-
-
-Job.Meta.table.create(engine, checkfirst=True)
-WQEntry.Meta.table.create(engine, checkfirst=True)
+    priority: int = ormar.Integer(default=0)
+    # times the entry was handed to a worker.
+    attempts: int = ormar.Integer(default=0)
+    worker: Optional[str] = ormar.String(max_length=1024, nullable=True)
+    lease: Optional[str] = ormar.String(max_length=64, nullable=True)
+    lease_expires: Optional[dt] = ormar.DateTime(nullable=True)
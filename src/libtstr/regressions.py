@@ -0,0 +1,215 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+# pyright: reportUnknownMemberType=false
+
+from datetime import datetime as dt
+from statistics import median
+from typing import Dict, List, NamedTuple, Set, Tuple
+from fastapi.logger import logger
+from pydantic import BaseModel, Field
+import sqlalchemy
+
+from libtstr.benchmark import Result
+from libtstr.benchstats import mann_whitney_less
+from libtstr.db import database, writes
+from libtstr.events import Event, EventBus, EventTypeEnum
+from libtstr.orm import bench as orm
+
+
+class RegressionConfig(BaseModel):
+    enabled: bool = Field(default=True)
+    # The most recent results for a benchmark shape are compared with the
+    # ones right before them.
+    recent_window: int = Field(default=5)
+    baseline_window: int = Field(default=20)
+    # Don't judge shapes without enough history.
+    min_baseline: int = Field(default=10)
+    # A drop is a regression if it's significant, and big enough to care.
+    max_p_value: float = Field(default=0.01)
+    min_change: float = Field(default=0.05)
+
+
+# workload, objsize, threads.
+Shape = Tuple[str, str, int]
+
+
+class _Candidate(NamedTuple):
+    regression: orm.Regression
+    # the results it was found comparing, newest first.
+    window: List[int]
+
+
+class RegressionDetector:
+    """
+    Looks for performance regressions whenever benchmark results are added,
+    in each op's ops/sec and bytes/sec. The latest results for a benchmark
+    shape are ranked against the results before them; a significant drop in
+    the median is recorded, and published as an event.
+    """
+
+    METRICS = ("ops_per_sec", "bytes_per_sec")
+
+    _config: RegressionConfig
+    _events: EventBus
+
+    def __init__(self, config: RegressionConfig, events: EventBus) -> None:
+        self._config = config
+        self._events = events
+
+    async def check(self, results: List[Result]) -> List[orm.Regression]:
+        """Check the benchmark shapes of newly added results."""
+        if not self._config.enabled:
+            return []
+
+        shapes: Set[Shape] = {
+            (r.details.workload, r.details.objsize, r.threads) for r in results
+        }
+        candidates: List[_Candidate] = []
+        for shape in sorted(shapes):
+            candidates.extend(await self._check_shape(shape))
+
+        if len(candidates) == 0:
+            return []
+        found = await writes.submit(lambda: self._record(candidates))
+        for regression in found:
+            logger.info(
+                f"regression in {regression.workload}/{regression.objsize}/"
+                f"{regression.threads} {regression.op} {regression.metric}: "
+                f"{regression.change:+.1%} at result {regression.result.id}"
+            )
+            self._publish(regression)
+        return found
+
+    async def _check_shape(self, shape: Shape) -> List[_Candidate]:
+        workload, objsize, threads = shape
+        window = self._config.recent_window + self._config.baseline_window
+        results = orm.Result.Meta.table
+        ops = orm.OpResult.Meta.table
+
+        # newest first.
+        rows = await database.fetch_all(
+            sqlalchemy.select(results.c.id)
+            .where(
+                (results.c.workload == workload)
+                & (results.c.objsize == objsize)
+                & (results.c.threads == threads)
+            )
+            .order_by(results.c.date.desc(), results.c.id.desc())
+            .limit(window)
+        )
+        ids: List[int] = [row["id"] for row in rows]
+        if len(ids) < self._config.recent_window + self._config.min_baseline:
+            return []
+
+        series: Dict[str, Dict[int, Dict[str, float]]] = {}
+        for row in await database.fetch_all(
+            sqlalchemy.select(ops).where(ops.c.result.in_(ids))
+        ):
+            values = series.setdefault(row["name"], {})
+            values[row["result"]] = {m: float(row[m]) for m in self.METRICS}
+
+        # Results up to a flagged regression are no baseline for the ones
+        # after it, or we'd keep flagging the same drop.
+        flagged: Dict[Tuple[str, str], int] = {}
+        for regression in await orm.Regression.objects.filter(
+            (orm.Regression.workload == workload)
+            & (orm.Regression.objsize == objsize)
+            & (orm.Regression.threads == threads)
+            & (orm.Regression.result.id << ids)
+        ).all():
+            key = (regression.op, regression.metric)
+            pos = ids.index(regression.result.id)
+            flagged[key] = min(flagged.get(key, pos), pos)
+
+        found: List[_Candidate] = []
+        for op, values in sorted(series.items()):
+            for metric in self.METRICS:
+                window_ids = [
+                    i
+                    for i in ids[: flagged.get((op, metric), len(ids))]
+                    if i in values
+                ]
+                recent_ids = window_ids[: self._config.recent_window]
+                baseline_ids = window_ids[self._config.recent_window :]
+                if (
+                    len(recent_ids) < self._config.recent_window
+                    or len(baseline_ids) < self._config.min_baseline
+                ):
+                    continue
+
+                base = [values[i][metric] for i in baseline_ids]
+                new = [values[i][metric] for i in recent_ids]
+                base_median = median(base)
+                new_median = median(new)
+                if base_median <= 0:
+                    continue
+                change = new_median / base_median - 1
+                if change > -self._config.min_change:
+                    continue
+                p_value = mann_whitney_less(base, new)
+                if p_value > self._config.max_p_value:
+                    continue
+                regression = orm.Regression(
+                    result=recent_ids[0],
+                    workload=workload,
+                    objsize=objsize,
+                    threads=threads,
+                    op=op,
+                    metric=metric,
+                    baseline_median=base_median,
+                    recent_median=new_median,
+                    change=change,
+                    p_value=p_value,
+                )
+                found.append(_Candidate(regression, window_ids))
+        return found
+
+    async def _record(
+        self, candidates: List[_Candidate]
+    ) -> List[orm.Regression]:
+        """
+        Save new regressions, unless found meanwhile by someone else: an
+        already flagged regression within the results compared means the
+        drop is the same.
+        """
+        recorded: List[orm.Regression] = []
+        for regression, window in candidates:
+            exists = await orm.Regression.objects.filter(
+                (orm.Regression.workload == regression.workload)
+                & (orm.Regression.objsize == regression.objsize)
+                & (orm.Regression.threads == regression.threads)
+                & (orm.Regression.op == regression.op)
+                & (orm.Regression.metric == regression.metric)
+                & (orm.Regression.result.id << window)
+            ).exists()
+            if not exists:
+                regression.detected = dt.utcnow()
+                recorded.append(await regression.save())
+        return recorded
+
+    def _publish(self, regression: orm.Regression) -> None:
+        self._events.publish(
+            Event(
+                what=EventTypeEnum.NEW_REGRESSION,
+                data={
+                    "id": regression.id,
+                    "result": regression.result.id,
+                    "workload": regression.workload,
+                    "objsize": regression.objsize,
+                    "threads": regression.threads,
+                    "op": regression.op,
+                    "metric": regression.metric,
+                    "change": regression.change,
+                },
+            )
+        )
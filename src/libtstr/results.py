@@ -0,0 +1,41 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+from typing import List
+
+from libtstr.changelog import ChangeLog
+from libtstr.events import Event, EventBus, EventTypeEnum
+
+
+class ResultsMgr:
+    """Keeps track of benchmark results being added, and lets everyone know."""
+
+    _events: EventBus
+    # by result id.
+    _changes: ChangeLog[int]
+
+    def __init__(self, events: EventBus) -> None:
+        self._events = events
+        self._changes = ChangeLog()
+
+    def added(self, ids: List[int]) -> None:
+        """Note results that have been added."""
+        self._changes.record(ids)
+        self._events.publish(
+            Event(what=EventTypeEnum.NEW_RESULTS, data={"ids": ids})
+        )
+
+    @property
+    def version(self) -> int:
+        """Changes whenever results are added."""
+        return self._changes.revision
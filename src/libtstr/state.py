@@ -13,14 +13,22 @@
 
 import databases
 
+from libtstr.cache import ResponseCache
+from libtstr.events import EventBus
 from libtstr.gh import GithubMgr
 from libtstr.config import TstrConfig
+from libtstr.regressions import RegressionDetector
+from libtstr.results import ResultsMgr
 from libtstr.wq import WorkQueue
 
 
 class TstrState:
 
+    cache: ResponseCache
     config: TstrConfig
     database: databases.Database
+    events: EventBus
     github: GithubMgr
+    regressions: RegressionDetector
+    results: ResultsMgr
     workqueue: WorkQueue
@@ -14,12 +14,18 @@
 # pyright: reportUnknownMemberType=false
 
 import asyncio
-from datetime import datetime as dt
-from typing import List, Optional
+from datetime import datetime as dt, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
 from fastapi.logger import logger
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from databases.interfaces import Record
+import sqlalchemy
 
-from libtstr.orm.heads import Head
+from libtstr.changelog import ChangeLog
+from libtstr.db import chunked, database, last_id, row_params, writes
+from libtstr.events import Event, EventBus, EventSubscriber, EventTypeEnum
+from libtstr.orm.heads import Branch, Head
 from libtstr.orm.workqueue import (
     Job,
     JobStateEnum,
@@ -29,8 +35,25 @@ from libtstr.orm.workqueue import (
 )
 
 
+class WorkQueueConfig(BaseModel):
+    # Entries are handed to workers by descending priority. An entry's
+    # priority is the sum of its head's and its job type's priorities.
+    default_branch_priority: int = Field(default=100)
+    pull_request_priority: int = Field(default=50)
+    job_priorities: Dict[str, int] = Field(
+        default={"build": 10, "s3tests": 5, "benchmark": 0}
+    )
+    # Cancel waiting entries for heads that are no longer the tip of any
+    # open branch.
+    supersede_stale_heads: bool = Field(default=True)
+    # An entry is handed to workers at most this many times; if it fails,
+    # or its lease expires, on the last attempt, it fails for good.
+    max_attempts: int = Field(default=3)
+
+
 class WQJob(BaseModel):
     id: int
+    repo: str
     sha: str
     branch: str
     when: dt
@@ -43,18 +66,98 @@ class WQItem(BaseModel):
     job: WQJob
     when: dt
     state: str
+    priority: int
+    attempts: int
+
+
+class WQDelta(BaseModel):
+    revision: int
+    # if true, `items` are all of them, and replace what we had.
+    full: bool
+    items: List[WQItem]
+    # ids of entries that are gone, or no longer match.
+    removed: List[int]
+
+
+class WQLease(BaseModel):
+    lease: str
+    expires: dt
+    item: WQItem
+
+
+def job_what_to_str(what: JobTypeEnum) -> str:
+    if what == JobTypeEnum.BUILD:
+        return "build"
+    elif what == JobTypeEnum.S3TESTS:
+        return "s3tests"
+    elif what == JobTypeEnum.BENCHMARK:
+        return "benchmark"
+    return "unknown"
+
+
+def job_state_to_str(state: JobStateEnum) -> str:
+    if state == JobStateEnum.WAITING:
+        return "waiting"
+    elif state == JobStateEnum.RUNNING:
+        return "running"
+    elif state == JobStateEnum.FINISHED:
+        return "finished"
+    elif state == JobStateEnum.CANCELLED:
+        return "cancelled"
+    elif state == JobStateEnum.FAILED:
+        return "failed"
+    return "unknown"
+
+
+def entry_state_to_str(state: WQStateEnum) -> str:
+    if state == WQStateEnum.NEW:
+        return "new"
+    elif state == WQStateEnum.ASSIGNED:
+        return "assigned"
+    elif state == WQStateEnum.RUNNING:
+        return "running"
+    elif state == WQStateEnum.DONE:
+        return "done"
+    elif state == WQStateEnum.CANCELLED:
+        return "cancelled"
+    elif state == WQStateEnum.FAILED:
+        return "failed"
+    return "unknown"
+
+
+def entry_state_from_str(state: str) -> Optional[WQStateEnum]:
+    for s in WQStateEnum:
+        if entry_state_to_str(s) == state:
+            return s
+    return None
 
 
 class WorkQueue:
 
+    # Heads are handed to us by GithubMgr as they show up. Every so often we
+    # still go through the database, in case we missed something.
+    RECONCILE_INTERVAL: float = 60.0
+    # Workers must heartbeat before their lease expires, otherwise their
+    # entry goes back to the queue.
+    LEASE_DURATION: float = 300.0
+
+    config: WorkQueueConfig
     _jobs: List[Job]
     _wq: List[WQEntry]
+    _bus: EventBus
+    _events: EventSubscriber
+    # entries that changed, by id.
+    _changes: ChangeLog[int]
     _is_running: bool
     _task: Optional[asyncio.Task]  # type: ignore
 
-    def __init__(self) -> None:
+    def __init__(self, config: WorkQueueConfig, events: EventBus) -> None:
+        self.config = config
         self._jobs = []
         self._wq = []
+        self._bus = events
+        self._events = events.subscribe()
+        self._changes = ChangeLog()
         self._is_running = False
         self._task = None
 
@@ -64,6 +167,7 @@ class WorkQueue:
 
     async def stop(self) -> None:
         self._is_running = False
+        self._events.close()
         if self._task is not None:
             await self._task
             self._task = None
@@ -73,90 +177,588 @@ class WorkQueue:
         while self._is_running:
             logger.debug("updating workqueue")
             await self._update()
-            await asyncio.sleep(10.0)
+            if self.config.supersede_stale_heads:
+                await self._cancel_superseded()
+                await self._revive_tips()
+            await self._requeue_expired()
+            await self._wait_for_heads()
+
+    async def _wait_for_heads(self) -> None:
+        """
+        Wait until new heads are announced, or until it is time to reconcile.
+        Events already queued are drained, so a burst of new heads results in
+        a single update. Other events, our own included, are ignored.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.RECONCILE_INTERVAL
+        new_head = False
+        while not new_head:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                return
+            event = await self._events.get(timeout=timeout)
+            if event is None:
+                return
+            new_head = event.what == EventTypeEnum.NEW_HEAD
+
+        while event is not None:
+            if event.what == EventTypeEnum.NEW_HEAD:
+                logger.debug(f"new head: {event.data}")
+            event = self._events.get_nowait()
 
     async def _load(self) -> None:
         self._jobs = await Job.objects.all()
         self._wq = await WQEntry.objects.all()
 
+    def _priority(self, what: JobTypeEnum, is_pull_request: bool) -> int:
+        prio = (
+            self.config.pull_request_priority
+            if is_pull_request
+            else self.config.default_branch_priority
+        )
+        return prio + self.config.job_priorities.get(job_what_to_str(what), 0)
+
     async def _update(self) -> None:
-        # go through heads and create jobs where appropriate
-        for head in await Head.objects.all():
-            jobs = await Job.objects.all(Job.head.sha == head.sha)
-            assert len(jobs) <= 1
-            if len(jobs) > 0:
-                # job already exists, continue
-                continue
-            # create new job
-            job = Job(
-                head=head,
-                what=JobTypeEnum.BUILD,
-                state=JobStateEnum.WAITING,
-            )
-            await job.save()
-            # add wq entry
-            entry = WQEntry(
-                job=job,
-                state=WQStateEnum.NEW,
-            )
-            await entry.save()
+        # Find heads whose sha has no job yet with a single anti-join, and
+        # create their jobs and workqueue entries in one transaction. The
+        # cost of a tick depends on the number of new heads, not on how many
+        # heads we have ever seen.
+        heads = Head.Meta.table
+        branches = Branch.Meta.table
+        jobs = Job.Meta.table
+        job_heads = heads.alias("job_heads")
+
+        has_job = (
+            sqlalchemy.select(jobs.c.id)
+            .select_from(jobs.join(job_heads, jobs.c.head == job_heads.c.id))
+            .where(job_heads.c.repo == heads.c.repo)
+            .where(job_heads.c.sha == heads.c.sha)
+            .exists()
+        )
+        new_heads = (
+            sqlalchemy.select(sqlalchemy.func.min(heads.c.id))
+            .where(~has_job)
+            .group_by(heads.c.repo, heads.c.sha)
+        )
+        query = (
+            sqlalchemy.select(
+                heads.c.id,
+                heads.c.repo,
+                heads.c.sha,
+                branches.c.name,
+                branches.c.is_pull_request,
+            )
+            .select_from(heads.join(branches, heads.c.branch == branches.c.id))
+            .where(heads.c.id.in_(new_heads))
+        )
+
+        what = JobTypeEnum.BUILD
+
+        async def write() -> Tuple[List[Record], List[int]]:
+            rows = await database.fetch_all(query)
+            if len(rows) == 0:
+                return rows, []
+
+            for chunk in chunked(rows, row_params(jobs)):
+                await Job.objects.bulk_create(
+                    [
+                        Job(
+                            head=row["id"],
+                            what=what,
+                            state=JobStateEnum.WAITING,
+                        )
+                        for row in chunk
+                    ]
+                )
+
+            is_pr: Dict[int, bool] = {
+                row["id"]: row["is_pull_request"] for row in rows
+            }
+            new_jobs: List[Job] = []
+            for chunk in chunked(list(is_pr.keys())):
+                new_jobs.extend(
+                    await Job.objects.filter(Job.head.id << chunk).all()
+                )
+            wq = WQEntry.Meta.table
+            last_entry = await last_id(wq)
+            for chunk in chunked(new_jobs, row_params(wq)):
+                await WQEntry.objects.bulk_create(
+                    [
+                        WQEntry(
+                            job=job,
+                            state=WQStateEnum.NEW,
+                            priority=self._priority(
+                                job.what, is_pr[job.head.id]
+                            ),
+                        )
+                        for job in chunk
+                    ]
+                )
+            entries = await database.fetch_all(
+                sqlalchemy.select(wq.c.id).where(wq.c.id > last_entry)
+            )
+            return rows, [row["id"] for row in entries]
+
+        rows, entries = await writes.submit(write)
+        if len(entries) > 0:
+            self._entries_changed(entries, WQStateEnum.NEW)
+        for row in rows:
             logger.debug(
-                f"created job for head(name: {head.branch.name}, "
-                f"sha: {head.sha})"
+                f"created job for head(repo: {row['repo']}, "
+                f"name: {row['name']}, sha: {row['sha']})"
             )
-        pass
 
-    async def get_entries(self) -> List[WQItem]:
-        items: List[WQItem] = []
+    async def _cancel_superseded(self) -> None:
+        """
+        Cancel new entries for heads that are no longer the tip of any open
+        branch, e.g. after a force-push to a pull request, so that workers
+        don't spend time on obsolete commits.
+        """
+        heads = Head.Meta.table
+        jobs = Job.Meta.table
+        wq = WQEntry.Meta.table
 
-        def _job_what(what: JobTypeEnum) -> str:
-            if what == JobTypeEnum.BUILD:
-                return "build"
-            elif what == JobTypeEnum.S3TESTS:
-                return "s3tests"
-            elif what == JobTypeEnum.BENCHMARK:
-                return "benchmark"
-            return "unknown"
-
-        def _job_state(state: JobStateEnum) -> str:
-            if state == JobStateEnum.WAITING:
-                return "waiting"
-            elif state == JobStateEnum.RUNNING:
-                return "running"
-            elif state == JobStateEnum.FINISHED:
-                return "finished"
-            return "unknown"
-
-        def _entry_state(state: WQStateEnum) -> str:
-            if state == WQStateEnum.NEW:
-                return "new"
-            elif state == WQStateEnum.ASSIGNED:
-                return "assigned"
-            elif state == WQStateEnum.RUNNING:
-                return "running"
-            elif state == WQStateEnum.DONE:
-                return "done"
-            return "unknown"
-
-        for entry in await WQEntry.objects.all():
-            print(f"entry: {entry}")
-            await entry.job.load()
-            await entry.job.head.load()
-            await entry.job.head.branch.load()
-            items.append(
-                WQItem(
-                    id=entry.id,
-                    job=WQJob(
-                        id=entry.job.id,
-                        sha=entry.job.head.sha,
-                        branch=entry.job.head.branch.name,
-                        when=entry.job.when,
-                        what=_job_what(entry.job.what),
-                        state=_job_state(entry.job.state),
-                    ),
-                    when=entry.when,
-                    state=_entry_state(entry.state),
+        query = (
+            sqlalchemy.select(wq.c.id, wq.c.job)
+            .select_from(
+                wq.join(jobs, wq.c.job == jobs.c.id).join(
+                    heads, jobs.c.head == heads.c.id
                 )
             )
+            .where(wq.c.state == WQStateEnum.NEW)
+            .where(~_is_tip(heads))
+        )
+
+        async def write() -> List[Record]:
+            rows = await database.fetch_all(query)
+            for chunk in chunked(rows):
+                await database.execute(
+                    wq.update()
+                    .where(wq.c.id.in_([row["id"] for row in chunk]))
+                    .where(wq.c.state == WQStateEnum.NEW)
+                    .values(state=WQStateEnum.CANCELLED)
+                )
+                await Job.objects.filter(
+                    Job.id << [row["job"] for row in chunk]
+                ).update(state=JobStateEnum.CANCELLED)
+            return rows
+
+        rows = await writes.submit(write)
+        if len(rows) == 0:
+            return
+        self._entries_changed(
+            [row["id"] for row in rows], WQStateEnum.CANCELLED
+        )
+        logger.info(f"cancelled {len(rows)} entries for superseded heads")
+
+    async def _revive_tips(self) -> None:
+        """
+        Put cancelled entries back in the queue, should their heads be the
+        tip of an open branch again; e.g., once a pull request is reopened,
+        or a branch is force-pushed back to an earlier commit.
+        """
+        heads = Head.Meta.table
+        jobs = Job.Meta.table
+        wq = WQEntry.Meta.table
+
+        query = (
+            sqlalchemy.select(wq.c.id, wq.c.job)
+            .select_from(
+                wq.join(jobs, wq.c.job == jobs.c.id).join(
+                    heads, jobs.c.head == heads.c.id
+                )
+            )
+            .where(wq.c.state == WQStateEnum.CANCELLED)
+            .where(_is_tip(heads))
+        )
+
+        async def write() -> List[Record]:
+            rows = await database.fetch_all(query)
+            for chunk in chunked(rows):
+                await database.execute(
+                    wq.update()
+                    .where(wq.c.id.in_([row["id"] for row in chunk]))
+                    .values(state=WQStateEnum.NEW)
+                )
+                await Job.objects.filter(
+                    Job.id << [row["job"] for row in chunk]
+                ).update(state=JobStateEnum.WAITING)
+            return rows
+
+        rows = await writes.submit(write)
+        if len(rows) == 0:
+            return
+        self._entries_changed([row["id"] for row in rows], WQStateEnum.NEW)
+        logger.info(f"requeued {len(rows)} cancelled entries for tips")
+
+    def _entries_changed(self, ids: List[int], state: WQStateEnum) -> None:
+        """Note entries that moved to `state`, and let everyone know."""
+        self._changes.record(ids)
+        self._bus.publish(
+            Event(
+                what=EventTypeEnum.WQ_STATE,
+                data={"ids": ids, "state": entry_state_to_str(state)},
+            )
+        )
+
+    @property
+    def version(self) -> int:
+        """Changes whenever workqueue entries change."""
+        return self._changes.revision
+
+    async def get_entries(
+        self,
+        limit: Optional[int] = None,
+        cursor: Optional[int] = None,
+        states: Optional[List[WQStateEnum]] = None,
+    ) -> List[WQItem]:
+        """
+        Obtain workqueue entries, ordered by id, along with their jobs, heads
+        and branches in a single joined query. Only entries after `cursor`
+        (an entry id) are returned, optionally restricted to `states` and at
+        most `limit` entries.
+        """
+        items: List[WQItem] = []
+
+        query = WQEntry.objects.select_related("job__head__branch")
+        if cursor is not None:
+            query = query.filter(WQEntry.id > cursor)
+        if states is not None and len(states) > 0:
+            query = query.filter(WQEntry.state << states)
+        query = query.order_by(WQEntry.id.asc())
+        if limit is not None:
+            query = query.limit(limit)
+
+        for entry in await query.all():
+            items.append(_entry_to_item(entry))
 
         return items
+
+    async def get_entries_since(
+        self, revision: int, states: Optional[List[WQStateEnum]] = None
+    ) -> WQDelta:
+        """
+        Obtain the entries that changed after `revision`. Changed entries no
+        longer in `states` are reported as removed. Should we not know what
+        changed since then, all entries are returned instead, as a full
+        resync.
+        """
+        current = self.version
+        changed = self._changes.changed_since(revision)
+        if changed is None:
+            return WQDelta(
+                revision=current,
+                full=True,
+                items=await self.get_entries(states=states),
+                removed=[],
+            )
+
+        found: Dict[int, WQEntry] = {}
+        for chunk in chunked(changed):
+            query = WQEntry.objects.select_related("job__head__branch").filter(
+                WQEntry.id << chunk
+            )
+            for entry in await query.all():
+                found[entry.id] = entry
+
+        items: List[WQItem] = []
+        removed: List[int] = []
+        for entry_id in sorted(changed):
+            entry = found.get(entry_id)
+            if entry is None or (
+                states is not None
+                and len(states) > 0
+                and entry.state not in states
+            ):
+                removed.append(entry_id)
+            else:
+                items.append(_entry_to_item(entry))
+        return WQDelta(
+            revision=current, full=False, items=items, removed=removed
+        )
+
+    async def _release(self, rows: List[Record]) -> Tuple[List[int], List[int]]:
+        """
+        Release the leases on entries, given their `id`, `job` and
+        `attempts`. Entries with attempts left go back in the queue, and the
+        others fail, along with their jobs. Must be called from a write.
+        Returns the ids of the entries requeued, and of those failed.
+        """
+        requeued: List[int] = []
+        failed: List[int] = []
+        for row in rows:
+            if row["attempts"] < self.config.max_attempts:
+                requeued.append(row["id"])
+            else:
+                failed.append(row["id"])
+
+        wq = WQEntry.Meta.table
+        jobs: Dict[int, int] = {row["id"]: row["job"] for row in rows}
+        for ids, state, job_state in [
+            (requeued, WQStateEnum.NEW, JobStateEnum.WAITING),
+            (failed, WQStateEnum.FAILED, JobStateEnum.FAILED),
+        ]:
+            for chunk in chunked(ids):
+                await database.execute(
+                    wq.update()
+                    .where(wq.c.id.in_(chunk))
+                    .values(
+                        state=state,
+                        worker=None,
+                        lease=None,
+                        lease_expires=None,
+                    )
+                )
+                await Job.objects.filter(
+                    Job.id << [jobs[i] for i in chunk]
+                ).update(state=job_state)
+        return requeued, failed
+
+    def _released(self, requeued: List[int], failed: List[int]) -> None:
+        if len(requeued) > 0:
+            self._entries_changed(requeued, WQStateEnum.NEW)
+        if len(failed) > 0:
+            self._entries_changed(failed, WQStateEnum.FAILED)
+            logger.info(f"entries {failed} failed, out of attempts")
+
+    async def _requeue_expired(self) -> None:
+        """
+        Put entries whose lease has expired back in the queue, unless they
+        are out of attempts.
+        """
+        wq = WQEntry.Meta.table
+
+        async def write() -> Tuple[List[int], List[int]]:
+            rows = await database.fetch_all(
+                sqlalchemy.select(wq.c.id, wq.c.job, wq.c.attempts).where(
+                    _lease_expired(wq)
+                )
+            )
+            return await self._release(rows)
+
+        requeued, failed = await writes.submit(write)
+        self._released(requeued, failed)
+        if len(requeued) > 0:
+            logger.info(f"requeued {len(requeued)} entries with expired leases")
+
+    async def _get_leased(self, lease: str) -> Optional[WQEntry]:
+        return await WQEntry.objects.select_related(
+            "job__head__branch"
+        ).get_or_none(WQEntry.lease == lease)
+
+    async def claim(
+        self, worker: str, repos: Optional[List[str]] = None
+    ) -> Optional[WQLease]:
+        """
+        Atomically assign the highest priority available entry to `worker`,
+        oldest first, optionally only for heads of `repos`. Entries are
+        available if they are new, or if their lease expired, and they have
+        attempts left. The candidate is selected and assigned by a single
+        UPDATE statement, tagged with a fresh lease token we then use to find
+        out which entry we got. Writes are serialized, so no other claim can
+        take the candidate from under us.
+        """
+        wq = WQEntry.Meta.table
+        jobs = Job.Meta.table
+        heads = Head.Meta.table
+
+        token = uuid4().hex
+        expires = dt.utcnow() + timedelta(seconds=self.LEASE_DURATION)
+        available = sqlalchemy.and_(
+            sqlalchemy.or_(wq.c.state == WQStateEnum.NEW, _lease_expired(wq)),
+            wq.c.attempts < self.config.max_attempts,
+        )
+        candidate = sqlalchemy.select(wq.c.id).where(available)
+        if repos is not None:
+            candidate = candidate.select_from(
+                wq.join(jobs, wq.c.job == jobs.c.id).join(
+                    heads, jobs.c.head == heads.c.id
+                )
+            ).where(heads.c.repo.in_(repos))
+        candidate = (
+            candidate.order_by(wq.c.priority.desc(), wq.c.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        update = (
+            wq.update()
+            .where(wq.c.id == candidate)
+            .where(available)
+            .values(
+                state=WQStateEnum.ASSIGNED,
+                worker=worker,
+                lease=token,
+                lease_expires=expires,
+                attempts=wq.c.attempts + 1,
+            )
+        )
+
+        async def write() -> Optional[WQEntry]:
+            await database.execute(update)
+            entry = await self._get_leased(token)
+            # the job of an expired lease we took over starts over.
+            if entry is not None and entry.job.state != JobStateEnum.WAITING:
+                entry.job.state = JobStateEnum.WAITING
+                await entry.job.update(_columns=["state"])
+            return entry
+
+        entry = await writes.submit(write)
+        if entry is not None:
+            self._entries_changed([entry.id], WQStateEnum.ASSIGNED)
+            logger.info(f"assigned entry {entry.id} to worker {worker}")
+            return WQLease(
+                lease=token, expires=expires, item=_entry_to_item(entry)
+            )
+
+        return None
+
+    async def heartbeat(self, lease: str) -> Optional[WQLease]:
+        """
+        Extend a lease, marking its entry and job as running. Returns None if
+        the lease is no longer held.
+        """
+        wq = WQEntry.Meta.table
+        expires = dt.utcnow() + timedelta(seconds=self.LEASE_DURATION)
+
+        # whether the entry just started running. Writes are serialized, so
+        # the entry can't change under us between finding it and updating it.
+        async def write() -> Optional[Tuple[WQEntry, bool]]:
+            row = await database.fetch_one(
+                sqlalchemy.select(wq.c.id, wq.c.state)
+                .where(wq.c.lease == lease)
+                .where(_is_leased(wq))
+                .where(wq.c.lease_expires >= dt.utcnow())
+            )
+            if row is None:
+                return None
+            await database.execute(
+                wq.update()
+                .where(wq.c.id == row["id"])
+                .values(state=WQStateEnum.RUNNING, lease_expires=expires)
+            )
+            entry = await WQEntry.objects.select_related(
+                "job__head__branch"
+            ).get(WQEntry.id == row["id"])
+            started = row["state"] == WQStateEnum.ASSIGNED
+            if started:
+                entry.job.state = JobStateEnum.RUNNING
+                await entry.job.update(_columns=["state"])
+            return entry, started
+
+        res = await writes.submit(write)
+        if res is None:
+            return None
+        entry, started = res
+        if started:
+            self._entries_changed([entry.id], WQStateEnum.RUNNING)
+        return WQLease(lease=lease, expires=expires, item=_entry_to_item(entry))
+
+    async def complete(self, lease: str) -> Optional[WQItem]:
+        """
+        Mark a leased entry as done, and its job as finished, releasing the
+        lease. Returns None if the lease is no longer held.
+        """
+        wq = WQEntry.Meta.table
+
+        # Writes are serialized, so the entry can't change under us between
+        # finding it and updating it.
+        async def write() -> Optional[WQEntry]:
+            entry_id = await database.fetch_val(
+                sqlalchemy.select(wq.c.id)
+                .where(wq.c.lease == lease)
+                .where(_is_leased(wq))
+                .where(wq.c.lease_expires >= dt.utcnow())
+            )
+            if entry_id is None:
+                return None
+            await database.execute(
+                wq.update()
+                .where(wq.c.id == entry_id)
+                .values(state=WQStateEnum.DONE, lease=None, lease_expires=None)
+            )
+            entry = await WQEntry.objects.select_related(
+                "job__head__branch"
+            ).get(WQEntry.id == entry_id)
+            entry.job.state = JobStateEnum.FINISHED
+            await entry.job.update(_columns=["state"])
+            return entry
+
+        entry = await writes.submit(write)
+        if entry is None:
+            return None
+        self._entries_changed([entry.id], WQStateEnum.DONE)
+        logger.info(f"entry {entry.id} done by worker {entry.worker}")
+        return _entry_to_item(entry)
+
+    async def fail(self, lease: str, reason: str) -> Optional[WQItem]:
+        """
+        Give up a leased entry because its work failed, putting it back in
+        the queue, unless it is out of attempts, in which case it fails for
+        good, along with its job. Returns None if the lease is no longer
+        held.
+        """
+        wq = WQEntry.Meta.table
+
+        async def write() -> Optional[Tuple[WQEntry, List[int], List[int]]]:
+            row = await database.fetch_one(
+                sqlalchemy.select(wq.c.id, wq.c.job, wq.c.attempts)
+                .where(wq.c.lease == lease)
+                .where(_is_leased(wq))
+                .where(wq.c.lease_expires >= dt.utcnow())
+            )
+            if row is None:
+                return None
+            requeued, failed = await self._release([row])
+            entry = await WQEntry.objects.select_related(
+                "job__head__branch"
+            ).get(WQEntry.id == row["id"])
+            return entry, requeued, failed
+
+        res = await writes.submit(write)
+        if res is None:
+            return None
+        entry, requeued, failed = res
+        logger.info(
+            f"entry {entry.id} failed on attempt {entry.attempts}: {reason}"
+        )
+        self._released(requeued, failed)
+        return _entry_to_item(entry)
+
+
+def _is_tip(heads: sqlalchemy.Table) -> sqlalchemy.sql.ColumnElement:
+    """Whether a head's sha is the current head of an open branch."""
+    branches = Branch.Meta.table
+    return (
+        sqlalchemy.select(branches.c.id)
+        .where(branches.c.repo == heads.c.repo)
+        .where(branches.c.tip == heads.c.sha)
+        .where(branches.c.is_closed.is_(False))
+        .exists()
+    )
+
+
+def _is_leased(wq: sqlalchemy.Table) -> sqlalchemy.sql.ColumnElement:
+    return wq.c.state.in_([WQStateEnum.ASSIGNED, WQStateEnum.RUNNING])
+
+
+def _lease_expired(wq: sqlalchemy.Table) -> sqlalchemy.sql.ColumnElement:
+    return sqlalchemy.and_(_is_leased(wq), wq.c.lease_expires < dt.utcnow())
+
+
+def _entry_to_item(entry: WQEntry) -> WQItem:
+    return WQItem(
+        id=entry.id,
+        job=WQJob(
+            id=entry.job.id,
+            repo=entry.job.head.repo,
+            sha=entry.job.head.sha,
+            branch=entry.job.head.branch.name,
+            when=entry.job.when,
+            what=job_what_to_str(entry.job.what),
+            state=job_state_to_str(entry.job.state),
+        ),
+        when=entry.when,
+        state=entry_state_to_str(entry.state),
+        priority=entry.priority,
+        attempts=entry.attempts,
+    )
@@ -0,0 +1,57 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# pyright: reportUnknownMemberType=false
+
+import asyncio
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+import pytest
+
+from libtstr.config import TstrConfig
+from libtstr.db import configure_database, database
+from libtstr.migrations import migrate
+
+Run = Callable[[Callable[[], Awaitable[Any]]], Any]
+
+
+@pytest.fixture
+def config(tmp_path: Path) -> TstrConfig:
+    """A configuration with a fresh, migrated, database."""
+    config = TstrConfig.parse_obj(
+        {
+            "gh": {"token": "token", "repos": ["org/repo"]},
+            "access_token": "secret",
+            "db": {"url": f"sqlite:///{tmp_path.joinpath('tstr.db')}"},
+        }
+    )
+    configure_database(config.db)
+    migrate(config)
+    return config
+
+
+@pytest.fixture
+def run(config: TstrConfig) -> Run:
+    """Run a coroutine function while connected to the test database."""
+
+    def _run(fn: Callable[[], Awaitable[Any]]) -> Any:
+        async def main() -> Any:
+            await database.connect()
+            try:
+                return await fn()
+            finally:
+                await database.disconnect()
+
+        return asyncio.run(main())
+
+    return _run
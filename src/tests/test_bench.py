@@ -0,0 +1,124 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# pyright: reportUnknownMemberType=false
+
+from datetime import datetime as dt
+from statistics import mean
+from typing import Any, List
+import pytest
+
+from libtstr.api import bench
+from libtstr.benchmark import OpResult, Result, WarpCmd
+from libtstr.events import EventBus
+from libtstr.regressions import RegressionConfig, RegressionDetector
+from libtstr.results import ResultsMgr
+
+
+def _result(day: int, ops_per_sec: float, threads: int = 1) -> Result:
+    return Result(
+        version="v1",
+        date=dt(2022, 1, day, 12),
+        threads=threads,
+        duration=60.0,
+        details=WarpCmd(
+            duration="1m", objects=100, objsize="4KiB", workload="mixed"
+        ),
+        ops=[
+            OpResult(
+                name="GET",
+                percent=100,
+                ops_per_sec=ops_per_sec,
+                objs_per_sec=ops_per_sec,
+                bytes_per_sec=int(ops_per_sec) * 4096,
+            )
+        ],
+    )
+
+
+def test_trends(run) -> None:
+    """Results added later are merged into the trends they belong to."""
+
+    async def test() -> None:
+        results = ResultsMgr(EventBus())
+        detector = RegressionDetector(
+            RegressionConfig(enabled=False), EventBus()
+        )
+        version = results.version
+
+        # plenty of trends, so updating them takes several chunks.
+        first = [_result(1, 10.0, threads=t) for t in range(1, 101)]
+        first.append(_result(2, 30.0))
+        await bench.add_bulk(first, results, detector)
+        assert results.version > version
+        reply = await bench.add_bulk(
+            [_result(1, 20.0, threads=t) for t in range(1, 101)]
+            + [_result(1, 60.0)],
+            results,
+            detector,
+        )
+        assert len(reply.ids) == 101
+
+        trends = await bench.get_trends(
+            workload="mixed",
+            objsize="4KiB",
+            threads=None,
+            op="GET",
+            since=None,
+            until=None,
+        )
+        assert len(trends) == 101
+        by_shape = {(t.threads, t.bucket.day): t for t in trends}
+
+        day1 = by_shape[(1, 1)]
+        assert day1.count == 3
+        values: List[float] = [10.0, 20.0, 60.0]
+        assert day1.ops_per_sec.mean == pytest.approx(mean(values))
+        assert day1.ops_per_sec.min == 10.0
+        assert day1.ops_per_sec.max == 60.0
+        assert day1.bytes_per_sec.max == 60 * 4096
+
+        day2 = by_shape[(1, 2)]
+        assert day2.count == 1
+        assert day2.ops_per_sec.mean == 30.0
+
+        for t in range(2, 101):
+            trend = by_shape[(t, 1)]
+            assert trend.count == 2
+            assert trend.ops_per_sec.mean == 15.0
+
+    run(test)
+
+
+def test_failing_regression_check(run) -> None:
+    """Results are added even if looking for regressions in them fails."""
+
+    class FailingDetector(RegressionDetector):
+        async def check(self, results: List[Result]) -> List[Any]:
+            raise RuntimeError("oops")
+
+    async def test() -> None:
+        results = ResultsMgr(EventBus())
+        detector = FailingDetector(RegressionConfig(), EventBus())
+
+        reply = await bench.add_new(_result(1, 10.0), results, detector)
+        replies = await bench.add_bulk(
+            [_result(2, 20.0), _result(3, 30.0)], results, detector
+        )
+        ids = [reply.id] + replies.ids
+        stored = await bench._get_results(
+            None, None, None, None, None, None, None, None, ["date"]
+        )
+        assert [r.id for r in stored] == ids
+
+    run(test)
@@ -0,0 +1,50 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# pyright: reportUnknownMemberType=false
+
+import asyncio
+from typing import List
+
+from libtstr.db import writes
+from libtstr.orm.heads import Branch
+
+
+def test_failing_write_in_group(run) -> None:
+    """A failing write doesn't affect the others committed in its group."""
+
+    async def test() -> None:
+        async def add(name: str, fail: bool = False) -> str:
+            await Branch(repo="org/repo", name=name, source=name).save()
+            if fail:
+                raise RuntimeError(f"failed adding {name}")
+            return name
+
+        writes.start(delay=0.05, size=100)
+        try:
+            results = await asyncio.gather(
+                writes.submit(lambda: add("a")),
+                writes.submit(lambda: add("b", fail=True)),
+                writes.submit(lambda: add("c")),
+                return_exceptions=True,
+            )
+        finally:
+            await writes.stop()
+
+        assert results[0] == "a"
+        assert isinstance(results[1], RuntimeError)
+        assert results[2] == "c"
+        names: List[str] = [b.name for b in await Branch.objects.all()]
+        assert sorted(names) == ["a", "c"]
+
+    run(test)
@@ -0,0 +1,77 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# pyright: reportUnknownMemberType=false
+
+import asyncio
+import signal
+from typing import Any, List, Optional
+from fastapi import FastAPI
+import uvicorn  # type: ignore
+
+from libtstr.api import events
+from libtstr.events import EventBus, close_on_exit
+from libtstr.state import TstrState
+
+
+def test_exit_with_streams_open() -> None:
+    """Being told to exit ends event streams, so the server can stop."""
+
+    app = FastAPI()
+    app.include_router(events.router)
+    state = TstrState()
+    state.events = EventBus()
+    app.state.tstr = state
+
+    @app.on_event("startup")  # type: ignore
+    async def on_startup() -> None:
+        close_on_exit(state.events)
+
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning")
+    )
+
+    async def test() -> Optional[bytes]:
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        port = server.servers[0].sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /events/ HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        while len(state.events._subscribers) == 0:
+            await asyncio.sleep(0.01)
+
+        signal.raise_signal(signal.SIGTERM)
+        await asyncio.wait_for(serving, timeout=5.0)
+        body = await asyncio.wait_for(reader.read(), timeout=1.0)
+        writer.close()
+        return body
+
+    # the server raises what it got again once it's done.
+    got: List[int] = []
+
+    def record(signum: int, frame: Any) -> None:
+        got.append(signum)
+
+    previous = signal.signal(signal.SIGTERM, record)
+    try:
+        body = asyncio.run(test())
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+    assert body is not None and body.startswith(b"HTTP/1.1 200")
+    assert len(state.events._subscribers) == 0
+    assert got == [signal.SIGTERM]
+    assert state.events.subscribe().is_closed
@@ -0,0 +1,234 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# pyright: reportUnknownMemberType=false
+
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from typing import Any, Iterator, List, Tuple
+from urllib.parse import urlparse
+import pytest
+import sqlalchemy
+
+from libtstr.events import EventBus
+from libtstr.gh import GithubConfig, GithubMgr, RepoSync
+from libtstr.ghclient import GithubClient, GithubError
+
+
+class FakeGithub(ThreadingHTTPServer):
+    """
+    Serves a repository with a main branch and a pull request, supporting
+    conditional requests, and keeps track of the requests it got.
+    """
+
+    replies: List[Tuple[str, int]]
+    broken: bool
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _FakeGithubHandler)
+        self.replies = []
+        self.broken = False
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, status: int) -> int:
+        return len([r for r in self.replies if r[1] == status])
+
+    def get(self, path: str) -> Any:
+        if path == "/repos/org/repo":
+            return {"default_branch": "main"}
+        elif path == "/repos/org/repo/branches/main":
+            return {"name": "main", "commit": {"sha": "a" * 40}}
+        elif path == "/repos/org/repo/pulls":
+            return [
+                {
+                    "number": 1,
+                    "state": "open",
+                    "head": {"label": "user:feature", "sha": "b" * 40},
+                    "updated_at": "2022-01-01T00:00:00Z",
+                }
+            ]
+        return None
+
+
+class _FakeGithubHandler(BaseHTTPRequestHandler):
+    server: FakeGithub
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        body = self.server.get(urlparse(self.path).path)
+        if body is None:
+            self._reply(404)
+            return
+
+        data = b"{" if self.server.broken else json.dumps(body).encode()
+        etag = f'"{hash(data):x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(304, etag)
+            return
+        self._reply(200, etag, data)
+
+    def _reply(self, status: int, etag: str = "", data: bytes = b"") -> None:
+        self.server.replies.append((self.path, status))
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def github() -> Iterator[FakeGithub]:
+    server = FakeGithub()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _config(github: FakeGithub) -> GithubConfig:
+    return GithubConfig(
+        token="token",
+        repos=["org/repo"],
+        api_url=github.url,
+        poll_interval=0.01,
+        min_poll_interval=0.01,
+        max_poll_interval=0.01,
+    )
+
+
+def test_client_errors(github: FakeGithub) -> None:
+    """Replies we can't make sense of, or don't get, are GitHub errors."""
+    client = GithubClient("token", github.url, 1)
+    github.broken = True
+    with pytest.raises(GithubError):
+        client.get("/repos/org/repo")
+
+    github.shutdown()
+    github.server_close()
+    with pytest.raises(GithubError) as e:
+        client.get("/repos/org/repo")
+    assert e.value.status is None
+
+
+def test_conditional_requests(run, github: FakeGithub) -> None:
+    """Nothing changed on GitHub costs us only 304 Not Modified replies."""
+
+    async def test() -> None:
+        mgr = GithubMgr(_config(github), EventBus())
+        await mgr._load()
+        sync: RepoSync = mgr._syncs[0]
+
+        # repo, main branch, and open pull requests.
+        assert await sync._update_heads()
+        assert github.count(200) == 3
+        heads = await mgr.get_heads()
+        assert sorted(b.name for b in heads) == ["main", "pull/1/head"]
+
+        # pull requests updated since the last sync are new to us.
+        assert await sync._update_heads()
+        assert github.count(200) == 4
+        assert github.count(304) == 2
+
+        assert not await sync._update_heads()
+        assert github.count(200) == 4
+        assert github.count(304) == 5
+        assert mgr.client.num_not_modified == 5
+
+        await mgr.stop()
+
+    run(test)
+
+
+def test_sync_survives_errors(run, github: FakeGithub) -> None:
+    """Unexpected errors don't stop a repository from being synced."""
+
+    async def test() -> None:
+        mgr = GithubMgr(_config(github), EventBus())
+        apply_heads = mgr.apply_heads
+        calls: List[int] = []
+
+        async def failing_apply_heads(*args: Any) -> None:
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise RuntimeError("oops")
+            await apply_heads(*args)
+
+        mgr.apply_heads = failing_apply_heads  # type: ignore
+        await mgr.start()
+        for _ in range(100):
+            if len(calls) > 1:
+                break
+            await asyncio.sleep(0.05)
+        await mgr.stop()
+
+        assert len(calls) > 1
+        # what we got before failing is fetched again, rather than found to
+        # be unchanged.
+        assert github.count(200) >= 6
+        heads = await mgr.get_heads()
+        assert sorted(b.name for b in heads) == ["main", "pull/1/head"]
+
+    run(test)
+
+
+def test_load_nothing(run, github: FakeGithub) -> None:
+    """Loading no branches doesn't count as a change."""
+
+    async def test() -> None:
+        mgr = GithubMgr(_config(github), EventBus())
+        await mgr._load()
+        version = mgr.version
+        assert await mgr._load_branches(sqlalchemy.false()) == []
+        assert mgr.version == version
+
+    run(test)
+
+
+def test_failed_full_sync(run, github: FakeGithub) -> None:
+    """A full sync only counts once its heads have been applied."""
+
+    async def test() -> None:
+        mgr = GithubMgr(_config(github), EventBus())
+        await mgr._load()
+        sync: RepoSync = mgr._syncs[0]
+        apply_heads = mgr.apply_heads
+
+        async def failing_apply_heads(*args: Any) -> None:
+            raise RuntimeError("oops")
+
+        mgr.apply_heads = failing_apply_heads  # type: ignore
+        with pytest.raises(RuntimeError):
+            await sync._update_heads()
+        assert sync._sync.last_full_sync is None
+        assert sync._sync.pulls_watermark is None
+
+        # the next sync is a full one again, and fetches everything again
+        # even though nothing changed on GitHub.
+        mgr.apply_heads = apply_heads  # type: ignore
+        assert await sync._update_heads()
+        assert github.count(200) == 6
+        assert sync._sync.last_full_sync is not None
+        assert sync._sync.pulls_watermark is not None
+        heads = await mgr.get_heads()
+        assert sorted(b.name for b in heads) == ["main", "pull/1/head"]
+
+    run(test)
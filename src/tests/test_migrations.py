@@ -0,0 +1,221 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# pyright: reportUnknownMemberType=false
+
+from pathlib import Path
+import sqlite3
+from typing import Any, Dict
+
+from libtstr.config import TstrConfig
+from libtstr.db import configure_database
+from libtstr.migrations import latest_version, migrate
+
+# the schema, and some data, as created before we tracked schema versions.
+BASELINE = """
+CREATE TABLE branches (
+    name VARCHAR(1024) NOT NULL,
+    source VARCHAR(1024) NOT NULL,
+    is_pull_request BOOLEAN,
+    pr_id INTEGER,
+    is_closed BOOLEAN,
+    last_update DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    PRIMARY KEY (name)
+);
+CREATE TABLE users (
+    id INTEGER NOT NULL,
+    name VARCHAR(1024) NOT NULL,
+    user VARCHAR(1024) NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (user)
+);
+CREATE TABLE hosts (
+    id INTEGER NOT NULL,
+    name VARCHAR(1024) NOT NULL,
+    cores INTEGER NOT NULL,
+    ram INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (name)
+);
+CREATE TABLE benchmark_results_ops (
+    id INTEGER NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    percent INTEGER NOT NULL,
+    ops_per_sec FLOAT NOT NULL,
+    objs_per_sec FLOAT NOT NULL,
+    bytes_per_sec INTEGER NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE TABLE benchmark_results (
+    id INTEGER NOT NULL,
+    version VARCHAR(1024) NOT NULL,
+    date DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    duration FLOAT NOT NULL,
+    threads INTEGER NOT NULL,
+    workload VARCHAR(100) NOT NULL,
+    objsize VARCHAR(100) NOT NULL,
+    num_objects INTEGER NOT NULL,
+    duration_str VARCHAR(100) NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE TABLE branch_heads (
+    id INTEGER NOT NULL,
+    sha VARCHAR(1024) NOT NULL,
+    branch VARCHAR(1024),
+    "when" DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    PRIMARY KEY (id),
+    CONSTRAINT fk_branch_heads_branches_name_branch
+        FOREIGN KEY(branch) REFERENCES branches (name)
+);
+CREATE TABLE tokens (
+    token VARCHAR(1024) NOT NULL,
+    user INTEGER,
+    host INTEGER,
+    PRIMARY KEY (token),
+    CONSTRAINT fk_tokens_users_id_user
+        FOREIGN KEY(user) REFERENCES users (id),
+    CONSTRAINT fk_tokens_hosts_id_host
+        FOREIGN KEY(host) REFERENCES hosts (id)
+);
+CREATE TABLE benchmark_result_x_ops (
+    id INTEGER NOT NULL,
+    opresult INTEGER,
+    result INTEGER,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_benchmark_result_x_ops_benchmark_results_ops_opresult_id
+        FOREIGN KEY(opresult) REFERENCES benchmark_results_ops (id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    CONSTRAINT fk_benchmark_result_x_ops_benchmark_results_result_id
+        FOREIGN KEY(result) REFERENCES benchmark_results (id)
+        ON DELETE CASCADE ON UPDATE CASCADE
+);
+CREATE TABLE jobs (
+    id INTEGER NOT NULL,
+    head INTEGER,
+    "when" DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    what VARCHAR(9) NOT NULL,
+    state VARCHAR(8) NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_jobs_branch_heads_id_head
+        FOREIGN KEY(head) REFERENCES branch_heads (id)
+);
+CREATE TABLE workqueue (
+    id INTEGER NOT NULL,
+    job INTEGER,
+    "when" DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    state VARCHAR(8) NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT fk_workqueue_jobs_id_job FOREIGN KEY(job) REFERENCES jobs (id)
+);
+
+INSERT INTO branches (name, source, is_pull_request, pr_id, is_closed)
+    VALUES ('main', 'main', 0, NULL, 0),
+           ('pull/1/head', 'user:feature', 1, 1, 0);
+INSERT INTO branch_heads (id, sha, branch)
+    VALUES (1, 'aaaa', 'main'), (2, 'bbbb', 'pull/1/head');
+INSERT INTO jobs (id, head, what, state) VALUES (1, 1, 'BUILD', 'WAITING');
+INSERT INTO workqueue (id, job, state) VALUES (1, 1, 'NEW');
+INSERT INTO benchmark_results (
+    id, version, duration, threads, workload, objsize, num_objects,
+    duration_str
+) VALUES (1, 'v1', 60.0, 4, 'mixed', '1MiB', 100, '1m');
+INSERT INTO benchmark_results_ops (
+    id, name, percent, ops_per_sec, objs_per_sec, bytes_per_sec
+) VALUES (1, 'GET', 50, 10.0, 10.0, 1000), (2, 'PUT', 50, 5.0, 5.0, 500);
+INSERT INTO benchmark_result_x_ops (id, opresult, result)
+    VALUES (1, 1, 1), (2, 2, 1);
+"""
+
+
+def _config(path: Path) -> TstrConfig:
+    return TstrConfig.parse_obj(
+        {
+            "gh": {"token": "token", "repos": ["org/repo"]},
+            "access_token": "secret",
+            "db": {"url": f"sqlite:///{path}"},
+        }
+    )
+
+
+def _schema(path: Path) -> Dict[str, Any]:
+    """
+    Each table's columns, foreign keys and indexes. Column lengths, which
+    SQLite ignores, are left out, and so are defaults, which columns added
+    by migrations need for existing rows.
+    """
+    conn = sqlite3.connect(path)
+    schema: Dict[str, Any] = {}
+    for (table,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+    ):
+        schema[table] = (
+            sorted(
+                (r[1], r[2].split("(")[0], r[3], r[5])
+                for r in conn.execute(f"PRAGMA table_info('{table}')")
+            ),
+            sorted(
+                tuple(r[2:5])
+                for r in conn.execute(f"PRAGMA foreign_key_list('{table}')")
+            ),
+            sorted(
+                r[1]
+                for r in conn.execute(f"PRAGMA index_list('{table}')")
+                if not r[1].startswith("sqlite_autoindex")
+            ),
+        )
+    conn.close()
+    return schema
+
+
+def _migrate(path: Path) -> sqlite3.Connection:
+    config = _config(path)
+    configure_database(config.db)
+    migrate(config)
+    return sqlite3.connect(path)
+
+
+def test_migrate_baseline(tmp_path: Path) -> None:
+    """A database from before versioning gets every migration, keeping data."""
+    path = tmp_path.joinpath("old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE)
+    conn.close()
+
+    conn = _migrate(path)
+    assert conn.execute("SELECT version FROM schema_version").fetchall() == [
+        (latest_version(),)
+    ]
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+    assert conn.execute(
+        "SELECT b.repo, b.name, h.repo, h.sha FROM branch_heads h "
+        "JOIN branches b ON h.branch = b.id ORDER BY h.id"
+    ).fetchall() == [
+        ("org/repo", "main", "org/repo", "aaaa"),
+        ("org/repo", "pull/1/head", "org/repo", "bbbb"),
+    ]
+    assert conn.execute(
+        "SELECT name, tip FROM branches ORDER BY id"
+    ).fetchall() == [("main", "aaaa"), ("pull/1/head", "bbbb")]
+    assert conn.execute("SELECT state FROM workqueue").fetchall() == [("NEW",)]
+    assert conn.execute(
+        "SELECT name, result FROM benchmark_results_ops ORDER BY id"
+    ).fetchall() == [("GET", 1), ("PUT", 1)]
+    conn.close()
+
+    fresh = tmp_path.joinpath("fresh.db")
+    _migrate(fresh).close()
+    assert _schema(path) == _schema(fresh)
+
+    # migrating again is a no-op.
+    _migrate(path).close()
+    assert _schema(path) == _schema(fresh)
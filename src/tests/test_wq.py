@@ -0,0 +1,222 @@
+# tstr - web-based testing framework
+# Copyright (C) 2022 SUSE LLC
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# pyright: reportUnknownMemberType=false
+
+import asyncio
+from datetime import datetime as dt, timedelta
+from typing import Dict, List, Sequence
+
+from libtstr.db import writes
+from libtstr.events import EventBus
+from libtstr.gh import GithubConfig, GithubHead, GithubMgr
+from libtstr.orm.heads import Branch, Head
+from libtstr.orm.workqueue import WQEntry
+from libtstr.wq import WorkQueue, WorkQueueConfig
+
+
+async def _queue(
+    num_heads: int, repos: Sequence[str] = ("org/repo",), max_attempts: int = 3
+) -> WorkQueue:
+    """A workqueue with an entry for each of `num_heads` new heads per repo."""
+    for repo in repos:
+        branch = Branch(repo=repo, name="main", source="main")
+        await branch.save()
+        for i in range(num_heads):
+            await Head(repo=repo, sha=f"{i:040x}", branch=branch.id).save()
+    config = WorkQueueConfig(
+        supersede_stale_heads=False, max_attempts=max_attempts
+    )
+    wq = WorkQueue(config, EventBus())
+    await wq._update()
+    return wq
+
+
+async def _expire(entry_id: int) -> None:
+    await WQEntry.objects.filter(WQEntry.id == entry_id).update(
+        lease_expires=dt.utcnow() - timedelta(seconds=1)
+    )
+
+
+def test_concurrent_claims(run) -> None:
+    """Concurrent claims are never given the same entry."""
+
+    async def test() -> None:
+        wq = await _queue(2)
+        writes.start(delay=0.01, size=100)
+        try:
+            leases = await asyncio.gather(
+                *[wq.claim(f"worker{i}") for i in range(3)]
+            )
+        finally:
+            await writes.stop()
+
+        claimed: List[int] = [l.item.id for l in leases if l is not None]
+        assert len(claimed) == 2
+        assert len(set(claimed)) == 2
+        assert await wq.claim("worker") is None
+
+    run(test)
+
+
+def test_complete_once(run) -> None:
+    """Completing releases the lease, so it can't be completed again."""
+
+    async def test() -> None:
+        wq = await _queue(1)
+        lease = await wq.claim("worker")
+        assert lease is not None
+        assert await wq.heartbeat(lease.lease) is not None
+
+        item = await wq.complete(lease.lease)
+        assert item is not None
+        assert item.state == "done"
+        assert item.job.state == "finished"
+
+        assert await wq.complete(lease.lease) is None
+        assert await wq.heartbeat(lease.lease) is None
+
+    run(test)
+
+
+def test_reclaimed_lease_starts_over(run) -> None:
+    """A job whose lease expired runs again once its entry is re-claimed."""
+
+    async def test() -> None:
+        wq = await _queue(1)
+        first = await wq.claim("worker1")
+        assert first is not None
+        lease = await wq.heartbeat(first.lease)
+        assert lease is not None
+        assert lease.item.job.state == "running"
+
+        await _expire(first.item.id)
+        second = await wq.claim("worker2")
+        assert second is not None
+        assert second.item.id == first.item.id
+        assert second.item.state == "assigned"
+        assert second.item.job.state == "waiting"
+        assert await wq.heartbeat(first.lease) is None
+
+        revision = wq.version
+        lease = await wq.heartbeat(second.lease)
+        assert lease is not None
+        assert lease.item.state == "running"
+        assert lease.item.job.state == "running"
+        delta = await wq.get_entries_since(revision)
+        assert [i.id for i in delta.items] == [second.item.id]
+
+    run(test)
+
+
+def test_fail_until_out_of_attempts(run) -> None:
+    """Failed entries are retried, until they run out of attempts."""
+
+    async def test() -> None:
+        wq = await _queue(1, max_attempts=2)
+        lease = await wq.claim("worker")
+        assert lease is not None
+        item = await wq.fail(lease.lease, "oops")
+        assert item is not None
+        assert (item.state, item.attempts) == ("new", 1)
+        assert item.job.state == "waiting"
+        assert await wq.fail(lease.lease, "oops") is None
+
+        lease = await wq.claim("worker")
+        assert lease is not None
+        item = await wq.fail(lease.lease, "oops")
+        assert item is not None
+        assert (item.state, item.attempts) == ("failed", 2)
+        assert item.job.state == "failed"
+        assert await wq.claim("worker") is None
+
+    run(test)
+
+
+def test_expire_until_out_of_attempts(run) -> None:
+    """Entries whose lease expired on their last attempt fail."""
+
+    async def test() -> None:
+        wq = await _queue(1, max_attempts=1)
+        lease = await wq.claim("worker")
+        assert lease is not None
+        await _expire(lease.item.id)
+        assert await wq.claim("worker") is None
+
+        await wq._requeue_expired()
+        entries = await wq.get_entries()
+        assert [(e.state, e.job.state) for e in entries] == [
+            ("failed", "failed")
+        ]
+
+    run(test)
+
+
+def test_claim_by_repo(run) -> None:
+    """Workers only get entries for the repositories they ask for."""
+
+    async def test() -> None:
+        wq = await _queue(1, repos=["org/repo", "org/other"])
+        assert await wq.claim("worker", ["org/unknown"]) is None
+        lease = await wq.claim("worker", ["org/other"])
+        assert lease is not None
+        assert lease.item.job.repo == "org/other"
+        assert await wq.claim("worker", ["org/other"]) is None
+        lease = await wq.claim("worker")
+        assert lease is not None
+        assert lease.item.job.repo == "org/repo"
+
+    run(test)
+
+
+def test_cancel_and_revive(run) -> None:
+    """
+    Entries are cancelled while their head isn't a branch's tip, and come
+    back should it be again.
+    """
+
+    async def test() -> None:
+        events = EventBus()
+        mgr = GithubMgr(GithubConfig(token="token", repos=["org/repo"]), events)
+        await mgr._load()
+        wq = WorkQueue(WorkQueueConfig(), events)
+
+        async def push(sha: str, state: str = "open") -> Dict[str, str]:
+            await mgr.apply_heads(
+                [
+                    GithubHead(
+                        repo="org/repo",
+                        head="pull/1/head",
+                        source="user:feature",
+                        sha=sha * 40,
+                        is_pull_request=True,
+                        id=1,
+                        state=state,
+                    )
+                ]
+            )
+            await wq._update()
+            await wq._cancel_superseded()
+            await wq._revive_tips()
+            return {e.job.sha[0]: e.state for e in await wq.get_entries()}
+
+        assert await push("a") == {"a": "new"}
+        # closed, and reopened.
+        assert await push("a", "closed") == {"a": "cancelled"}
+        assert await push("a") == {"a": "new"}
+        # force-pushed, and back.
+        assert await push("b") == {"a": "cancelled", "b": "new"}
+        assert await push("a") == {"a": "new", "b": "cancelled"}
+        await mgr.stop()
+
+    run(test)
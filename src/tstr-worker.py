@@ -13,14 +13,19 @@
 # GNU Affero General Public License for more details.
 
 import asyncio
+from datetime import datetime as dt
+import json
 import logging
 import os
 from pathlib import Path
 import signal
+import socket
 import sys
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
+import urllib.error
+import urllib.request
 import click
-from pydantic import BaseModel, parse_raw_as
+from pydantic import BaseModel, Field, parse_obj_as, parse_raw_as
 
 
 logging.basicConfig()
@@ -145,6 +150,15 @@ class Git:
         sha = (await self.get_sha()).strip()
         self.logger.debug(f"pulled latest version ({sha})")
 
+    async def checkout(self, sha: str) -> None:
+        """
+        Fetch a given commit from the repository, which may be a fork of the
+        one we cloned, and check it out.
+        """
+        await self.run(["fetch", f"https://github.com/{self.repo}", sha])
+        await self.run(["checkout", "--detach", sha])
+        self.logger.debug(f"checked out {sha}")
+
     async def get_sha(self, short: bool = False) -> str:
         """Obtain repository's HEAD sha256"""
         lst: List[str] = ["rev-parse"]
@@ -179,6 +193,8 @@ class Config(BaseModel):
     queue_url: str
     scratch_dir: Path
     token: str
+    # repositories we build, all of them ceph.git trees.
+    repos: List[str] = Field(default=["aquarist-labs/ceph"])
 
     def check_validity(self) -> None:
         if not self.scratch_dir.exists() or not self.scratch_dir.is_dir():
@@ -189,17 +205,105 @@ class Config(BaseModel):
             raise InvalidURLError()
 
 
+class WorkJob(BaseModel):
+    id: int
+    repo: str
+    sha: str
+    branch: str
+    what: str
+
+
+class WorkItem(BaseModel):
+    id: int
+    job: WorkJob
+
+
+class WorkLease(BaseModel):
+    lease: str
+    expires: dt
+    item: WorkItem
+
+
+class LeaseLostError(TstrError):
+    """Our lease on a workqueue item is no longer valid."""
+
+    pass
+
+
+class QueueClient:
+    """Talks to the tstr server's workqueue."""
+
+    config: Config
+    worker: str
+    timeout: float
+
+    def __init__(
+        self, config: Config, worker: str, timeout: float = 30.0
+    ) -> None:
+        self.config = config
+        self.worker = worker
+        self.timeout = timeout
+
+    def _post(self, ep: str, body: Dict[str, Any]) -> Any:
+        req = urllib.request.Request(
+            f"{self.config.queue_url}/api/wq/{ep}",
+            data=json.dumps(body).encode("utf-8"),
+            headers={
+                "Content-Type": "application/json",
+                "X-Token": self.config.token,
+            },
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as res:
+                return json.loads(res.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise LeaseLostError(msg=f"lost lease on '{ep}'")
+            raise TstrError(msg=f"error on '{ep}': {e}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise TstrError(msg=f"unable to reach server on '{ep}': {e}")
+
+    async def _request(self, ep: str, body: Dict[str, Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._post, ep, body)
+
+    async def claim(self) -> Optional[WorkLease]:
+        """Claim the next available work item, if any."""
+        res = await self._request(
+            "claim", {"worker": self.worker, "repos": self.config.repos}
+        )
+        if res is None:
+            return None
+        return parse_obj_as(WorkLease, res)
+
+    async def heartbeat(self, lease: WorkLease) -> WorkLease:
+        """Extend our lease on a work item."""
+        res = await self._request("heartbeat", {"lease": lease.lease})
+        return parse_obj_as(WorkLease, res)
+
+    async def complete(self, lease: WorkLease) -> None:
+        """Report a work item as done."""
+        await self._request("complete", {"lease": lease.lease})
+
+    async def fail(self, lease: WorkLease, reason: str) -> None:
+        """Report a work item as failed."""
+        await self._request("fail", {"lease": lease.lease, "reason": reason})
+
+
 class Worker:
     """
-    Represents a worker. For now we have only one worker, which will perform
-    tasks sequentially.
+    Represents a worker. Each worker performs tasks sequentially, but any
+    number of workers may be pulling work from the same server.
     """
 
     config: Config
+    client: QueueClient
     keep_running: bool
 
     def __init__(self, config: Config) -> None:
         self.config = config
+        self.client = QueueClient(config, socket.gethostname())
         self.keep_running = True
 
     async def setup(self) -> None:
@@ -216,18 +320,66 @@ class Worker:
         loop.add_signal_handler(signal.SIGINT, _interrupt)
 
         while self.keep_running:
-            builder = CreateBuildContainer(self.config)
-            logger.info("setup builder image")
-            await builder.setup()
-            await builder.run()
-
-            logger.info("build s3gw")
-            unit = CreateS3GWContainer(self.config)
-            await unit.setup()
-            await unit.run()
-
             logger.info("request work")
-            await asyncio.sleep(5.0)
+            try:
+                lease = await self.client.claim()
+            except TstrError as e:
+                logger.error(f"unable to request work: {e}")
+                lease = None
+
+            if lease is None:
+                await asyncio.sleep(5.0)
+                continue
+
+            logger.info(
+                f"claimed item {lease.item.id} "
+                f"(branch: {lease.item.job.branch}, sha: {lease.item.job.sha})"
+            )
+            heartbeat = asyncio.create_task(self._keep_lease(lease))
+            failure: Optional[str] = None
+            try:
+                await self._do_work(lease.item.job)
+            except TstrError as e:
+                logger.error(f"unable to work on item {lease.item.id}: {e}")
+                failure = str(e)
+            finally:
+                heartbeat.cancel()
+
+            try:
+                if failure is not None:
+                    await self.client.fail(lease, failure)
+                else:
+                    await self.client.complete(lease)
+            except TstrError as e:
+                # should we have failed, the lease expires, to the same end.
+                logger.error(f"unable to report item {lease.item.id}: {e}")
+
+    async def _keep_lease(self, lease: WorkLease) -> None:
+        """Heartbeat well before our lease on a work item expires."""
+        while True:
+            interval = (lease.expires - dt.utcnow()).total_seconds() / 3
+            await asyncio.sleep(max(interval, 1.0))
+            try:
+                lease = await self.client.heartbeat(lease)
+            except LeaseLostError:
+                logger.error(f"lost lease on item {lease.item.id}")
+                return
+            except TstrError as e:
+                logger.error(f"unable to heartbeat item {lease.item.id}: {e}")
+
+    async def _do_work(self, job: WorkJob) -> None:
+        if job.what != "build":
+            raise TstrError(msg=f"unsupported job type '{job.what}'")
+
+        builder = CreateBuildContainer(self.config)
+        logger.info("setup builder image")
+        await builder.setup()
+        await builder.run()
+
+        logger.info(f"build s3gw from {job.repo} at {job.sha}")
+        unit = CreateS3GWContainer(self.config, job)
+        await unit.setup()
+        await unit.run()
 
 
 class CreateBuildContainer:
@@ -295,28 +447,28 @@ class CreateBuildContainer:
 
 class CreateS3GWContainer:
     """
-    Creates an S3GW container image for a specified branch/sha from
-    aquarist-labs/ceph.git, using the aquarist-labs/s3gw-core.git's build
-    container.
+    Creates an S3GW container image for a job's repository and sha, a
+    ceph.git, using the aquarist-labs/s3gw-core.git's build container.
     """
 
     config: Config
+    sha: str
     cephdir: Path
     ccache: Path
     git: Git
 
-    def __init__(self, cfg: Config) -> None:
+    def __init__(self, cfg: Config, job: WorkJob) -> None:
         self.config = cfg
+        self.sha = job.sha
         self.cephdir = cfg.scratch_dir.joinpath("ceph.git")
         self.ccache = self.cephdir.joinpath("build.ccache")
         self.logger = logger.getChild("s3gw-builder")
-        self.git = Git("aquarist-labs/ceph.git", self.cephdir, self.logger)
-        pass
+        self.git = Git(job.repo, self.cephdir, self.logger)
 
     async def setup(self) -> None:
         """
-        Ensure we have an aquarist-labs/ceph.git clone, and a ready to go
-        ccache.
+        Ensure we have a ceph.git clone, checked out at the job's sha, and a
+        ready to go ccache.
         """
         self.logger.debug("setup radosgw build")
         if self.cephdir.exists():
@@ -329,7 +481,7 @@ class CreateS3GWContainer:
         else:
             self.logger.debug(f"clone repository to '{self.cephdir}'.")
             await self.git.clone()
-        await self.git.update()
+        await self.git.checkout(self.sha)
 
         self.ccache.mkdir(exist_ok=True)
         ret, _, err = await run_cmd(
@@ -26,18 +26,25 @@ from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 import uvicorn  # type: ignore
 
+from libtstr.cache import ResponseCache
 from libtstr.misc import setup_logging
-from libtstr.db import database
+from libtstr.db import configure_database, database, writes
+from libtstr.events import EventBus, close_on_exit
 from libtstr.state import TstrState
 from libtstr.config import TstrConfig
+from libtstr.migrations import MigrationError, migrate
 from libtstr.wq import WorkQueue
 from libtstr.gh import GithubMgr
+from libtstr.regressions import RegressionDetector
+from libtstr.results import ResultsMgr
 
 # routers
 #
 from libtstr.api import heads
 from libtstr.api import wq
 from libtstr.api import bench
+from libtstr.api import github
+from libtstr.api import events
 
 
 api_tags = [
@@ -50,6 +57,8 @@ api_tags = [
         "description": "Branches and PR related operations.",
     },
     {"name": "benchmark", "description": "Benchmark results."},
+    {"name": "github", "description": "GitHub webhooks."},
+    {"name": "events", "description": "Live updates."},
 ]
 
 app = FastAPI(docs_url=None)
@@ -64,6 +73,8 @@ api = FastAPI(
 api.include_router(heads.router)
 api.include_router(wq.router)
 api.include_router(bench.router)
+api.include_router(github.router)
+api.include_router(events.router)
 app.mount("/api", api, name="API")
 
 app.mount("/", StaticFiles(directory="frontend/dist", html=True), name="static")
@@ -75,8 +86,14 @@ _main_task: Optional[asyncio.Task] = None
 
 async def tstr_main_task(app: FastAPI, state: TstrState) -> None:
 
-    state.github = GithubMgr(state.config.gh)
-    state.workqueue = WorkQueue()
+    state.events = EventBus()
+    close_on_exit(state.events)
+    state.github = GithubMgr(state.config.gh, state.events)
+    state.workqueue = WorkQueue(state.config.wq, state.events)
+    state.regressions = RegressionDetector(
+        state.config.regressions, state.events
+    )
+    state.results = ResultsMgr(state.events)
     await state.github.start()
     state.workqueue.start()
 
@@ -87,6 +104,8 @@ async def tstr_main_task(app: FastAPI, state: TstrState) -> None:
     logger.info("shutting down main tstr task.")
     await state.workqueue.stop()
     await state.github.stop()
+    # already closed if we were told to exit, but not necessarily otherwise.
+    state.events.close()
 
 
 @app.on_event("startup")  # type: ignore
@@ -108,11 +127,20 @@ async def on_startup():
 
     state = TstrState()
     state.config = config
+    state.cache = ResponseCache()
     state.database = database
     api.state.tstr = state
 
+    configure_database(config.db)
+    try:
+        migrate(config)
+    except MigrationError as e:
+        logger.error(f"unable to migrate database: {e}")
+        sys.exit(1)
+
     if not state.database.is_connected:
         await state.database.connect()
+    writes.start(config.db.group_commit_delay, config.db.group_commit_size)
 
     global _main_task
     _main_task = asyncio.create_task(tstr_main_task(app, state))
@@ -127,6 +155,8 @@ async def on_shutdown():
     if _main_task is not None:
         await _main_task
 
+    await writes.stop()
+
     state: TstrState = api.state.tstr
     if state.database.is_connected:
         await state.database.disconnect()